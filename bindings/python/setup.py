@@ -42,7 +42,9 @@ setup(
         "docopt",
         "aioconsole",
     ],
-    extras_require={},
+    extras_require={
+        "uvloop": ["uvloop; platform_system != 'Windows'"],
+    },
     entry_points={},
     python_requires=">=3.7",
 )
@@ -0,0 +1,91 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""pose bus between workers, resyncing after a ring overrun"""
+import os
+import struct
+
+import pytest
+
+from virtualreality.server.bus import K_GONE, PoseBus
+from virtualreality.server.channels import DEFAULT_CHANNEL
+from virtualreality.server.ring import PoseRing
+from virtualreality.server.server import Server
+
+FRAME = struct.pack("13f", *range(13)) + b"\t\r\n"
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # two workers in one process, their buses drained by hand
+    rings = [
+        PoseRing(str(tmp_path / f"bus{i}"), create=True, slot_size=1 << 12, slot_count=8) # noqa E501
+        for i in range(2)
+    ]
+    bells = [os.pipe() for _ in range(2)]
+    for r, _ in bells:
+        os.set_blocking(r, False)  # what PoseBus.start does
+    servers = []
+    for i in range(2):
+        srv = Server()
+        srv.worker = i
+        srv._bus = PoseBus(srv, i, rings, bells)
+        servers.append(srv)
+
+    yield servers
+
+    for i in rings:
+        i.close()
+
+    for r, w in bells:
+        os.close(r)
+        os.close(w)
+
+
+def _remote_keys(srv):
+    return sorted(key for _, key in srv._bus._sources)
+
+
+def test_nothing_lost_without_an_overrun(workers):
+    a, b = workers
+    ch = a.channels[DEFAULT_CHANNEL]
+    a.set_layout(ch, "h", "poser")
+    a._bus.publish_last(FRAME, "poser 1", ch)
+    b._bus._drain()
+    assert b.channels[DEFAULT_CHANNEL].udu == "h"
+    assert _remote_keys(b) == ["poser 1"]
+    assert b._bus.lost == 0
+    assert b._bus.resyncs == 0
+
+
+def test_overrun_resyncs(workers):
+    a, b = workers
+    ch = a.channels[DEFAULT_CHANNEL]
+    for i in ("poser 1", "poser 2"):
+        a.keep_last_frame(FRAME, i, ch)
+
+    b._bus._drain()
+    assert _remote_keys(b) == ["poser 1", "poser 2"]
+
+    # a burst, the layout and poser 2 leaving get overwritten
+    a.set_layout(ch, "h", "poser")
+    ch.last_frames.pop("poser 2")
+    a._bus._publish(K_GONE, ch.name, "poser 2", b"")
+    for i in range(20):
+        a._bus.publish_pose(FRAME, "poser 1", ch)
+
+    b._bus._drain()
+    assert b._bus.lost > 0
+    assert b._bus.resyncs == 1
+    assert b.channels[DEFAULT_CHANNEL].udu is None
+
+    # still waiting for the answer, no second request
+    b._bus._drain()
+    assert b._bus.resyncs == 1
+
+    a._bus._drain()  # answers
+    b._bus._drain()
+    bch = b.channels[DEFAULT_CHANNEL]
+    assert bch.udu == "h"
+    assert _remote_keys(b) == ["poser 1"]
+    assert list(bch.last_frames.values()) == [FRAME]
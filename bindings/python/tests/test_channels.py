@@ -0,0 +1,124 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""channel isolation and id line options"""
+import asyncio
+import struct
+
+import pytest
+
+from virtualreality.server.channels import DEFAULT_CHANNEL, parse_id
+from virtualreality.server.server import Server
+
+
+def _frame(n, size=13):
+    return struct.pack(f"{size}f", *([n] * size)) + b"\t\r\n"
+
+
+def test_parse_id():
+    assert parse_id(b"hello") == (b"hello", {})
+    assert parse_id(b"") == (b"", {})
+    assert parse_id(b"monitor channel=rig1 rate=30") == (
+        b"monitor", {b"channel": b"rig1", b"rate": b"30"}
+    )
+
+
+def test_parse_id_edge_cases():
+    # unknown keys are kept, the server only looks at the ones it knows
+    assert parse_id(b"hello lol=1") == (b"hello", {b"lol": b"1"})
+    # empty values, options without a value and extra spaces
+    assert parse_id(b"hello channel=") == (b"hello", {b"channel": b""})
+    assert parse_id(b"hello  channel  =x") == (b"hello", {b"": b"x"})
+    assert parse_id(b"holla udu") == (b"holla", {})
+    # only the first '=' splits, the last of a repeated key wins
+    assert parse_id(b"holla a=b=c a=d x=y") == (
+        b"holla", {b"a": b"d", b"x": b"y"}
+    )
+
+
+async def _connect(port, id_line):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(id_line + b"\n")
+    await writer.drain()
+    return reader, writer
+
+
+async def _read_all(reader, t=0.2):
+    # everything that arrives within :t: seconds
+    data = b""
+    try:
+        while True:
+            chunk = await asyncio.wait_for(reader.read(1 << 16), t)
+            if not chunk:
+                return data
+
+            data += chunk
+
+    except asyncio.TimeoutError:
+        return data
+
+
+async def _until(cond):
+    for _ in range(200):
+        if cond():
+            return
+
+        await asyncio.sleep(0.01)
+
+    raise AssertionError("timed out")
+
+
+@pytest.mark.parametrize("frame_relay", [False, True])
+def test_posers_only_reach_their_channel(frame_relay):
+    async def main():
+        srv = Server()
+        srv.frame_relay = frame_relay
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        drivers = {
+            name: await _connect(port, b"hello" + (b" channel=" + name if name else b"")) # noqa E501
+            for name in (b"rig1", b"rig2", b"")
+        }
+        # 'channel=' is the default channel
+        drivers[b"empty"] = await _connect(port, b"hello channel=")
+        await _until(lambda: len(srv._connections) == 4)
+
+        p_reader, p_writer = await _connect(port, b"holla channel=rig1 udu=h") # noqa E501
+        await _until(lambda: len(srv._connections) == 5)
+        for i in range(3):
+            p_writer.write(_frame(i))
+            await p_writer.drain()
+            await asyncio.sleep(0.01)
+
+        got = {k: await _read_all(r) for k, (r, _) in drivers.items()}
+
+        # a driver connecting later on another channel gets no snapshot
+        late = await _connect(port, b"hello channel=rig2")
+        got[b"late"] = await _read_all(late[0])
+
+        # driver messages only go to the posers of their channel
+        drivers[b"rig2"][1].write(b"rig2 says hi\n")
+        drivers[b"rig1"][1].write(b"rig1 says hi\n")
+        back = await _read_all(p_reader)
+
+        for _, w in [*drivers.values(), late, (None, p_writer)]:
+            w.close()
+
+        # empty channels close with their last connection
+        await _until(lambda: not srv._connections)
+        server.close()
+        await server.wait_closed()
+        return srv, got, back
+
+    srv, got, back = asyncio.run(main())
+    frames = b"".join(_frame(i) for i in range(3))
+    if frame_relay:
+        assert got[b"rig1"][-len(_frame(2)):] == _frame(2)
+
+    else:
+        assert got[b"rig1"] == frames
+
+    assert got[b"rig2"] == got[b""] == got[b"empty"] == got[b"late"] == b""
+    assert back == b"rig1 says hi\n"
+    assert set(srv.channels) == {DEFAULT_CHANNEL}
@@ -0,0 +1,99 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""compact frame reader, heartbeats around and between frames, compact posers changing their udu""" # noqa E501
+import asyncio
+import struct
+
+from virtualreality.server.compact import CompactCodec, CompactReader
+from virtualreality.server.heartbeat import HEARTBEAT_MSG
+from virtualreality.server.server import Server
+from virtualreality.templates.poses import ControllerState
+from virtualreality.templates.udu_templates import UduPoserTemplate
+
+
+def test_lone_heartbeat_is_counted():
+    # an idle compact driver only ever sends heartbeats
+    r = CompactReader(CompactCodec("h c c"))
+    assert r.feed(HEARTBEAT_MSG) == []
+    assert r.heartbeats == 1
+    assert r.pending() == 0
+
+
+def test_heartbeats_split_across_reads():
+    r = CompactReader(CompactCodec("h c c"))
+    data = HEARTBEAT_MSG * 3
+    for i in range(0, len(data), 5):
+        r.feed(data[i:i + 5])
+
+    assert r.heartbeats == 3
+    assert r.pending() < len(HEARTBEAT_MSG)
+
+
+def test_heartbeat_before_a_frame():
+    codec = CompactCodec("h c c")
+    r = CompactReader(codec)
+    frame = codec.encode_frame(bytes(4 * codec.values) + b"\t\r\n")
+    frames = r.feed(HEARTBEAT_MSG)
+    frames += r.feed(frame + HEARTBEAT_MSG)
+    assert len(frames) == 1
+    assert r.heartbeats == 2
+
+
+def test_udu_change_reconnects_a_compact_poser():
+    async def main():
+        srv = Server()
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        d_reader, d_writer = await asyncio.open_connection("127.0.0.1", port)
+        d_writer.write(b"hello\n")
+
+        poser = UduPoserTemplate(
+            "h c", addr="127.0.0.1", port=port, compact=True,
+            velocity=[True, False]
+        )
+        await poser._socket_init()
+        await poser._send_pose(poser._frame())
+        before = await asyncio.wait_for(d_reader.readexactly((13 + 22) * 4 + 3), 2) # noqa E501
+
+        async def no_driver(msg):
+            return None
+
+        poser._send_manager = no_driver
+        await asyncio.wait_for(poser._sync_udu("h c c"), 2)
+        id_message = poser.id_message
+
+        poser.poses[2].trigger_value = 1
+        await poser._send_pose(poser._frame())
+        after = await asyncio.wait_for(d_reader.readexactly((13 + 22 + 22) * 4 + 3), 2) # noqa E501
+
+        # the old pose connection is gone, the new one decodes 3 devices
+        for _ in range(100):
+            posers = [i for i in srv._connections.values() if i.role == 2]
+            if len(posers) == 1:
+                break
+
+            await asyncio.sleep(0.01)
+
+        codec = posers[0].codec
+        poser._manager_task.cancel()
+        for i in (poser.writer, poser._manager_writer, d_writer):
+            i.close()
+
+        server.close()
+        return before, after, id_message, codec, poser, srv.malformed_frames
+
+    before, after, id_message, codec, poser, malformed = asyncio.run(main())
+    assert before.endswith(b"\t\r\n") and after.endswith(b"\t\r\n")
+    assert " udu=h,c,c enc=q" in id_message
+    assert " udu=h,c " not in id_message
+    # velocity flags were for 2 devices, they don't carry over
+    assert poser.velocity is None
+    assert codec.device_types == ["h", "c", "c"]
+    assert malformed == 0
+
+    # drivers get float frames, the 3rd device's trigger made it through
+    values = struct.unpack("57f", after[:-3])
+    trigger = 13 + 22 + ControllerState.__slots__.index("trigger_value")
+    assert abs(values[trigger] - 1) < 1e-3
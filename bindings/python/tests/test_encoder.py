@@ -0,0 +1,95 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""whole frame encoder and the poser's switch to a new udu layout"""
+import asyncio
+import struct
+
+import pytest
+
+from virtualreality.server.server import Server
+from virtualreality.templates.encoder import FrameEncoder
+from virtualreality.templates.poses import ControllerState, Pose
+from virtualreality.templates.udu_templates import UduPoserTemplate
+
+TERMINATOR = b"\t\r\n"
+
+
+def _per_device(poses):
+    return b"".join(
+        struct.pack(f"{len(i)}f", *i.get_vals()) for i in poses
+    ) + TERMINATOR
+
+
+def test_encoder_matches_get_vals():
+    poses = [Pose(), ControllerState(), ControllerState()]
+    enc = FrameEncoder.for_poses(poses)
+    poses[0].x = 1.5
+    poses[2].trigger_value = 0.25
+    frame = enc.encode(poses)
+    assert bytes(frame) == _per_device(poses)
+
+    # the same buffer, rewritten
+    poses[1].y = -2
+    assert enc.encode(poses) is frame
+    assert bytes(frame) == _per_device(poses)
+
+
+def test_encoder_from_sizes_and_header():
+    poses = [Pose(), ControllerState()]
+    enc = FrameEncoder([13, 22], header=b"HDR")
+    frame = enc.encode(poses)
+    assert bytes(frame) == b"HDR" + _per_device(poses)
+
+
+def test_poses_that_dont_fit():
+    enc = FrameEncoder([13, 22])
+    with pytest.raises(ValueError):
+        enc.encode([Pose()])
+
+    with pytest.raises(AttributeError):
+        enc.encode([Pose(), Pose()])
+
+    with pytest.raises(ValueError):
+        FrameEncoder([13], fields=[("x", "y")])
+
+
+def test_no_malformed_frames_while_the_layout_changes():
+    async def main():
+        srv = Server()
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        poser = UduPoserTemplate(
+            "h", addr="127.0.0.1", port=port, send_delay=0.002
+        )
+        await poser._socket_init()
+        send_manager = poser._send_manager
+
+        async def slow_send_manager(msg):
+            # new layout frames have plenty of time to go out too early
+            await asyncio.sleep(0.05)
+            return await send_manager(msg)
+
+        poser._send_manager = slow_send_manager
+        send = asyncio.ensure_future(poser.send())
+        await asyncio.sleep(0.1)
+
+        await asyncio.wait_for(poser._sync_udu("h c c"), 2)
+        await asyncio.sleep(0.1)
+
+        poser.coro_keep_alive["send"].is_alive = False
+        await send
+        posers = [i for i in srv._connections.values() if i.role == 2]
+        layout = posers[0].ch.udu
+
+        poser.writer.close()
+        poser._manager_writer.close()
+        server.close()
+        return srv.malformed_frames, layout, posers[0].stats.frames_in
+
+    malformed, layout, frames_in = asyncio.run(main())
+    assert malformed == 0
+    assert layout.split(" ")[0] in ("h", "h13")
+    assert len(layout.split(" ")) == 3
+    assert frames_in > 0
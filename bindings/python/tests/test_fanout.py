@@ -0,0 +1,118 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""queue overflow policies, coalescing, urgent messages and monitor rates"""
+import asyncio
+
+import pytest
+
+from virtualreality.server.server import Server
+
+from virtualreality.server.fanout import (
+    DISCONNECT,
+    DROP_NEWEST,
+    DROP_OLDEST,
+    Decimator,
+    Subscriber,
+)
+
+
+class _Writer:
+    # stands in for an asyncio.StreamWriter
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+def _put_all(policy, msgs, maxsize=2):
+    # everything is put before the writer task gets to run once
+    async def main():
+        writer = _Writer()
+        sub = Subscriber(("test", writer, None), maxsize, policy)
+        ret = [sub.put(i) for i in msgs]
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        sub.close()
+        return sub, writer, ret
+
+    return asyncio.run(main())
+
+
+def test_drop_oldest():
+    sub, writer, ret = _put_all(DROP_OLDEST, [b"a", b"b", b"c"])
+    assert ret == [True, True, True]
+    assert sub.dropped == 1
+    assert bytes(writer.data) == b"bc"
+
+
+def test_drop_newest():
+    sub, writer, ret = _put_all(DROP_NEWEST, [b"a", b"b", b"c"])
+    assert ret == [True, True, False]
+    assert sub.dropped == 1
+    assert bytes(writer.data) == b"ab"
+
+
+def test_disconnect():
+    sub, writer, ret = _put_all(DISCONNECT, [b"a", b"b", b"c"])
+    assert ret == [True, True, False]
+    assert sub.closed
+    assert writer.closed
+    assert bytes(writer.data) == b""
+
+
+def test_keyed_messages_coalesce_and_urgent_goes_first():
+    async def main():
+        writer = _Writer()
+        sub = Subscriber(("test", writer, None), 2, DROP_OLDEST)
+        sub.put(b"a1", key="a")
+        sub.put(b"b1", key="b")
+        sub.put(b"a2", key="a")  # replaces a1 in place, nothing overflows
+        sub.put(b"!", urgent=True)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        sub.close()
+        return sub, writer
+
+    sub, writer = asyncio.run(main())
+    assert bytes(writer.data) == b"!a2b1"
+    assert sub.dropped == 1
+    assert sub.urgent_out == 1
+
+
+def test_bad_monitor_rates_use_the_default():
+    for spec in (b"rate=0", b"rate=-5", b"rate=nan", b"rate=lol"):
+        d = Decimator.from_spec(spec, default_rate=10)
+        assert d.rate == 10
+        assert d.accept("poser", now=1.0)
+        assert not d.accept("poser", now=1.05)
+
+    assert Decimator.from_spec(b"every=0").every == 1
+
+    with pytest.raises(ValueError):
+        Decimator(rate=0)
+
+
+def test_monitors_forget_sources_that_are_gone():
+    srv = Server()
+    srv._decimators = {"monitor a": Decimator(), "monitor b": Decimator(every=2)} # noqa E501
+    for i in srv._decimators.values():
+        i.accept(("1.2.3.4", 5))
+        i.accept("poser")
+
+    srv.source_gone(("1.2.3.4", 5))
+    for i in srv._decimators.values():
+        assert list(i._last) == ["poser"]
@@ -0,0 +1,206 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""stalled and silent connections, heartbeats only ever between whole frames"""
+import asyncio
+import struct
+import types
+
+from virtualreality.server import heartbeat
+from virtualreality.server.heartbeat import HEARTBEAT_MSG, HeartbeatFilter, Reaper
+from virtualreality.server.metrics import ConnectionStats
+from virtualreality.server.server import Connection, Server
+
+TERMINATOR = b"\t\r\n"
+
+
+def _cut(data, size):
+    # frames and heartbeats, fails on anything else
+    ret = []
+    pos = 0
+    while pos < len(data):
+        if data.startswith(HEARTBEAT_MSG, pos):
+            ret.append(HEARTBEAT_MSG)
+            pos += len(HEARTBEAT_MSG)
+            continue
+
+        frame = data[pos:pos + size]
+        assert frame.endswith(TERMINATOR), f"garbage at {pos}: {frame!r}"
+        ret.append(frame)
+        pos += size
+
+    return ret
+
+
+class _Sub:
+    # stands in for a fanout.Subscriber
+    def __init__(self):
+        self.size = 0
+        self.sent = []
+
+    def buffer_size(self):
+        return self.size
+
+    def put(self, msg, key=None, urgent=False):
+        self.sent.append(msg)
+        return True
+
+
+def _conn(name, hb=False):
+    conn = Connection((name, None, None), 2, None)
+    conn.stats = ConnectionStats(name, "poser")
+    conn.heartbeat = hb
+    return conn
+
+
+def _clock(monkeypatch):
+    # a fake monotonic clock, a wall clock far off from it
+    now = [1000.0]
+    monkeypatch.setattr(heartbeat, "time", types.SimpleNamespace(
+        monotonic=lambda: now[0], time=lambda: now[0] + 1e9
+    ))
+    return now
+
+
+def test_stalled_connection(monkeypatch):
+    now = _clock(monkeypatch)
+    reaper = Reaper(idle_timeout=5)
+    conn = _conn("a")
+    sub = _Sub()
+    subs = {conn.me: sub}
+
+    sub.size = 100
+    assert reaper.sweep([conn], subs) == []
+    now[0] += 4
+    sub.size = 50  # still going down
+    assert reaper.sweep([conn], subs) == []
+    now[0] += 4
+    assert reaper.sweep([conn], subs) == []
+    now[0] += 2
+    assert [c for c, _ in reaper.sweep([conn], subs)] == [conn]
+    assert reaper.stalled == 1
+
+    # an empty write buffer starts over
+    reaper.forget(conn.me)
+    sub.size = 0
+    assert reaper.sweep([conn], subs) == []
+    now[0] += 10
+    assert reaper.sweep([conn], subs) == []
+    assert sub.sent == []
+
+
+def test_silent_connection(monkeypatch):
+    now = _clock(monkeypatch)
+    reaper = Reaper(idle_timeout=5)
+    old = _conn("old client")
+    hb = _conn("hb client", hb=True)
+    for i in (old, hb):
+        i.stats.last_seen = now[0]
+
+    subs = {old.me: _Sub(), hb.me: _Sub()}
+    assert reaper.sweep([old, hb], subs) == []
+    assert subs[hb.me].sent == [HEARTBEAT_MSG]
+    assert subs[old.me].sent == []
+
+    now[0] += 6
+    assert [c for c, _ in reaper.sweep([old, hb], subs)] == [hb]
+    assert reaper.silent == 1
+    assert reaper.heartbeats_out == 1
+
+
+def test_heartbeats_between_partial_chunks():
+    async def main():
+        srv = Server()
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        dr, dw = await asyncio.open_connection("127.0.0.1", port)
+        dw.write(b"hello hb=1\n")
+        pr, pw = await asyncio.open_connection("127.0.0.1", port)
+        pw.write(b"holla\n")  # no layout, a raw stream
+        await asyncio.sleep(0.1)
+
+        reaper = Reaper(idle_timeout=5)
+        frame = struct.pack("13f", *range(13)) + TERMINATOR
+        for i in range(5):
+            # half a frame, a sweep, the other half
+            pw.write(frame[:20])
+            await pw.drain()
+            await asyncio.sleep(0.02)
+            reaper.sweep(list(srv._connections.values()), srv._subscribers)
+            await asyncio.sleep(0.02)
+            pw.write(frame[20:])
+            await pw.drain()
+            await asyncio.sleep(0.02)
+
+        data = b""
+        try:
+            while 1:
+                data += await asyncio.wait_for(dr.read(4096), 0.3)
+
+        except asyncio.TimeoutError:
+            pass
+
+        for i in (dw, pw):
+            i.close()
+
+        server.close()
+        return data, reaper.heartbeats_out
+
+    data, sent = asyncio.run(main())
+    got = _cut(data, 13 * 4 + len(TERMINATOR))
+    assert sent == 5
+    assert got.count(HEARTBEAT_MSG) == 5
+    assert len(got) > 5
+
+
+def test_heartbeat_cut_in_two_is_filtered():
+    f = HeartbeatFilter()
+    assert f.feed(b"abc\t\r\nHBE") == b"abc\t\r\n"
+    assert f.feed(b"AT\t\r\ndef\t\r\nH") == b"def\t\r\n"
+    assert f.feed(b"ello\n") == b"Hello\n"
+    assert f.heartbeats == 1
+
+
+def test_poser_reply_in_two_pieces():
+    async def main():
+        srv = Server()
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        dr, dw = await asyncio.open_connection("127.0.0.1", port)
+        dw.write(b"hello\n")
+        pr, pw = await asyncio.open_connection("127.0.0.1", port)
+        pw.write(b"holla hb=1\n")  # no layout, a raw stream
+        await asyncio.sleep(0.1)
+
+        frame = struct.pack("13f", *range(13)) + TERMINATOR
+        for i in range(3):
+            # a frame and half a heartbeat, the other half and a frame
+            pw.write(frame + HEARTBEAT_MSG[:3])
+            await pw.drain()
+            await asyncio.sleep(0.02)
+            pw.write(HEARTBEAT_MSG[3:] + frame)
+            await pw.drain()
+            await asyncio.sleep(0.02)
+
+        data = b""
+        try:
+            while 1:
+                data += await asyncio.wait_for(dr.read(4096), 0.3)
+
+        except asyncio.TimeoutError:
+            pass
+
+        poser = [i for i in srv._connections.values() if i.role == 2][0]
+        last = list(poser.ch.last_frames.values())
+
+        for i in (dw, pw):
+            i.close()
+
+        server.close()
+        return data, last, frame
+
+    data, last, frame = asyncio.run(main())
+    assert _cut(data, len(frame)) == [frame] * 6
+    assert last == [frame]
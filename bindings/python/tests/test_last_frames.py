@@ -0,0 +1,85 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""the newest frame of every poser for drivers that connect late"""
+import asyncio
+import struct
+
+import pytest
+
+from virtualreality.server.server import Server
+
+
+def _frame(n):
+    return struct.pack("13f", *([n] * 13)) + b"\t\r\n"
+
+
+async def _connect(port, id_line):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(id_line + b"\n")
+    await writer.drain()
+    return reader, writer
+
+
+async def _until(cond):
+    for _ in range(200):
+        if cond():
+            return
+
+        await asyncio.sleep(0.01)
+
+    raise AssertionError("timed out")
+
+
+async def _read_all(reader, t=0.2):
+    data = b""
+    try:
+        while True:
+            chunk = await asyncio.wait_for(reader.read(1 << 16), t)
+            if not chunk:
+                return data
+
+            data += chunk
+
+    except asyncio.TimeoutError:
+        return data
+
+
+@pytest.mark.parametrize("frame_relay", [False, True])
+def test_late_driver_gets_the_newest_frames(frame_relay):
+    async def main():
+        srv = Server()
+        srv.frame_relay = frame_relay
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        posers = [await _connect(port, b"holla udu=h") for _ in range(2)]
+        await _until(lambda: len(srv.poser_conz) == 2)
+        for n, (_, w) in enumerate(posers):
+            for i in range(3):
+                w.write(_frame(10 * n + i))
+                await w.drain()
+                await asyncio.sleep(0.01)
+
+        await _until(lambda: len(srv.channels[""].last_frames) == 2)
+
+        # one frame per poser, the newest one, nothing older
+        late = await _connect(port, b"hello")
+        got = await _read_all(late[0])
+
+        # a poser that left has no frame to send anymore
+        posers[0][1].close()
+        await _until(lambda: len(srv.channels[""].last_frames) == 1)
+        later = await _connect(port, b"hello")
+        got_later = await _read_all(later[0])
+
+        for _, w in (late, later, posers[1]):
+            w.close()
+
+        server.close()
+        await server.wait_closed()
+        return got, got_later
+
+    got, got_later = asyncio.run(main())
+    assert got == _frame(2) + _frame(12)
+    assert got_later == _frame(12)
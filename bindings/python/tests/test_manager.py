@@ -0,0 +1,144 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""manager request and reply framing, replies matched to requests in order"""
+import asyncio
+import struct
+
+import pytest
+
+from virtualreality.server.manager import (
+    IDS_ACK,
+    MANAGER_MSG_SIZE,
+    STATS_MSG,
+    ManagerRequest,
+    PlainRequestReader,
+    ReplyReader,
+    ReplyRouter,
+    RequestReader,
+    pack_reply,
+    pack_request,
+)
+from virtualreality.templates.template_base import PoserTemplateBase
+
+
+def _msg(*values):
+    # a settings manager message, any of the uint32 values can hold terminator bytes
+    vals = list(values) + [0] * (130 - len(values))
+    return struct.pack("130I", *vals) + b"\t\r\n"
+
+
+# 658697 is 0x000a0d09, '\t\r\n\x00' on the wire
+IPD_MSG = _msg(10, 658697, 10000000)
+
+
+def test_plain_messages_cut_by_size():
+    r = PlainRequestReader()
+    data = STATS_MSG + IPD_MSG + _msg(1) + STATS_MSG
+    msgs = []
+    for i in range(0, len(data), 100):
+        msgs += r.feed(data[i:i + 100])
+
+    assert msgs == [STATS_MSG, IPD_MSG, _msg(1), STATS_MSG]
+    assert r.pending() == 0
+    assert len(IPD_MSG) == MANAGER_MSG_SIZE
+
+
+def test_requests_with_ids():
+    r = RequestReader()
+    data = pack_request(7, IPD_MSG) + STATS_MSG + pack_request(8, _msg(1))
+    assert r.feed(data[:10]) == []
+    assert r.feed(data[10:]) == [(7, IPD_MSG), (None, STATS_MSG), (8, _msg(1))]
+
+
+def test_request_stream_with_a_bad_header():
+    with pytest.raises(ValueError):
+        RequestReader().feed(b"nope" + bytes(4) + _msg(1))
+
+
+def test_replies_and_report_lines():
+    r = ReplyReader()
+    data = pack_reply(3, b"2000") + b'{"conz": 1}\n' + pack_reply(4, b"-100")
+    assert r.feed(data[:5]) == []
+    assert r.feed(data[5:]) == [
+        (3, b"2000"),
+        (None, b'{"conz": 1}\n'),
+        (4, b"-100"),
+    ]
+
+
+def test_router_answers_oldest_first_per_target():
+    router = ReplyRouter()
+    a = ManagerRequest("manager a", 1)
+    b = ManagerRequest("manager b", 2)
+    c = ManagerRequest("manager a", 3)
+    router.sent("driver 1", a)
+    router.sent("driver 1", b)
+    router.sent("driver 2", c)
+    assert len(router) == 3
+
+    assert router.replied("driver 2") is c
+    assert router.replied("driver 1") is a
+    assert router.replied("driver 1") is b
+    assert router.replied("driver 1") is None
+
+    router.sent("driver 1", a)
+    router.forget("driver 1")
+    assert len(router) == 0
+
+
+def test_router_keeps_the_newest_requests():
+    router = ReplyRouter(max_pending=2)
+    reqs = [ManagerRequest("manager", i) for i in range(3)]
+    for i in reqs:
+        router.sent("driver", i)
+
+    assert router.replied("driver") is reqs[1]
+    assert router.replied("driver") is reqs[2]
+
+
+def test_lost_reply_doesnt_shift_later_ones():
+    router = ReplyRouter(timeout=5)
+    lost = ManagerRequest("manager", 1)
+    lost.t0 = 100
+    later = ManagerRequest("manager", 2)
+    later.t0 = 104
+    router.sent("driver", lost)
+    router.sent("driver", later)
+
+    # lost's reply never came, the next one is later's
+    assert router.replied("driver", now=106) is later
+    assert router.expired == 1
+    assert len(router) == 0
+
+
+def test_manager_reply_timeout():
+    async def main():
+        async def silent_server(reader, writer):
+            # knows request ids, never answers one
+            if (await reader.readline()).startswith(b"monky"):
+                writer.write(IDS_ACK)
+
+            await reader.read()
+
+        server = await asyncio.start_server(silent_server, "127.0.0.1", 0)
+        poser = PoserTemplateBase(
+            addr="127.0.0.1", port=server.sockets[0].getsockname()[1],
+            manager_timeout=0.1
+        )
+        await poser._socket_init()
+        timed_out = False
+        try:
+            await poser._send_manager(b"lol")
+
+        except asyncio.TimeoutError:
+            timed_out = True
+
+        pending = len(poser._manager_pending)
+        poser._manager_task.cancel()
+        poser.writer.close()
+        poser._manager_writer.close()
+        server.close()
+        return timed_out, pending
+
+    assert asyncio.run(main()) == (True, 0)
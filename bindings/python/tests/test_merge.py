@@ -0,0 +1,66 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""partial frames merged into full frames, one merged frame per channel"""
+import struct
+
+from virtualreality.server.channels import Channel
+from virtualreality.server.merge import FrameMerger, pack_partial_header
+from virtualreality.server.server import Server
+
+TERMINATOR = b"\t\r\n"
+
+
+def _device(value, size=13):
+    return struct.pack("%df" % size, *[value] * size)
+
+
+def _partial(slots, value):
+    return pack_partial_header(slots) + b"".join(_device(value) for _ in slots) + TERMINATOR # noqa E501
+
+
+def test_partials_patch_their_slots():
+    m = FrameMerger("h13 t13 t13")
+    assert not m.dirty
+
+    frame = m.frame()
+    assert len(frame) == 3 * 13 * 4 + len(TERMINATOR)
+    assert struct.unpack_from("f", frame, 3 * 4)[0] == 1  # r_w of the hmd
+
+    assert m.update(_partial([2], 5))
+    assert m.dirty
+    frame = m.frame()
+    assert not m.dirty
+    assert frame[2 * 13 * 4:-len(TERMINATOR)] == _device(5)
+    assert frame[13 * 4:2 * 13 * 4] != _device(5)
+
+
+def test_partials_that_dont_fit_are_rejected():
+    m = FrameMerger("h13 t13")
+    assert not m.update(_partial([5], 1))  # no such slot
+    assert not m.update(_partial([1], 1)[:-5] + TERMINATOR)  # short
+    assert not m.update(_device(1) + TERMINATOR)  # not a partial frame
+    assert m.rejected == 3
+    assert not m.dirty
+
+
+def test_one_merged_frame_per_channel():
+    srv = Server()
+    srv.merge_udu = "h13 t13"
+    srv._mergers = {}
+
+    rig = srv.channels["rig1"] = Channel("rig1")
+    a = ("poser a", None, None)
+    b = ("poser b", None, None)
+    rig.add("conz", b)
+    srv._channel_of[b] = rig
+
+    assert srv.handle_pose_frame(_partial([0], 1), a)
+    assert srv.handle_pose_frame(_partial([1], 2), b)
+
+    default = srv._mergers[""].frame()
+    rig1 = srv._mergers["rig1"].frame()
+    assert default[:13 * 4] == _device(1)
+    assert default[13 * 4:26 * 4] != _device(2)
+    assert rig1[13 * 4:26 * 4] == _device(2)
+    assert rig1[:13 * 4] != _device(1)
@@ -0,0 +1,145 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""connection counters, latency histograms and the metrics report"""
+import json
+import types
+
+import pytest
+
+from virtualreality.server import metrics
+from virtualreality.server.metrics import (
+    ConnectionStats,
+    LatencyHistogram,
+    snapshot,
+    to_json_line,
+)
+
+
+class _Clock:
+    # wall and monotonic clocks that only move when told to
+    def __init__(self, wall=1000, mono=50):
+        self.wall = wall
+        self.mono = mono
+
+    def step(self, dt, wall_step=0):
+        self.mono += dt
+        self.wall += dt + wall_step
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(metrics, "time", types.SimpleNamespace(
+        time=lambda: c.wall, monotonic=lambda: c.mono
+    ))
+    return c
+
+
+class _Sub:
+    # stands in for a fanout.Subscriber
+    def __init__(self, msgs_out=0, bytes_out=0, dropped=0):
+        self.msgs_out = msgs_out
+        self.bytes_out = bytes_out
+        self.urgent_out = 0
+        self.dropped = dropped
+
+    def __len__(self):
+        return 0
+
+    def buffer_size(self):
+        return 0
+
+
+def test_last_seen_is_wall_clock(clock):
+    s = ConnectionStats(("127.0.0.1", 1), "poser")
+    clock.step(2)
+    s.record_in(10, 1)
+    seen_at = clock.wall
+
+    # the wall clock jumps, idle time and last_seen don't
+    clock.step(0.5, wall_step=3600)
+    d = s.as_dict()
+    assert d["last_seen"] == seen_at
+    assert d["idle"] == 0.5
+    assert d["connected_for"] == 2.5 + 3600
+
+
+def test_rates_over_the_window(clock):
+    s = ConnectionStats("udp", "driver")
+    sub = _Sub()
+    s.record_in(100, 10)
+    sub.msgs_out = 30
+    clock.step(0.5)
+    assert s.as_dict(sub)["fps_in"] == 0  # window not full yet
+
+    clock.step(1.5)
+    d = s.as_dict(sub)
+    assert (d["fps_in"], d["fps_out"]) == (5, 15)
+    assert d["addr"] == "udp"
+
+
+def test_percentile():
+    h = LatencyHistogram()
+    assert h.percentile(99) == 0
+
+    for i in range(1, 101):
+        h.add(i / 1000)  # 1ms to 100ms
+
+    assert h.count == 100
+    assert h.max == 0.1
+    for p in (1, 50, 90, 99):
+        # an upper bound, within the bucket resolution
+        want = p / 1000
+        assert want <= h.percentile(p) <= want * h.RESOLUTION ** 2
+
+    assert h.percentile(100) == 0.1
+
+
+def test_tiny_samples_floor_at_a_microsecond():
+    h = LatencyHistogram()
+    h.add(0)
+    h.add(1e-9)
+    assert h.buckets == {0: 2}
+    # never more than the biggest sample
+    assert h.percentile(50) == h.max == 1e-9
+
+
+def test_merge():
+    a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i in range(1, 51):
+        a.add(i / 1000)
+        both.add(i / 1000)
+
+    for i in range(51, 201):
+        b.add(i / 1000)
+        both.add(i / 1000)
+
+    a.merge(LatencyHistogram.from_dict(json.loads(json.dumps(b.as_dict()))))
+    assert (a.buckets, a.count, a.max) == (both.buckets, both.count, both.max)
+    assert a.percentile(50) == both.percentile(50)
+
+
+def test_snapshot(clock):
+    driver = ConnectionStats(("127.0.0.1", 1), "driver")
+    posers = [ConnectionStats(("127.0.0.1", i), "poser") for i in (2, 3)]
+    for n, i in enumerate(posers):
+        i.record_in(100 * (n + 1), n + 1)
+
+    stats = {"d": driver, "p0": posers[0], "p1": posers[1]}
+    subs = {"d": _Sub(msgs_out=3, bytes_out=300, dropped=1)}
+    ret = snapshot(stats, subs)
+
+    assert ret["time"] == clock.wall
+    assert len(ret["connections"]) == 3
+    assert ret["roles"]["poser"]["connections"] == 2
+    assert ret["roles"]["poser"]["bytes_in"] == 300
+    assert ret["roles"]["poser"]["frames_in"] == 3
+    assert ret["roles"]["driver"]["frames_out"] == 3
+    assert ret["roles"]["driver"]["dropped"] == 1
+    assert ret["roles"]["manager"]["connections"] == 0
+    assert "udp" not in ret
+
+    line = to_json_line(ret)
+    assert line.endswith("\n") and line.count("\n") == 1
+    assert json.loads(line) == ret
@@ -0,0 +1,93 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""event loop backends and the low latency socket profile"""
+import asyncio
+import socket
+import sys
+import types
+
+import pytest
+
+from virtualreality.server import net
+
+
+def test_loop_factory_falls_back_to_asyncio(monkeypatch, capsys):
+    # None in sys.modules makes the import fail, installed or not
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+    assert net.loop_factory("asyncio") == (asyncio.new_event_loop, "asyncio")
+    assert net.loop_factory("auto") == (asyncio.new_event_loop, "asyncio")
+    assert capsys.readouterr().out == ""
+
+    # asked for by name, it says so
+    assert net.loop_factory("uvloop") == (asyncio.new_event_loop, "asyncio")
+    assert "uvloop is not installed" in capsys.readouterr().out
+
+
+def test_loop_factory_picks_uvloop(monkeypatch):
+    fake = types.ModuleType("uvloop")
+    fake.new_event_loop = asyncio.new_event_loop
+    monkeypatch.setitem(sys.modules, "uvloop", fake)
+    assert net.loop_factory("auto") == (fake.new_event_loop, "uvloop")
+    assert net.loop_factory("uvloop")[1] == "uvloop"
+    assert net.loop_factory("asyncio")[1] == "asyncio"
+
+
+def test_unknown_loop():
+    with pytest.raises(ValueError):
+        net.loop_factory("trio")
+
+
+def test_run_closes_its_loop(monkeypatch):
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+    loops = []
+
+    async def main():
+        loops.append(asyncio.get_running_loop())
+        return 42
+
+    assert net.run(main()) == 42
+    assert loops[0].is_closed()
+
+
+def _connected_pair():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    client = socket.create_connection(srv.getsockname())
+    conn, _ = srv.accept()
+    srv.close()
+    return client, conn
+
+
+def test_tune_socket():
+    client, conn = _connected_pair()
+    try:
+        net.tune_socket(conn, send_buffer=None)
+        assert conn.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+        net.tune_socket(client, send_buffer=8192)
+        assert client.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        sndbuf = client.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        # linux doubles what it's given, for its own bookkeeping
+        assert 8192 <= sndbuf <= 2 * 8192
+
+    finally:
+        client.close()
+        conn.close()
+
+
+def test_tune_socket_skips_what_fails():
+    set_opts = []
+
+    class _Sock:
+        # a socket that refuses SO_SNDBUF
+        def setsockopt(self, level, opt, value):
+            if opt == socket.SO_SNDBUF:
+                raise OSError("nope")
+
+            set_opts.append(opt)
+
+    net.tune_socket(None)
+    net.tune_socket(_Sock())
+    assert socket.TCP_NODELAY in set_opts
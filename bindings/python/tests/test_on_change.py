@@ -0,0 +1,64 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""change driven sending, a pose write wakes the send thread"""
+import asyncio
+
+import pytest
+
+from virtualreality.templates.templates import PoserTemplate
+from virtualreality.templates.udu_templates import UduPoserTemplate
+
+
+def _sent_after_write(poser, write):
+    sent = []
+
+    async def send_pose(msg):
+        sent.append(bytes(msg))
+
+    poser._send_pose = send_pose
+
+    async def main():
+        task = asyncio.ensure_future(poser.send())
+        await asyncio.sleep(0.05)  # the first frame goes out right away
+        first = len(sent)
+        write()
+        await asyncio.sleep(0.05)
+        poser.coro_keep_alive["send"].is_alive = False
+        await task
+        return first
+
+    first = asyncio.run(main())
+    return sent, first
+
+
+@pytest.mark.parametrize("pose_store", [False, True])
+def test_pose_write_wakes_the_sender(pose_store):
+    # no keep alives, only a change can send another frame
+    poser = UduPoserTemplate(
+        "h c", on_change=True, keep_alive_rate=None, pose_store=pose_store
+    )
+
+    def write():
+        poser.poses[1].trigger_value = 1
+
+    sent, first = _sent_after_write(poser, write)
+    assert first == 1
+    assert len(sent) == 2
+    assert sent[0] != sent[1]
+
+
+def test_controller_write_wakes_the_sender():
+    poser = PoserTemplate(on_change=True, keep_alive_rate=None)
+
+    def write():
+        poser.pose_controller_l.grip = 1
+
+    sent, first = _sent_after_write(poser, write)
+    assert (first, len(sent)) == (1, 2)
+
+
+def test_nothing_written_nothing_sent():
+    poser = UduPoserTemplate("h", on_change=True, keep_alive_rate=None)
+    sent, first = _sent_after_write(poser, lambda: None)
+    assert (first, len(sent)) == (1, 1)
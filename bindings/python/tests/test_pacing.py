@@ -0,0 +1,103 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""deadline based pacing, skipping and catching up on overruns"""
+import types
+
+import pytest
+
+from virtualreality.templates import pacing
+from virtualreality.templates.pacing import CATCH_UP, SKIP, Pacer
+
+
+def _clock(monkeypatch):
+    # a fake monotonic clock, sleeping moves it
+    now = [100.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(pacing, "time", types.SimpleNamespace(
+        monotonic=lambda: now[0], sleep=sleep
+    ))
+    return now
+
+
+def test_work_doesnt_slow_the_loop_down(monkeypatch):
+    now = _clock(monkeypatch)
+    p = Pacer(0.1)
+    for i in range(10):
+        now[0] += 0.03  # work
+        p.wait_sync()
+
+    # deadlines start at the first wait
+    assert now[0] == pytest.approx(101.03)
+    assert p.ticks == 10
+    assert p.skipped == 0
+    assert p.late.max == pytest.approx(0)
+
+
+def test_skip_drops_missed_ticks(monkeypatch):
+    now = _clock(monkeypatch)
+    p = Pacer(0.1, SKIP)
+    p.wait_sync()  # deadline 100.1
+    now[0] += 0.35  # overran 2 deadlines and then some
+    p.wait_sync()
+    assert p.skipped == 2
+    assert now[0] == pytest.approx(100.45)  # runs right away
+    assert p.late.max == pytest.approx(0.05)
+
+    p.wait_sync()  # back on the old grid
+    assert now[0] == pytest.approx(100.5)
+    assert p.ticks == 3
+
+
+def test_catch_up_runs_missed_ticks(monkeypatch):
+    now = _clock(monkeypatch)
+    p = Pacer(0.1, CATCH_UP)
+    p.wait_sync()
+    now[0] += 0.35
+    for i in range(3):
+        # 100.2, 100.3, 100.4 are all due already
+        p.wait_sync()
+        assert now[0] == pytest.approx(100.45)
+
+    p.wait_sync()
+    assert now[0] == pytest.approx(100.5)
+    assert p.skipped == 0
+    assert p.ticks == 5
+
+
+def test_catch_up_gives_up_after_a_second(monkeypatch):
+    now = _clock(monkeypatch)
+    p = Pacer(0.1, CATCH_UP)
+    p.wait_sync()
+    now[0] += 3
+    p.wait_sync()
+    assert p.skipped == 29
+    p.wait_sync()
+    assert now[0] == pytest.approx(103.2)
+
+
+def test_stats(monkeypatch):
+    now = _clock(monkeypatch)
+    p = Pacer(0.01)
+    assert p.stats()["rate_hz"] == 0
+    for i in range(100):
+        p.wait_sync()
+
+    now[0] += 0.025
+    p.wait_sync()
+    stats = p.stats()
+    assert stats["target_hz"] == 100
+    assert stats["rate_hz"] == pytest.approx(100, rel=0.05)
+    assert stats["policy"] == SKIP
+    assert stats["ticks"] == 101
+    assert stats["skipped"] == 1
+    assert stats["late_max_ms"] == pytest.approx(5)
+    assert stats["late_p50_ms"] < 0.01
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Pacer(0.1, "sometimes")
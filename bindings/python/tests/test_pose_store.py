@@ -0,0 +1,81 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""pose store views share memory with the frame, and follow udu changes"""
+import asyncio
+import struct
+
+import numpy as np
+
+from virtualreality.templates.pose_store import PoseStore
+from virtualreality.templates.poses import ControllerState, Pose
+from virtualreality.templates.udu_templates import UduPoserTemplate
+
+
+def _unpack(frame, header=b""):
+    n = (len(frame) - len(header) - 3) // 4
+    return struct.unpack_from(f"{n}f", frame, len(header))
+
+
+def test_views_write_into_the_frame():
+    store = PoseStore("h c", header=b"head")
+    frame = store.frame()
+    assert len(frame) == 4 + (13 + 22) * 4 + 3
+    assert frame.startswith(b"head") and frame.endswith(b"\t\r\n")
+
+    # defaults of the pose classes are already in the frame
+    assert list(_unpack(frame, b"head")) == Pose().get_vals() + ControllerState().get_vals() # noqa E501
+
+    store.poses[0].x = 1.5
+    store.poses[1].trigger_value = 0.25
+    assert store.values[0] == 1.5
+    assert store.values[13 + ControllerState.__slots__.index("trigger_value")] == 0.25 # noqa E501
+
+    # frame() is the store's own buffer, no copy
+    assert store.frame() is frame
+    assert _unpack(frame, b"head")[0] == 1.5
+
+
+def test_array_writes_show_up_in_the_views():
+    store = PoseStore("t t t")
+    positions = np.arange(9, dtype=np.float32).reshape(3, 3)
+    store.values[store.index("x", "y", "z")] = positions
+    assert [[p.x, p.y, p.z] for p in store.poses] == positions.tolist()
+    assert np.shares_memory(store.devices[1], store.values)
+    assert store.poses[2].get_vals()[:3] == [6, 7, 8]
+
+    # float32, what the driver gets
+    store.poses[0].x = 0.1
+    assert store.poses[0].x == np.float32(0.1)
+    assert store.poses[0].x != 0.1
+
+
+def test_index_of_controller_fields():
+    store = PoseStore("h c c")
+    field = ControllerState.__slots__.index("trigger_value")
+    idx = store.index("trigger_value", devices=[1, 2])
+    assert idx.tolist() == [[13 + field], [35 + field]]
+
+
+def test_store_follows_a_udu_change():
+    poser = UduPoserTemplate("h c", pose_store=True, keep_alive_rate=None)
+    old = poser.pose_store
+
+    async def nothing(*args):
+        return None
+
+    # no server, the manager reply and the reconnect are skipped
+    poser._send_manager = nothing
+    poser._poser_reconnect = nothing
+    asyncio.run(poser._sync_udu("h t t"))
+
+    store = poser.pose_store
+    assert store is not old
+    assert store.device_types == ["h", "t", "t"]
+    assert poser.poses is store.poses
+    assert len(poser._frame()) == 39 * 4 + 3
+
+    # the new views write into the new frame, the old store is left alone
+    poser.poses[2].y = 3
+    assert _unpack(poser._frame())[13 + 13 + 1] == 3
+    assert old.values.tolist() == Pose().get_vals() + ControllerState().get_vals() # noqa E501
@@ -0,0 +1,120 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""manager traffic ahead of queued poses, and round trip accounting"""
+import asyncio
+import struct
+import types
+
+from virtualreality.server import server as server_module
+from virtualreality.server.fanout import Subscriber
+from virtualreality.server.manager import (
+    IDS_ACK,
+    MANAGER_MSG_SIZE,
+    ManagerRequest,
+    pack_reply,
+    pack_request,
+)
+from virtualreality.server.server import Server
+
+
+class _Writer:
+    # stands in for an asyncio.StreamWriter
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+def _msg(*values):
+    vals = list(values) + [0] * (130 - len(values))
+    return struct.pack("130I", *vals) + b"\t\r\n"
+
+
+def test_reply_jumps_the_pose_queue(monkeypatch):
+    async def main():
+        srv = Server()
+        writer = _Writer()
+        me = (("127.0.0.1", 1), writer, "lol0")
+        sub = srv._subscribers[me] = Subscriber(me)
+        for i in range(3):
+            sub.put(b"pose%d" % i, key=i)
+
+        req = ManagerRequest(me, 7)
+        monkeypatch.setattr(server_module, "time", types.SimpleNamespace(
+            monotonic=lambda: req.t0 + 0.002
+        ))
+        srv.answer_manager_request(req, b"2000")
+        first = bytes(writer.data)
+
+        # only the first answer counts
+        srv.answer_manager_request(req, b"-100")
+
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        sub.close()
+        return first, bytes(writer.data), srv._manager_rtt.as_dict(), sub
+
+    first, data, rtt, sub = asyncio.run(main())
+    assert first == pack_reply(7, b"2000")
+    assert data == first + b"pose0pose1pose2"
+    assert sub.urgent_out == 1
+    assert rtt["count"] == 1
+    assert rtt["last_ms"] == 2
+    assert rtt["p50_ms"] <= 2 and rtt["max_ms"] == 2
+
+
+def test_round_trip_over_sockets():
+    async def main():
+        srv = Server()
+        server = await asyncio.start_server(srv, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        # the driver side of the settings manager, answers requests
+        d_reader, d_writer = await asyncio.open_connection("127.0.0.1", port)
+        d_writer.write(b"monky role=driver\n")
+        while not srv.channels[""].responders:
+            await asyncio.sleep(0.01)
+
+        m_reader, m_writer = await asyncio.open_connection("127.0.0.1", port)
+        m_writer.write(b"monky ids=1\n")
+        ack = await asyncio.wait_for(m_reader.readexactly(len(IDS_ACK)), 2)
+
+        m_writer.write(pack_request(5, _msg(1)))
+        request = await asyncio.wait_for(d_reader.readexactly(MANAGER_MSG_SIZE), 2) # noqa E501
+        d_writer.write(b"2000")
+        reply = await asyncio.wait_for(m_reader.readexactly(len(pack_reply(5, b"2000"))), 2) # noqa E501
+
+        # a reply nobody asked for
+        d_writer.write(b"-100")
+        for _ in range(100):
+            if srv._manager_rtt.unmatched:
+                break
+
+            await asyncio.sleep(0.01)
+
+        rtt = srv.get_stats()["manager_rtt"]
+        for i in (d_writer, m_writer):
+            i.close()
+
+        server.close()
+        await server.wait_closed()
+        return ack, request, reply, rtt
+
+    ack, request, reply, rtt = asyncio.run(main())
+    assert ack == IDS_ACK
+    assert request == _msg(1)
+    assert reply == pack_reply(5, b"2000")
+    assert (rtt["count"], rtt["unmatched"], rtt["expired"]) == (1, 1, 0)
+    assert 0 < rtt["last_ms"] < 2000
@@ -0,0 +1,154 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""callback based engine, reads split anywhere, backpressure and parity with the streams engine""" # noqa E501
+import asyncio
+import struct
+
+import pytest
+
+from virtualreality.server.protocol import ServerProtocol
+from virtualreality.server.server import Server
+
+
+class _Transport:
+    # stands in for an asyncio transport
+    def __init__(self, peer):
+        self.peer = peer
+        self.data = bytearray()
+        self.writes = 0
+        self.closed = False
+
+    def get_extra_info(self, name, default=None):
+        return self.peer if name == "peername" else default
+
+    def write(self, data):
+        self.data += data
+        self.writes += 1
+
+    def writelines(self, data):
+        self.data += b"".join(data)
+        self.writes += 1
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self):
+        return self.closed
+
+
+def _frame(n):
+    return struct.pack("13f", *([n] * 13)) + b"\t\r\n"
+
+
+def _connect(srv, peer):
+    p = ServerProtocol(srv, buffer_size=64)
+    t = _Transport(peer)
+    p.connection_made(t)
+    return p, t
+
+
+def _feed(p, data, step):
+    # what the loop does, copy into get_buffer(), then buffer_updated()
+    for i in range(0, len(data), step):
+        chunk = data[i:i + step]
+        p.get_buffer(-1)[:len(chunk)] = chunk
+        p.buffer_updated(len(chunk))
+
+
+@pytest.mark.parametrize("step", [1, 7, 40, 64])
+def test_frames_split_across_reads(step):
+    async def main():
+        srv = Server()
+        driver, driver_t = _connect(srv, ("127.0.0.1", 1))
+        _feed(driver, b"hello\n", step)
+        poser, poser_t = _connect(srv, ("127.0.0.1", 2))
+
+        frames = [_frame(i) for i in range(3)]
+        for i in frames:
+            # the id line and every frame cut up by the reads
+            _feed(poser, (b"holla udu=h\n" if i is frames[0] else b"") + i, step) # noqa E501
+
+        closed = poser_t.closed
+        poser.connection_lost(None)
+        driver.connection_lost(None)
+        return srv, bytes(driver_t.data), closed
+
+    srv, got, closed = asyncio.run(main())
+    assert got == b"".join(_frame(i) for i in range(3))
+    assert srv.malformed_frames == 0
+    assert not closed
+
+
+def test_paused_transport_gets_the_newest_frame():
+    async def main():
+        srv = Server()
+        driver, driver_t = _connect(srv, ("127.0.0.1", 1))
+        _feed(driver, b"hello\n", 64)
+        poser, _ = _connect(srv, ("127.0.0.1", 2))
+        _feed(poser, b"holla udu=h\n" + _frame(0), 64)
+
+        driver.pause_writing()
+        sub = driver._subscriber()
+        for i in range(1, 5):
+            _feed(poser, _frame(i), 64)
+
+        # nothing written while paused, older frames of the poser coalesced
+        paused = bytes(driver_t.data), len(sub._queue)
+
+        driver.resume_writing()
+        resumed = bytes(driver_t.data), driver_t.writes, sub.paused
+
+        driver.connection_lost(None)
+        poser.connection_lost(None)
+        return paused, resumed
+
+    paused, resumed = asyncio.run(main())
+    assert paused == (_frame(0), 1)
+    assert resumed == (_frame(0) + _frame(4), 2, False)
+
+
+async def _round_trip(engine):
+    # a driver and a poser over real sockets, what the driver got
+    srv = Server()
+    srv.engine = engine
+    server = await srv.start_server("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    d_reader, d_writer = await asyncio.open_connection("127.0.0.1", port)
+    d_writer.write(b"hello\n")
+    await d_writer.drain()
+    while not srv.driver_conz:
+        await asyncio.sleep(0.01)
+
+    p_reader, p_writer = await asyncio.open_connection("127.0.0.1", port)
+    p_writer.write(b"holla udu=h\n")
+    frames = [_frame(i) for i in range(5)]
+    for i in frames:
+        # every frame cut in two by the reads
+        p_writer.write(i[:20])
+        await p_writer.drain()
+        await asyncio.sleep(0.01)
+        p_writer.write(i[20:])
+        await p_writer.drain()
+        await asyncio.sleep(0.01)
+
+    got = await asyncio.wait_for(d_reader.readexactly(len(b"".join(frames))), 2) # noqa E501
+
+    # and the driver's messages go back to the poser
+    d_writer.write(b"lol\n")
+    await d_writer.drain()
+    back = await asyncio.wait_for(p_reader.readline(), 2)
+
+    p_writer.close()
+    d_writer.close()
+    server.close()
+    await server.wait_closed()
+    return got, back, srv.malformed_frames
+
+
+def test_engines_agree():
+    streams = asyncio.run(_round_trip("streams"))
+    protocol = asyncio.run(_round_trip("protocol"))
+    assert streams == protocol
+    assert streams == (b"".join(_frame(i) for i in range(5)), b"lol\n", 0)
@@ -0,0 +1,92 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""recording seek, missing and stale indexes"""
+import pytest
+
+from virtualreality.server.recording import (
+    INDEX_INTERVAL,
+    REC_MAGIC,
+    REC_POSE,
+    REC_SOURCE,
+    PoseLog,
+    PoseRecorder,
+    index_entry_t,
+    rec_header_t,
+    record_header_t,
+)
+
+
+def _write_log(path, times):
+    # a log with one pose record at every one of :times:, an index entry per
+    # INDEX_INTERVAL like PoseRecorder writes, returns the index entries
+    index = []
+    next_t = 0
+    with open(path, "wb") as f:
+        f.write(rec_header_t.pack(REC_MAGIC, 0))
+        f.write(record_header_t.pack(0, 0, REC_SOURCE, 1) + b"a")
+        for t in times:
+            if t >= next_t:
+                index.append(index_entry_t.pack(t, f.tell()))
+                next_t = t + INDEX_INTERVAL
+
+            data = b"%.2f\t\r\n" % t
+            f.write(record_header_t.pack(t, 0, REC_POSE, len(data)) + data)
+
+    with open(path + ".idx", "wb") as f:
+        f.write(b"".join(index))
+
+    return index
+
+
+TIMES = [i * 0.1 for i in range(20)]
+
+
+def test_records_from_the_middle(tmp_path):
+    path = str(tmp_path / "log")
+    _write_log(path, TIMES)
+    with PoseLog(path) as log:
+        got = [t for t, _, _, _ in log.records(start=1.05)]
+        assert got == TIMES[11:]
+        assert log.seek(1.05) <= log.seek(1.5)
+        assert log.seek(-1) == rec_header_t.size
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / "log")
+    index = _write_log(path, TIMES)
+    (tmp_path / "log.idx").unlink()
+    with PoseLog(path) as log:
+        assert len(log._times) == len(index)
+        assert [t for t, _, _, _ in log.records(start=1.05)] == TIMES[11:]
+
+
+def test_stale_index_is_extended(tmp_path):
+    # the recorder crashed, or the log was appended to, after two index entries
+    path = str(tmp_path / "log")
+    index = _write_log(path, TIMES)
+    with open(path + ".idx", "wb") as f:
+        f.write(b"".join(index[:2]) + index[2][:5])
+
+    with PoseLog(path) as log:
+        assert len(log._times) == len(index)
+        assert log.seek(1.95) == index_entry_t.unpack(index[-1])[1]
+
+
+def test_recorder_round_trip(tmp_path):
+    path = str(tmp_path / "log")
+    with PoseRecorder(path, index_interval=0) as r:
+        r.record(REC_POSE, ("poser", 1), b"frame\t\r\n")
+        r.record(REC_POSE, ("poser", 1), b"frame 2\t\r\n")
+
+    with PoseLog(path) as log:
+        got = [(kind, data) for _, _, kind, data in log.records()]
+        assert got == [(REC_POSE, b"frame\t\r\n"), (REC_POSE, b"frame 2\t\r\n")]
+        assert log.sources == {0: str(("poser", 1))}
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(bytes(64))
+    with pytest.raises(RuntimeError):
+        PoseLog(str(path))
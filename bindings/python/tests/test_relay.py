@@ -0,0 +1,45 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""frame splitting of raw pose streams"""
+import struct
+
+from virtualreality.server.relay import POSE_TERMINATOR, FrameSplitter
+
+# its little endian bytes are the terminator and one more
+FLOAT_WITH_TERMINATOR = struct.unpack("<f", POSE_TERMINATOR + b"\x3f")[0]
+
+
+def _frame(*values):
+    return struct.pack("<%df" % len(values), *values) + POSE_TERMINATOR
+
+
+def test_frames_split_across_chunks():
+    s = FrameSplitter()
+    data = _frame(1, 2, 3) + _frame(4, 5, 6)
+    frames = []
+    for i in range(0, len(data), 7):
+        frames += s.feed(data[i:i + 7])
+
+    assert frames == [_frame(1, 2, 3), _frame(4, 5, 6)]
+    assert s.pending() == 0
+
+
+def test_terminator_inside_a_float():
+    # the stream has no framing besides the terminator, such a frame comes
+    # out in two pieces that don't fit any layout, the next one is fine again
+    s = FrameSplitter()
+    bad = _frame(1, FLOAT_WITH_TERMINATOR, 3)
+    frames = s.feed(bad + _frame(4, 5, 6))
+
+    assert len(frames) == 3
+    assert b"".join(frames[:2]) == bad
+    assert frames[2] == _frame(4, 5, 6)
+
+
+def test_overflow_throws_the_buffer_away():
+    s = FrameSplitter(max_size=16)
+    assert s.feed(bytes(17)) == []
+    assert s.overflows == 1
+    assert s.pending() == 0
+    assert s.feed(_frame(1)) == [_frame(1)]
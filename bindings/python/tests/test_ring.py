@@ -0,0 +1,87 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""pose ring wrap around, readers that fall behind, producer restarts"""
+import os
+
+import pytest
+
+from virtualreality.server import ring
+from virtualreality.server.ring import PoseRing
+
+
+def _frame(n):
+    return b"frame %d\t\r\n" % n
+
+
+def test_latest_after_wrap_around(tmp_path):
+    path = str(tmp_path / "ring")
+    with PoseRing(path, create=True, slot_size=64, slot_count=4) as w, PoseRing(path) as r: # noqa E501
+        assert r.latest() is None
+        for i in range(1, 11):
+            w.publish(_frame(i))
+
+        assert r.slot_count == 4
+        assert r.latest() == (10, _frame(10))
+        assert r.latest(10) is None
+
+
+def test_since_counts_overwritten_frames(tmp_path):
+    path = str(tmp_path / "ring")
+    with PoseRing(path, create=True, slot_size=64, slot_count=4) as w, PoseRing(path) as r: # noqa E501
+        for i in range(1, 11):
+            w.publish(_frame(i))
+
+        seq, frames, lost = r.since(0)
+        assert seq == 10
+        assert frames == [_frame(i) for i in range(7, 11)]
+        assert lost == 6
+
+        seq, frames, lost = r.since(8)
+        assert frames == [_frame(9), _frame(10)]
+        assert lost == 0
+        assert r.since(10) == (10, [], 0)
+
+
+def test_restarted_producer_reuses_the_file(tmp_path):
+    path = str(tmp_path / "ring")
+    with PoseRing(path, create=True, slot_size=64, slot_count=4) as w:
+        w.publish(_frame(1))
+
+    with PoseRing(path) as r:
+        assert r.latest() == (1, _frame(1))
+        with PoseRing(path, create=True, slot_size=64, slot_count=4) as w:
+            # same layout, same file, readers keep their mapping
+            assert not r.replaced()
+            assert r.latest(1) is None
+            assert r.since(1) == (1, [], 0)
+            w.publish(_frame(2))
+            assert r.latest(1) == (2, _frame(2))
+            assert r.since(1) == (2, [_frame(2)], 0)
+
+
+def test_layout_change_while_mapped(tmp_path, monkeypatch):
+    # what windows does while the driver has the ring mapped
+    def replace(src, dst):
+        raise PermissionError(13, "in use")
+
+    path = str(tmp_path / "ring")
+    PoseRing(path, create=True, slot_size=64, slot_count=4).close()
+    monkeypatch.setattr(ring.os, "replace", replace)
+    with pytest.raises(RuntimeError):
+        PoseRing(path, create=True, slot_size=128, slot_count=4)
+
+    assert os.listdir(tmp_path) == ["ring"]
+
+
+def test_frames_bigger_than_a_slot(tmp_path):
+    with PoseRing(str(tmp_path / "ring"), create=True, slot_size=8) as w:
+        with pytest.raises(ValueError):
+            w.publish(bytes(9))
+
+
+def test_not_a_ring(tmp_path):
+    path = tmp_path / "ring"
+    path.write_bytes(bytes(1024))
+    with pytest.raises(RuntimeError):
+        PoseRing(str(path))
@@ -0,0 +1,160 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""server side pose processing stages"""
+import asyncio
+import math
+import struct
+
+import numpy as np
+import pytest
+
+from virtualreality.server.channels import DEFAULT_CHANNEL
+from virtualreality.server.server import Server
+from virtualreality.server.stages import (
+    EstimateVelocity,
+    PoseBatch,
+    PoseProcessor,
+    Predict,
+    Smooth,
+    parse_stage_spec,
+)
+
+
+def _batch(pos, rot=(1, 0, 0, 0), vel=(0, 0, 0), ang_vel=(0, 0, 0)):
+    # one device
+    return PoseBatch(*(np.array([i], dtype=np.float64) for i in (pos, rot, vel, ang_vel))) # noqa E501
+
+
+def _rot_z(angle):
+    return (math.cos(angle / 2), 0, 0, math.sin(angle / 2))
+
+
+def _frame(*values):
+    return struct.pack(f"{len(values)}f", *values) + b"\t\r\n"
+
+
+def test_parse_stage_spec():
+    assert parse_stage_spec("smooth") == (Smooth, {})
+    assert parse_stage_spec("smooth:alpha=0.3:devices=0,2") == (
+        Smooth, {"alpha": 0.3, "devices": [0, 2]}
+    )
+    assert parse_stage_spec("predict:horizon=0.05") == (
+        Predict, {"horizon": 0.05}
+    )
+    assert parse_stage_spec("velocity")[0] is EstimateVelocity
+
+    with pytest.raises(ValueError):
+        parse_stage_spec("blur:alpha=1")
+
+    with pytest.raises(ValueError):
+        parse_stage_spec("smooth:alpha=lots")
+
+
+def test_smooth():
+    s = Smooth(alpha=0.5)
+    b = _batch((0, 0, 0))
+    s(b, 0)
+    assert b.pos.tolist() == [[0, 0, 0]]
+
+    b = _batch((2, 4, 0))
+    s(b, 0.01)
+    assert b.pos.tolist() == [[1, 2, 0]]
+
+    # -q is the same rotation as q, smoothing toward it changes nothing
+    b = _batch((2, 4, 0), rot=(-1, 0, 0, 0))
+    s(b, 0.01)
+    assert np.allclose(b.rot, [[1, 0, 0, 0]])
+    assert np.allclose(np.linalg.norm(b.rot, axis=1), 1)
+
+
+def test_estimate_velocity():
+    s = EstimateVelocity()
+    b = _batch((0, 0, 0), vel=(9, 9, 9))
+    s(b, 0)
+    assert b.vel.tolist() == [[9, 9, 9]]  # first frame, nothing to compare to
+
+    b = _batch((0.1, 0, -0.2), rot=_rot_z(0.05), vel=(9, 9, 9))
+    s(b, 0.1)
+    assert np.allclose(b.vel, [[1, 0, -2]])
+    assert np.allclose(b.ang_vel, [[0, 0, 0.5]])
+
+
+def test_predict():
+    s = Predict(horizon=0.5)
+    b = _batch((1, 0, 0), vel=(2, 0, 0), ang_vel=(0, 0, 1))
+    s(b, 0.01)
+    assert np.allclose(b.pos, [[2, 0, 0]])
+    assert np.allclose(b.rot, [_rot_z(0.5)])
+
+    # standing still stays put
+    b = _batch((1, 0, 0), rot=_rot_z(1))
+    s(b, 0.01)
+    assert np.allclose(b.pos, [[1, 0, 0]])
+    assert np.allclose(b.rot, [_rot_z(1)])
+
+
+def test_stage_devices():
+    s = Predict(horizon=1, devices=[1])
+    b = PoseBatch(
+        np.zeros((2, 3)), np.tile([1.0, 0, 0, 0], (2, 1)),
+        np.ones((2, 3)), np.zeros((2, 3))
+    )
+    s(b, 0.01)
+    assert b.pos.tolist() == [[0, 0, 0], [1, 1, 1]]
+
+
+def test_processor_leaves_inputs_alone():
+    p = PoseProcessor("h13 c22", [(Predict, {"horizon": 1})])
+    hmd = [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0]
+    ctrl = [0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0] + list(range(9))
+    out = p.process(_frame(*hmd, *ctrl), 1)
+    vals = struct.unpack("35f", out[:-3])
+    assert vals[:3] == (1, 0, 0)
+    assert vals[13 + 13:] == tuple(range(9))
+    assert out.endswith(b"\t\r\n")
+
+    short = _frame(*hmd)
+    assert p.process(short, 2) is short
+    assert p.skipped == 1
+
+
+def test_stages_follow_the_channel_layout():
+    async def main():
+        srv = Server()
+        srv.process_udu = "h13"
+        srv.add_stage(Predict, horizon=1)
+        ch = srv.channels[DEFAULT_CHANNEL]
+        out = []
+        got = asyncio.Event()
+
+        def publish(frame, me):
+            out.append(frame)
+            got.set()
+
+        srv.publish_pose_frame = publish
+
+        async def forward(frame):
+            got.clear()
+            srv.forward_pose_frame(frame, "poser")
+            await asyncio.wait_for(got.wait(), 1)
+            return struct.unpack(f"{(len(out[-1]) - 3) // 4}f", out[-1][:-3]) # noqa E501
+
+        moving = [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0]
+
+        # --process until the poser's layout is known
+        assert (await forward(_frame(*moving)))[:3] == (1, 0, 0)
+
+        srv.set_layout(ch, "h t", "poser")
+        assert (await forward(_frame(*moving, *moving)))[:16] == (1, 0, 0, *moving[3:], 1, 0, 0) # noqa E501
+        assert srv._processors["poser"].sizes == [13, 13]
+
+        # frames of another layout pass as they are, and show up in the stats
+        assert (await forward(_frame(*moving)))[:3] == (0, 0, 0)
+        assert srv.get_stats()["stages"] == {"sources": 1, "skipped": 1}
+
+        srv.source_gone("poser")
+        assert srv.get_stats()["stages"] == {"sources": 0, "skipped": 1}
+        srv._stage_executor.shutdown()
+
+    asyncio.run(main())
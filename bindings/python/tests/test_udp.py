@@ -0,0 +1,52 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""datagram sequence filtering, wrap around and sender restarts"""
+from virtualreality.server.udp import (
+    DGRAM_POSE,
+    SEQ_MASK,
+    SEQ_RESET_WINDOW,
+    SequenceFilter,
+    pack_dgram,
+    unpack_dgram,
+)
+
+
+def test_late_and_repeated_datagrams_are_dropped():
+    f = SequenceFilter()
+    assert [f.accept("a", i) for i in (1, 3, 2, 3, 4)] == [True, True, False, False, True] # noqa E501
+    assert f.dropped == 2
+
+
+def test_sources_are_filtered_apart():
+    f = SequenceFilter()
+    assert f.accept("a", 10)
+    assert f.accept("b", 1)
+    assert not f.accept("a", 9)
+
+    f.forget("a")
+    assert f.accept("a", 9)
+
+
+def test_sequence_wraps_around():
+    f = SequenceFilter()
+    assert f.accept("a", SEQ_MASK - 1)
+    assert f.accept("a", SEQ_MASK)
+    assert f.accept("a", 0)
+    assert f.accept("a", 1)
+    assert not f.accept("a", SEQ_MASK)
+
+
+def test_restarted_sender_is_accepted():
+    f = SequenceFilter()
+    assert f.accept("a", 5000)
+    assert not f.accept("a", 5000 - SEQ_RESET_WINDOW)
+    assert f.accept("a", 1)
+    assert f.accept("a", 2)
+
+
+def test_datagram_round_trip():
+    frame = bytes(16) + b"\t\r\n"
+    assert unpack_dgram(pack_dgram(DGRAM_POSE, SEQ_MASK + 2, frame)) == (DGRAM_POSE, 1, frame) # noqa E501
+    assert unpack_dgram(b"xx" + bytes(6)) is None
+    assert unpack_dgram(b"hv") is None
@@ -0,0 +1,194 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""server to server relay, framing, source ids, reconnects and a loopback pair"""
+import asyncio
+import re
+import socket
+import struct
+
+import pytest
+
+from virtualreality.server.server import Server
+from virtualreality.server.upstream import (
+    RelayFrameReader,
+    UpstreamLink,
+    pack_relay_frame,
+    pack_relay_gone,
+)
+
+
+def _frame(n):
+    return struct.pack("13f", *([n] * 13)) + b"\t\r\n"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _until(cond, t=2):
+    for _ in range(int(t * 100)):
+        if cond():
+            return
+
+        await asyncio.sleep(0.01)
+
+    raise AssertionError("timed out")
+
+
+def test_relay_frames_split_anywhere():
+    r = RelayFrameReader()
+    data = pack_relay_frame(0, _frame(1)) + pack_relay_gone(3) + pack_relay_frame(1, _frame(2)) # noqa E501
+    got = []
+    for i in range(0, len(data), 5):
+        got += r.feed(data[i:i + 5])
+
+    assert got == [(0, _frame(1)), (3, b""), (1, _frame(2))]
+
+
+def test_relay_stream_with_a_bad_header():
+    with pytest.raises(ValueError):
+        RelayFrameReader().feed(b"lol!" + bytes(6))
+
+    with pytest.raises(ValueError):
+        RelayFrameReader(max_size=8).feed(pack_relay_frame(0, _frame(1)))
+
+
+def test_source_ids_are_reused():
+    async def main():
+        link = UpstreamLink(Server(), "127.0.0.1", 1)
+        link.publish(_frame(1), "a")
+        link.publish(_frame(2), "b")
+        link.publish(_frame(3), "a")
+        before = dict(link._source_ids), dict(link._latest)
+
+        # not connected, nothing to tell upstream
+        link.forget("a")
+        gone = set(link._gone)
+        link.publish(_frame(4), "c")
+        link.forget("nobody")
+        return before, gone, dict(link._source_ids), link.stats()["sources"]
+
+    before, gone, after, sources = asyncio.run(main())
+    assert before == ({"a": 0, "b": 1}, {0: _frame(3), 1: _frame(2)})
+    assert gone == set()
+    assert after == {"b": 1, "c": 0}
+    assert sources == 2
+
+
+class _Pair:
+    # an upstream server and a relay server, both on real sockets
+    async def start_upstream(self, port=0):
+        self.up = Server()
+        self.up_server = await asyncio.start_server(self.up, "127.0.0.1", port) # noqa E501
+        return self.up_server.sockets[0].getsockname()[1]
+
+    async def stop_upstream(self):
+        # close the server and every connection it has, like a crash would
+        self.up_server.close()
+        for me in list(self.up._connections):
+            me[1].close()
+
+        await self.up_server.wait_closed()
+
+    async def start_relay(self, port, reconnect_delay=0.01):
+        self.relay = Server()
+        self.relay.upstream = f"127.0.0.1:{port}"
+        self.relay_server = await asyncio.start_server(self.relay, "127.0.0.1", 0) # noqa E501
+        self.link = UpstreamLink(
+            self.relay, "127.0.0.1", port, reconnect_delay=reconnect_delay
+        )
+        self.relay._upstream = self.link
+        self.link_task = asyncio.ensure_future(self.link.run())
+        return self.relay_server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.link_task.cancel()
+        await asyncio.gather(self.link_task, return_exceptions=True)
+        for i in (self.relay_server, self.up_server):
+            i.close()
+
+
+async def _connect(port, id_line):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(id_line + b"\n")
+    await writer.drain()
+    return reader, writer
+
+
+def test_loopback_relay():
+    async def main():
+        pair = _Pair()
+        up_port = await pair.start_upstream()
+        relay_port = await pair.start_relay(up_port)
+        await _until(lambda: pair.link.connected)
+
+        d_reader, d_writer = await _connect(up_port, b"hello")
+        p_reader, p_writer = await _connect(relay_port, b"holla udu=h")
+        await _until(lambda: len(pair.relay._connections) == 1)
+
+        # the relay's poser shows up upstream as one of its own
+        p_writer.write(_frame(1))
+        got = await asyncio.wait_for(d_reader.readexactly(len(_frame(1))), 2) # noqa E501
+        sources = [k for k in pair.up.channels[""].last_frames if k[1] is None] # noqa E501
+
+        # drivers upstream talk to the relay's posers
+        d_writer.write(b"lol\n")
+        back = await asyncio.wait_for(p_reader.readline(), 2)
+
+        # the poser leaves, upstream forgets it
+        p_writer.close()
+        await _until(lambda: not pair.up.channels[""].last_frames)
+
+        d_writer.close()
+        await pair.stop()
+        return got, len(sources), back, pair.link.stats()
+
+    got, sources, back, stats = asyncio.run(main())
+    assert got == _frame(1)
+    assert sources == 1
+    assert back == b"lol\n"
+    assert stats["frames_out"] == 1
+    assert stats["sources"] == 0
+    assert stats["reconnects"] == 0
+
+
+def test_reconnect_with_backoff(capsys):
+    async def main():
+        pair = _Pair()
+        up_port = _free_port()
+        await pair.start_relay(up_port, reconnect_delay=0.01)
+
+        # nobody upstream yet, frames wait for the link, newest one only
+        pair.link.publish(_frame(1), "poser")
+        pair.link.publish(_frame(2), "poser")
+        await asyncio.sleep(0.3)
+
+        await pair.start_upstream(up_port)
+        d_reader, _ = await _connect(up_port, b"hello")
+        await _until(lambda: pair.link.connected and pair.up.driver_conz)
+        first = await asyncio.wait_for(d_reader.readexactly(len(_frame(2))), 2) # noqa E501
+
+        # upstream goes away and comes back, the newest frame is sent again
+        await pair.stop_upstream()
+        await _until(lambda: not pair.link.connected)
+        await pair.start_upstream(up_port)
+        d_reader, d_writer = await _connect(up_port, b"hello")
+        await _until(lambda: pair.link.connected)
+        await _until(lambda: pair.up.channels[""].last_frames)
+        last = list(pair.up.channels[""].last_frames.values())
+
+        d_writer.close()
+        await pair.stop()
+        return first, last, pair.link.reconnects
+
+    first, last, reconnects = asyncio.run(main())
+    assert first == _frame(2)
+    assert last == [_frame(2)]
+    assert reconnects == 1
+
+    delays = [float(i) for i in re.findall(r"retrying in ([\d.]+)s", capsys.readouterr().out)] # noqa E501
+    assert delays[:4] == [0.01, 0.02, 0.04, 0.08]
+    assert max(delays) == 0.08
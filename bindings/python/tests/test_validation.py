@@ -0,0 +1,56 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""pose frames checked against the channel's udu layout"""
+import struct
+
+from virtualreality.server.channels import DEFAULT_CHANNEL
+from virtualreality.server.server import Server
+
+
+class _Bus:
+    # stands in for a bus.PoseBus
+    def __init__(self):
+        self.layouts = []
+
+    def publish_layout(self, ch):
+        self.layouts.append(ch.udu)
+
+
+def test_same_layout_in_both_formats():
+    srv = Server()
+    srv._bus = bus = _Bus()
+    ch = srv.channels[DEFAULT_CHANNEL]
+
+    srv.set_layout(ch, "h c c", "poser")
+    srv.set_layout(ch, "h13 c22 c22", "manager")
+    assert bus.layouts == ["h c c"]
+    assert ch.frame_size == 57 * 4 + 3
+
+    srv.set_layout(ch, "h13 c22", "manager")
+    assert bus.layouts == ["h c c", "h13 c22"]
+    assert ch.device_types == ["h", "c"]
+    assert ch.device_sizes == [13, 22]
+
+
+def test_bad_layouts_are_ignored():
+    srv = Server()
+    ch = srv.channels[DEFAULT_CHANNEL]
+    srv.set_layout(ch, "h c", "poser")
+    srv.set_layout(ch, "x y z", "poser")
+    assert ch.udu == "h c"
+    assert not ch.same_layout("x y z")
+
+
+def test_frames_that_dont_fit_are_dropped():
+    srv = Server()
+    ch = srv.channels[DEFAULT_CHANNEL]
+    srv.set_layout(ch, "h", "poser")
+    forwarded = []
+    srv.forward_pose_frame = lambda frame, me: forwarded.append(frame)
+
+    good = struct.pack("13f", *range(13)) + b"\t\r\n"
+    assert srv.handle_pose_frame(good, "poser")
+    assert not srv.handle_pose_frame(good[4:], "poser")
+    assert forwarded == [good]
+    assert srv.malformed_frames == 1
@@ -346,7 +346,7 @@ Options:
                         self.poses[2].system = self.temp_pose.system
                         self.poses[2].menu = self.temp_pose.menu
 
-                await asyncio.sleep(self.coro_keep_alive["mode_switcher"].sleep_delay)
+                await self.pace("mode_switcher")
 
             except Exception as e:
                 print(f"failed mode_switcher: {e}")
@@ -439,9 +439,7 @@ Options:
                                     self.poses[i].y = temp[1]
                                     self.poses[i].z = temp[2]
 
-                        await asyncio.sleep(
-                            self.coro_keep_alive["get_location"].sleep_delay
-                        )
+                        await self.pace("get_location")
 
                     except Exception as e:
                         print("stopping get_location:", e)
@@ -577,9 +575,7 @@ Options:
                             else:
                                 self.temp_pose.trigger_click = 0
 
-                            await asyncio.sleep(
-                                self.coro_keep_alive["serial_listener2"].sleep_delay
-                            )
+                            await self.pace("serial_listener2")
 
                         except Exception as e:
                             print(f"{self.serial_listener2.__name__}: {e}")
@@ -693,9 +689,7 @@ Options:
                                 if self._serialResetYaw:
                                     my_off = Quaternion([0, z, 0, w]).inverse.normalised
 
-                            await asyncio.sleep(
-                                self.coro_keep_alive["serial_listener3"].sleep_delay
-                            )
+                            await self.pace("serial_listener3")
 
                         except Exception as e:
                             print(f"serial_listener3: {e}")
@@ -788,9 +782,7 @@ Options:
                                 self.poses[0].ang_vel_z = ge[2]
 
 
-                            await asyncio.sleep(
-                                self.coro_keep_alive["serial_listener"].sleep_delay
-                            )
+                            await self.pace("serial_listener")
 
                         except Exception as e:
                             print(f"{self.serial_listener.__name__}: {e}")
@@ -836,7 +828,7 @@ Options:
                 print (f'nut: dead, reason: {e}')
                 # break
 
-            await asyncio.sleep(self.coro_keep_alive['nut'].sleep_delay)
+            await self.pace('nut')
 
 def run_poser_only(addr="127.0.0.1", cam=4, colordata=None, serz=[]):
     """Run the poser only. The server must be started in another program."""
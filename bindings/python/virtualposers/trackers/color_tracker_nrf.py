@@ -305,9 +305,7 @@ Options:
                             self.poses[1].y = poses[2][1]
                             self.poses[1].z = poses[2][2]
 
-                        await asyncio.sleep(
-                            self.coro_keep_alive["get_location"].sleep_delay
-                        )
+                        await self.pace("get_location")
 
                     except Exception as e:
                         print("stopping get_location:", e)
@@ -500,9 +498,7 @@ Options:
                                     self.poses[2].trigger_click = 0
 
 
-                            await asyncio.sleep(
-                                self.coro_keep_alive["serial_listener"].sleep_delay
-                            )
+                            await self.pace("serial_listener")
 
                         except Exception as e:
                             print(f"{self.serial_listener.__name__}: {e}")
@@ -160,9 +160,7 @@ class Poser(templates.PoserTemplate):
                     self.pose.y = round(poses["blue"]["y"] + 1 - 0.07, 6)
                     self.pose.z = round(poses["blue"]["z"] - 0.03, 6)
 
-                    await asyncio.sleep(
-                        self.coro_keep_alive["get_location"].sleep_delay
-                    )
+                    await self.pace("get_location")
 
                 except Exception as e:
                     print("stopping get_location:", e)
@@ -325,11 +323,7 @@ class Poser(templates.PoserTemplate):
                                 else:
                                     self.temp_pose.trigger_click = 0
 
-                                await asyncio.sleep(
-                                    self.coro_keep_alive[
-                                        "serial_listener_2"
-                                    ].sleep_delay
-                                )
+                                await self.pace("serial_listener_2")
 
                             except Exception as e:
                                 print(f"{self.serial_listener_2.__name__}: {e}")
@@ -382,9 +376,7 @@ class Poser(templates.PoserTemplate):
                                     if self._serialResetYaw:
                                         yaw_offset = 0 - ypr[0]
 
-                                await asyncio.sleep(
-                                    self.coro_keep_alive["serial_listener"].sleep_delay
-                                )
+                                await self.pace("serial_listener")
 
                             except Exception as e:
                                 print(f"{self.serial_listener.__name__}: {e}")
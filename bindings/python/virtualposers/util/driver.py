@@ -9,6 +9,12 @@ import threading
 from . import utilz as u
 import struct
 
+from virtualreality.server import udp as dgram
+from virtualreality.server.ring import PoseRing, DEFAULT_RING_PATH
+from virtualreality.server.net import tune_socket
+from virtualreality.server.heartbeat import HEARTBEAT_MSG
+from virtualreality.server.compact import CompactCodec, CompactReader, velocity_mask
+
 
 class DummyDriverReceiver(threading.Thread):
     """
@@ -35,6 +41,7 @@ class DummyDriverReceiver(threading.Thread):
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((addr, port))
+        tune_socket(self.sock, send_buffer=None)
         self.sock.settimeout(2)
         self.sock.send(b'hello\n')
 
@@ -119,6 +126,10 @@ class UduDummyDriverReceiver(threading.Thread):
 
     example:
     t = UduDummyDriverReceiver('h13 c22 c22')
+    # t = UduDummyDriverReceiver('h13 c22 c22', udp=True) # poses over udp
+    # t = UduDummyDriverReceiver('h13 c22 c22', pose_ring=True) # poses from the same host pose ring
+    # t = UduDummyDriverReceiver('h13 c22 c22', monitor='rate=30') # read only, 30 frames per second, for debug tools
+    # t = UduDummyDriverReceiver('h13 c22 c22', compact=True, velocity=[True, False, False]) # quantized compact frames
 
     with t:
         t.send('hello') # driver id message
@@ -129,9 +140,19 @@ class UduDummyDriverReceiver(threading.Thread):
 
     """
 
-    def __init__(self, expected_pose_struct, *, addr="127.0.0.1", port=6969):
+    def __init__(self, expected_pose_struct, *, addr="127.0.0.1", port=6969, udp=False, pose_ring=None, monitor=None, channel=None, heartbeats=True, idle_timeout=5, compact=False, velocity=None):
         """
         ill let you guess what this does, :expected_pose_struct: should completely match this regex: ([htc][0-9]+[ ])*([htc][0-9]+)$
+        :udp: receive poses as datagrams, the tcp connection is kept for send() only
+        :pose_ring: read poses from a same host pose ring, path to the ring file or True for the default path,
+                    the tcp connection is kept for send() only
+        :monitor: connect as a read only monitor instead of a driver, True for the server's default rate,
+                  or the monitor options, 'rate=30' or 'every=4', send() goes nowhere
+        :channel: server channel to join, None is the default channel, udp poses are default channel only
+        :heartbeats: ask the server for heartbeats and answer them, tcp poses and monitors only
+        :idle_timeout: give up on a server silent for this long(in seconds), once it sent a heartbeat, None never does
+        :compact: ask the server for quantized compact frames, tcp only, see virtualreality.server.compact
+        :velocity: with compact, a bool per device, False for devices whose velocities aren't needed, None is all
         """
         super().__init__()
         self.device_order, self.eps = u.get_pose_struct_from_text(expected_pose_struct)
@@ -139,11 +160,50 @@ class UduDummyDriverReceiver(threading.Thread):
         if not self.eps:
             raise RuntimeError(f"invalid expected_pose_struct: {expected_pose_struct}")
 
+        self.compact = None
+        if compact:
+            if udp or pose_ring or monitor:
+                raise RuntimeError("compact frames are tcp only")
+
+            self.compact = CompactReader(CompactCodec(expected_pose_struct, velocity))
+
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((addr, port))
+        tune_socket(self.sock, send_buffer=None)
         self.sock.settimeout(2)
-        self.sock.send(b'hello\n')
 
+        self.udp_sock = None
+        self.ring = None
+        self.ring_path = None
+        idOpts = f' channel={channel}' if channel else ''
+        # udp and ring modes never read the tcp connection, they can't answer
+        self.heartbeats = bool(heartbeats and (monitor or not (udp or pose_ring)))
+        self.idle_timeout = idle_timeout
+        if self.heartbeats:
+            idOpts += ' hb=1'
+
+        if monitor:
+            self.sock.send(f'monitor{idOpts}\n'.encode() if monitor is True else f'monitor {monitor}{idOpts}\n'.encode())
+
+        elif pose_ring:
+            self.sock.send(f'hello_ring{idOpts}\n'.encode())
+            # opened by the receive thread, the poser might not have made it yet
+            self.ring_path = DEFAULT_RING_PATH if pose_ring is True else pose_ring
+
+        elif udp:
+            self.sock.send(f'hello_udp{idOpts}\n'.encode())
+            self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_sock.connect((addr, port))
+            self.udp_sock.settimeout(1)
+            self.udp_sock.send(dgram.pack_dgram(dgram.DGRAM_SUBSCRIBE, 0))
+            self._seqFilter = dgram.SequenceFilter()
+
+        elif self.compact is not None:
+            codec = self.compact.codec
+            self.sock.send(f'hello{idOpts} enc=q udu={",".join(codec.device_types)} vel={velocity_mask(codec.velocity)}\n'.encode())
+
+        else:
+            self.sock.send(f'hello{idOpts}\n'.encode())
 
         self.readSize = sum(self.eps)*4
         self._terminator = b"\t\r\n"
@@ -175,6 +235,13 @@ class UduDummyDriverReceiver(threading.Thread):
 
     def close(self):
         """hammer time!"""
+        if self.udp_sock is not None:
+            self.udp_sock.send(dgram.pack_dgram(dgram.DGRAM_UNSUBSCRIBE, 0))
+            self.udp_sock.close()
+
+        if self.ring is not None:
+            self.ring.close()
+
         self.sock.send(b"CLOSE\n")
         time.sleep(1)
         self.sock.close()
@@ -198,25 +265,132 @@ class UduDummyDriverReceiver(threading.Thread):
 
         return False
 
+    def _run_udp(self):
+        lastSub = time.monotonic()
+        while self.alive:
+            try:
+                # subscriptions expire on the server, keep renewing
+                if time.monotonic() - lastSub > 1:
+                    self.udp_sock.send(dgram.pack_dgram(dgram.DGRAM_SUBSCRIBE, 0))
+                    lastSub = time.monotonic()
+
+                pk = dgram.unpack_dgram(self.udp_sock.recv(self.readSize+3+dgram.dgram_header_t.size))
+                if pk is None:
+                    continue
+
+                kind, seq, payload = pk
+                if kind != dgram.DGRAM_POSE or not self._seqFilter.accept(None, seq):
+                    continue
+
+                if not self._handlePacket(payload[:-len(self._terminator)]):
+                    print(len(payload), repr(payload))
+
+            except socket.timeout:
+                pass
+
+            except Exception as e:
+                print(f"UduDummyDriverReceiver udp receive thread failed: {repr(e)}")
+                break
+
+        self.alive = False
+
+    def _open_ring(self):
+        # like the driver's ring thread, wait for the poser to make the ring
+        delay = 0.01
+        while self.alive:
+            try:
+                return PoseRing(self.ring_path)
+
+            except (OSError, ValueError, RuntimeError):
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
+        return None
+
+    def _run_ring(self):
+        seq = 0
+        lastNew = time.monotonic()
+        while self.alive:
+            try:
+                if self.ring is None:
+                    self.ring = self._open_ring()
+                    seq = 0
+                    lastNew = time.monotonic()
+                    continue
+
+                new = self.ring.latest(seq)
+                if new is None:
+                    # poser restarted with a different ring layout
+                    if time.monotonic() - lastNew > 1 and self.ring.replaced():
+                        self.ring.close()
+                        self.ring = None
+
+                    time.sleep(0.0005)
+                    continue
+
+                lastNew = time.monotonic()
+
+                seq, payload = new
+                if not self._handlePacket(payload[:-len(self._terminator)]):
+                    print(len(payload), repr(payload))
+
+            except Exception as e:
+                print(f"UduDummyDriverReceiver ring receive thread failed: {repr(e)}")
+                break
+
+        self.alive = False
+
     def run(self):
+        if self.ring_path is not None:
+            self._run_ring()
+            return
+
+        if self.udp_sock is not None:
+            self._run_udp()
+            return
+
         backBuffer = bytearray()
+        heartbeat = HEARTBEAT_MSG[:-len(self._terminator)]
+        heartbeatSeen = False
+        lastData = time.monotonic()
         while self.alive:
             try:
                 data = self.sock.recv(self.readSize+3)
-                backBuffer.extend(data)
 
                 if not data:
                     break
 
+                lastData = time.monotonic()
+
+                if self.compact is not None:
+                    # cut by size, quantized values can look like a terminator
+                    heartbeats = self.compact.heartbeats
+                    for i in self.compact.feed(data):
+                        self._handlePacket(i[:-len(self._terminator)])
+
+                    if self.compact.heartbeats > heartbeats:
+                        heartbeatSeen = True
+                        self.sock.send(HEARTBEAT_MSG)
+
+                    continue
+
+                backBuffer.extend(data)
                 while self._terminator in backBuffer:
                     lastPacket, backBuffer = backBuffer.split(
                         self._terminator, 1
                     )
+                    if lastPacket == heartbeat:
+                        heartbeatSeen = True
+                        self.sock.send(HEARTBEAT_MSG)
+                        continue
+
                     if not self._handlePacket(lastPacket):
                         print(len(lastPacket), repr(backBuffer))
 
-            except socket.timeout as e:
-                pass
+            except socket.timeout:
+                if heartbeatSeen and self.idle_timeout and time.monotonic() - lastData > self.idle_timeout:
+                    print(f"UduDummyDriverReceiver: server silent for {self.idle_timeout}s, giving up on it")
+                    break
 
             except Exception as e:
                 print(f"UduDummyDriverReceiver receive thread failed: {repr(e)}")
@@ -5,7 +5,7 @@
 from . import server
 # from ..logging import log
 
-__version__ = "0.9"  # the server is at this version
+__version__ = "0.10"  # the server is at this version
 
 # logger = log.setup_custom_logger(
 #     name=__name__,
@@ -5,14 +5,48 @@
 pyvr server.
 
 usage:
-  server [--show-messages]
+  server [--show-messages] [--engine=<engine>] [--loop=<loop>] [--no-socket-tuning]
+         [--frame-relay] [--queue-size=<n>] [--overflow=<policy>] [--udp]
+         [--stats-file=<path>] [--stats-interval=<s>]
+         [--merge=<udu>] [--merge-rate=<hz>]
+         [--record=<path>] [--replay=<path>] [--replay-speed=<x>] [--replay-from=<s>]
+         [--monitor-rate=<hz>] [--process=<udu>] [--stage=<spec>]...
+         [--upstream=<addr>] [--upstream-channel=<name>] [--no-validate]
+         [--workers=<n>] [--heartbeat=<s>] [--idle-timeout=<s>]
 
 options:
-    -h --help               shows this message
-    -d --show-messages      show messages
+    -h --help                 shows this message
+    -d --show-messages        show messages
+    -e --engine=<engine>      streams, or protocol for the callback based engine [default: streams]
+    -l --loop=<loop>          event loop, asyncio, uvloop or auto for uvloop if installed [default: auto]
+    -k --no-socket-tuning     leave pose connections with the default socket options
+    -f --frame-relay          reassemble pose frames, forward only the newest one per poser
+    -q --queue-size=<n>       max queued outbound messages per connection [default: 64]
+    -o --overflow=<policy>    full queue policy: drop-oldest, drop-newest or disconnect [default: drop-oldest]
+    -u --udp                  also accept and send pose frames over udp
+    -s --stats-file=<path>    append a json lines metrics report to this file, '-' for stdout
+    -i --stats-interval=<s>   seconds between metrics reports [default: 1]
+    -m --merge=<udu>          merge partial frames from many posers into this udu layout, e.g. 'h13 c22 t13'
+    -r --merge-rate=<hz>      merged frames sent per second [default: 100]
+    -w --record=<path>        record forwarded pose frames and manager messages to this file
+    -p --replay=<path>        stream a recording to drivers once one connects
+    -x --replay-speed=<x>     replay speed multiplier, 0 is as fast as possible [default: 1]
+    -t --replay-from=<s>      start the replay this many seconds into the recording [default: 0]
+    -M --monitor-rate=<hz>    frames per second per poser for monitors that don't ask for a rate [default: 10]
+    -P --process=<udu>        pose frame layout for the processing stages until a poser sends its udu settings
+    -S --stage=<spec>         add a processing stage, smooth, velocity or predict, with options,
+                              e.g. 'smooth:alpha=0.3:devices=0,1' or 'predict:horizon=0.02'
+    -U --upstream=<addr>      relay local posers to another server at host:port
+    -C --upstream-channel=<name>
+                              channel to join on the upstream server
+    -n --no-validate          don't drop pose frames that don't fit the channel's udu layout
+    -W --workers=<n>          worker processes sharing the port, linux only [default: 1]
+    -b --heartbeat=<s>        seconds between heartbeats to clients that ask for them [default: 1]
+    -I --idle-timeout=<s>     close connections stalled or silent for this long, 0 never does [default: 5]
 
 """
 from . import server
+from . import stages
 
 from . import __version__
 
@@ -22,5 +56,56 @@ args = docopt(__doc__, version=__version__)
 
 my_server = server.Server()
 my_server.debug = args["--show-messages"]
+my_server.engine = args["--engine"]
+my_server.event_loop = args["--loop"]
+my_server.socket_tuning = not args["--no-socket-tuning"]
+my_server.frame_relay = args["--frame-relay"]
+my_server.queue_size = int(args["--queue-size"])
+my_server.overflow_policy = args["--overflow"]
+my_server.udp = args["--udp"]
+my_server.stats_file = args["--stats-file"]
+my_server.stats_interval = float(args["--stats-interval"])
+my_server.merge_udu = args["--merge"]
+my_server.merge_rate = float(args["--merge-rate"])
+my_server.record_file = args["--record"]
+my_server.replay_file = args["--replay"]
+my_server.replay_speed = float(args["--replay-speed"])
+my_server.replay_from = float(args["--replay-from"])
+try:
+    my_server.monitor_rate = float(args["--monitor-rate"])
+
+except ValueError:
+    my_server.monitor_rate = 0
+
+if not my_server.monitor_rate > 0:
+    raise SystemExit(f"bad --monitor-rate={args['--monitor-rate']}, has to be a positive number") # noqa E501
+
+my_server.process_udu = args["--process"]
+my_server.upstream = args["--upstream"]
+my_server.upstream_channel = args["--upstream-channel"]
+my_server.validate_frames = not args["--no-validate"]
+my_server.workers = int(args["--workers"])
+my_server.heartbeat_interval = float(args["--heartbeat"])
+my_server.idle_timeout = float(args["--idle-timeout"])
+for i in args["--stage"]:
+    try:
+        stage, kwargs = stages.parse_stage_spec(i)
+
+    except ValueError as e:
+        raise SystemExit(f"bad --stage={i}: {e}")
+
+    my_server.add_stage(stage, **kwargs)
+
+if my_server.stages:
+    # posers get their own processors later, build one now so bad options
+    # stop the server here instead of disconnecting every poser, without
+    # --process the layout comes from the posers' udu settings
+    try:
+        stages.PoseProcessor(
+            my_server.process_udu or my_server.merge_udu or "h13", my_server.stages
+        )
+
+    except (TypeError, ValueError, KeyError) as e:
+        raise SystemExit(f"bad --stage or frame layout: {e}")
 
 server.run_til_dead(conn_handle=my_server)
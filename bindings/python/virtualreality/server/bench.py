@@ -0,0 +1,499 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+pyvr server load generator and latency benchmark.
+
+spins up synthetic posers and drivers against a server and reports
+throughput, end to end latency percentiles and drops
+
+every synthetic frame carries a stamp(poser id, sequence number, send time)
+in its first bytes, send times are CLOCK_MONOTONIC so they stay comparable
+across processes, only frames sent inside the measurement window are counted
+
+server cpu time is measured over the window too, that needs the server in a
+process of its own(--server=spawn), or the posers and drivers in theirs(--processes)
+
+usage:
+    bench [options]
+
+options:
+    -h --help               shows this message
+    -n --posers=<n>         number of synthetic posers [default: 4]
+    -m --drivers=<n>        number of synthetic drivers [default: 1]
+    -u --udu=<udu>          device layout of every poser, 'h c c' or with sizes, 'h13 t64' [default: h c c]
+    -r --rate=<hz>          frames per second per poser [default: 100]
+    -t --duration=<s>       measurement window in seconds [default: 10]
+    -w --warmup=<s>         seconds before the measurement window [default: 1]
+    -s --server=<mode>      in-process, spawn(python -m virtualreality.server) or external [default: in-process]
+    -a --addr=<addr>        server address, spawn and external only [default: 127.0.0.1]
+    -p --port=<port>        server port, spawn and external only [default: 6969]
+    -f --frame-relay        run the server with --frame-relay, in-process and spawn only
+    -e --engine=<engine>    server engine, streams or protocol, in-process and spawn only [default: streams]
+    -W --workers=<n>        server worker processes, spawn only [default: 1]
+    -l --loop=<loop>        event loop, asyncio, uvloop or auto [default: auto]
+    -k --no-socket-tuning   default socket options everywhere
+    -c --compare            run every engine x installed event loop x socket tuning on/off, side by side
+    -P --processes          run every poser and driver in its own process
+    --seed=<n>              seed for the poser send phases [default: 0]
+    --json                  print the report as a single json line
+    --worker=<role>         internal, run a single poser or driver and print its result
+    --index=<i>             internal, worker index [default: 0]
+    --start-at=<t>          internal, CLOCK_MONOTONIC time the warmup starts at
+"""
+import asyncio
+import contextlib
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+from docopt import docopt
+
+from . import __version__
+from .merge import parse_udu
+from .metrics import LatencyHistogram
+from .net import loop_factory, run, tune_socket
+from .relay import POSE_TERMINATOR
+from .server import Server
+
+stamp_t = struct.Struct("<IId")
+
+# seconds a driver keeps reading after the window closes
+_GRACE = 0.5
+
+ENGINES = ("streams", "protocol")
+
+
+def frame_size(udu):
+    """bytes in a synthetic frame of the :udu: layout, terminator included"""
+    return sum(parse_udu(udu)[1]) * 4 + len(POSE_TERMINATOR)
+
+
+async def run_poser(index, udu, rate, addr, port, start, warmup, duration, phase=0, tune=False): # noqa E501
+    """
+    a synthetic poser, sends stamped frames at :rate: from :start: for :warmup: + :duration:
+
+    returns counters of the frames sent inside the measurement window
+    """
+    frame = bytearray(frame_size(udu))
+    frame[-len(POSE_TERMINATOR):] = POSE_TERMINATOR
+    if len(frame) - len(POSE_TERMINATOR) < stamp_t.size:
+        raise ValueError(f"{repr(udu)} is too small to carry a stamp")
+
+    reader, writer = await asyncio.open_connection(addr, port)
+    if tune:
+        tune_socket(writer.get_extra_info("socket"))
+
+    writer.write(b"holla\n")
+    await writer.drain()
+
+    loop = asyncio.get_event_loop()
+    window = (start + warmup, start + warmup + duration)
+    period = 1 / rate
+    deadline = start + phase * period
+    seq = 0
+    sent = 0
+    late = 0
+    try:
+        while 1:
+            # asyncio's clock is CLOCK_MONOTONIC as well
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            elif delay < -period:
+                late += 1
+
+            now = time.monotonic()
+            if now >= window[1]:
+                break
+
+            seq += 1
+            stamp_t.pack_into(frame, 0, index, seq, now)
+            writer.write(frame)
+            await writer.drain()
+
+            if now >= window[0]:
+                sent += 1
+
+            deadline += period
+
+    finally:
+        writer.close()
+
+    return {
+        "role": "poser",
+        "index": index,
+        "sent": sent,
+        "bytes": sent * len(frame),
+        "late": late,
+    }
+
+
+async def run_driver(index, udu, addr, port, start, warmup, duration, tune=False): # noqa E501
+    """
+    a synthetic driver, reads frames until the window closes
+
+    returns counters and the latency histogram of the frames sent inside the window
+    """
+    size = frame_size(udu)
+    reader, writer = await asyncio.open_connection(addr, port)
+    if tune:
+        tune_socket(writer.get_extra_info("socket"))
+
+    writer.write(b"hello\n")
+    await writer.drain()
+
+    loop = asyncio.get_event_loop()
+    window = (start + warmup, start + warmup + duration)
+    hist = LatencyHistogram()
+    last_seq = {}
+    received = 0
+    corrupt = 0
+    gaps = 0
+    try:
+        while 1:
+            timeout = window[1] + _GRACE - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                data = await asyncio.wait_for(
+                    reader.readuntil(POSE_TERMINATOR), timeout
+                )
+
+            except asyncio.TimeoutError:
+                break
+
+            now = time.monotonic()
+            if len(data) != size:
+                corrupt += 1
+                continue
+
+            poser, seq, sent_at = stamp_t.unpack_from(data)
+            if not window[0] <= sent_at < window[1]:
+                continue
+
+            last = last_seq.get(poser)
+            if last is not None and seq > last + 1:
+                gaps += seq - last - 1
+
+            last_seq[poser] = seq
+            received += 1
+            hist.add(now - sent_at)
+
+    finally:
+        writer.close()
+
+    return {
+        "role": "driver",
+        "index": index,
+        "received": received,
+        "bytes": received * size,
+        "corrupt": corrupt,
+        "gaps": gaps,
+        "latency": hist.as_dict(),
+    }
+
+
+def _proc_cpu(pid):
+    """
+    cpu seconds of another process and its children(server workers),
+    None where /proc isn't a thing
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+
+        ret = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    except (OSError, ValueError, IndexError):
+        return None
+
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split()
+
+    except OSError:
+        children = []
+
+    for i in children:
+        ret += _proc_cpu(i) or 0
+
+    return ret
+
+
+async def _cpu_window(start, warmup, duration, pid=None):
+    """server cpu seconds spent inside the window, this process or :pid:"""
+    def cpu():
+        return time.process_time() if pid is None else _proc_cpu(pid)
+
+    loop = asyncio.get_event_loop()
+    await asyncio.sleep(max(start + warmup - loop.time(), 0))
+    t0 = cpu()
+    await asyncio.sleep(max(start + warmup + duration - loop.time(), 0))
+    t1 = cpu()
+    if t0 is None or t1 is None:
+        return None
+
+    return t1 - t0
+
+
+def summarize(results, posers, drivers, udu, rate, duration, server_cpu=None, setup=None): # noqa E501
+    """
+    build the report out of every poser's and driver's result,
+    :setup: is a dict of engine, loop and socket_tuning
+    """
+    hist = LatencyHistogram()
+    sent = received = corrupt = gaps = late = 0
+    for i in results:
+        if i["role"] == "poser":
+            sent += i["sent"]
+            late += i["late"]
+
+        else:
+            received += i["received"]
+            corrupt += i["corrupt"]
+            gaps += i["gaps"]
+            hist.merge(LatencyHistogram.from_dict(i["latency"]))
+
+    expected = sent * drivers
+    latency = {
+        f"p{p}": round(hist.percentile(p) * 1e3, 3) for p in (50, 90, 99, 99.9)
+    }
+    latency["max"] = round(hist.max * 1e3, 3)
+
+    setup = setup or {}
+    return {
+        "engine": setup.get("engine"),
+        "loop": setup.get("loop"),
+        "socket_tuning": setup.get("socket_tuning"),
+        "workers": setup.get("workers", 1),
+        "posers": posers,
+        "drivers": drivers,
+        "udu": udu,
+        "rate": rate,
+        "duration": duration,
+        "frame_size": frame_size(udu),
+        "sent": sent,
+        "received": received,
+        "expected": expected,
+        "drop_rate": round(1 - received / expected, 6) if expected else 0,
+        "corrupt": corrupt,
+        "gaps": gaps,
+        "late_sends": late,
+        "fps_in": round(sent / duration, 2),
+        "fps_out": round(received / duration, 2),
+        "mbps_out": round(received * frame_size(udu) * 8 / duration / 1e6, 3), # noqa E501
+        "latency_ms": latency,
+        "server_cpu_s": None if server_cpu is None else round(server_cpu, 3),
+        "cpu_us_per_frame": round(server_cpu / received * 1e6, 3) if server_cpu is not None and received else None, # noqa E501
+    }
+
+
+async def _spawn_worker(role, index, args, start):
+    argv = [
+        sys.executable, "-m", "virtualreality.server.bench",
+        f"--worker={role}",
+        f"--index={index}",
+        f"--start-at={start!r}",
+        f"--udu={args['--udu']}",
+        f"--rate={args['--rate']}",
+        f"--duration={args['--duration']}",
+        f"--warmup={args['--warmup']}",
+        f"--addr={args['--addr']}",
+        f"--port={args['--port']}",
+        f"--seed={args['--seed']}",
+        f"--loop={args['--loop']}",
+        *(["--no-socket-tuning"] if args["--no-socket-tuning"] else []),
+    ]
+    proc = await asyncio.create_subprocess_exec(
+        *argv, stdout=asyncio.subprocess.PIPE
+    )
+    out, _ = await proc.communicate()
+    if proc.returncode:
+        raise RuntimeError(f"{role} worker {index} failed")
+
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def _phase(seed, index):
+    return random.Random(seed * 7919 + index).random()
+
+
+async def _wait_for_server(addr, port, timeout=10):
+    t = time.monotonic()
+    while 1:
+        try:
+            _, writer = await asyncio.open_connection(addr, port)
+            writer.close()
+            return
+
+        except OSError:
+            if time.monotonic() - t > timeout:
+                raise
+
+            await asyncio.sleep(0.1)
+
+
+async def bench(args):
+    """run a whole benchmark, returns the report"""
+    posers = int(args["--posers"])
+    drivers = int(args["--drivers"])
+    udu = args["--udu"]
+    rate = float(args["--rate"])
+    duration = float(args["--duration"])
+    warmup = float(args["--warmup"])
+    seed = int(args["--seed"])
+
+    tune = not args["--no-socket-tuning"]
+    setup = {
+        "engine": None,
+        "loop": loop_factory(args["--loop"])[1],
+        "socket_tuning": tune,
+        "workers": 1,
+    }
+    srv = None
+    proc = None
+    if args["--server"] == "in-process":
+        handle = Server()
+        handle.frame_relay = args["--frame-relay"]
+        handle.engine = setup["engine"] = args["--engine"]
+        handle.socket_tuning = tune
+        srv = await handle.start_server("127.0.0.1", 0)
+        args["--addr"], args["--port"] = srv.sockets[0].getsockname()[:2]
+
+    elif args["--server"] == "spawn":
+        setup["engine"] = args["--engine"]
+        setup["workers"] = int(args["--workers"])
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "virtualreality.server",
+            f"--engine={args['--engine']}",
+            f"--workers={args['--workers']}",
+            f"--loop={args['--loop']}",
+            *(["--no-socket-tuning"] if not tune else []),
+            *(["--frame-relay"] if args["--frame-relay"] else []),
+            stdout=asyncio.subprocess.DEVNULL,
+        )
+        await _wait_for_server(args["--addr"], args["--port"])
+
+    elif args["--server"] != "external":
+        raise ValueError(f"unknown server mode: {repr(args['--server'])}")
+
+    addr, port = args["--addr"], int(args["--port"])
+    # drivers connect and posers set up before anything is sent
+    start = time.monotonic() + (2 if args["--processes"] else 0.5)
+    try:
+        if args["--processes"]:
+            jobs = [_spawn_worker("driver", i, args, start) for i in range(drivers)] # noqa E501
+            jobs += [_spawn_worker("poser", i, args, start) for i in range(posers)] # noqa E501
+
+        else:
+            jobs = [
+                run_driver(i, udu, addr, port, start, warmup, duration, tune)
+                for i in range(drivers)
+            ]
+            jobs += [
+                run_poser(i, udu, rate, addr, port, start, warmup, duration, _phase(seed, i), tune) # noqa E501
+                for i in range(posers)
+            ]
+
+        cpu = None
+        if proc is not None:
+            cpu = asyncio.ensure_future(
+                _cpu_window(start, warmup, duration, proc.pid)
+            )
+
+        elif srv is not None and args["--processes"]:
+            # nothing but the server runs in this process
+            cpu = asyncio.ensure_future(_cpu_window(start, warmup, duration))
+
+        results = await asyncio.gather(*jobs)
+        if cpu is not None:
+            cpu = await cpu
+
+    finally:
+        if srv is not None:
+            await asyncio.sleep(0.1)  # let the server see everyone leave
+            srv.close()
+
+        if proc is not None:
+            proc.terminate()
+            await proc.wait()
+
+    return summarize(results, posers, drivers, udu, rate, duration, cpu, setup) # noqa E501
+
+
+async def _worker(args):
+    i = int(args["--index"])
+    start = float(args["--start-at"])
+    common = (args["--addr"], int(args["--port"]))
+    timing = (start, float(args["--warmup"]), float(args["--duration"]))
+    tune = not args["--no-socket-tuning"]
+    if args["--worker"] == "poser":
+        return await run_poser(
+            i, args["--udu"], float(args["--rate"]), *common, *timing,
+            _phase(int(args["--seed"]), i), tune
+        )
+
+    return await run_driver(i, args["--udu"], *common, *timing, tune)
+
+
+def print_report(r):
+    """human readable report"""
+    print(f"{r['posers']} poser(s) x {r['rate']}Hz -> {r['drivers']} driver(s), udu {repr(r['udu'])}, {r['frame_size']} byte frames, {r['duration']}s") # noqa E501
+    print(f"  {r['engine'] or 'external'} engine, {r['loop']} event loop, socket tuning {'on' if r['socket_tuning'] else 'off'}, {r['workers']} worker(s)") # noqa E501
+    print(f"  sent {r['sent']} ({r['fps_in']} fps), received {r['received']}/{r['expected']} ({r['fps_out']} fps, {r['mbps_out']} Mbit/s)") # noqa E501
+    print(f"  drop rate {r['drop_rate'] * 100:.3f}%, corrupt {r['corrupt']}, sequence gaps {r['gaps']}, late sends {r['late_sends']}") # noqa E501
+    print("  latency ms: " + ", ".join(f"{k} {v}" for k, v in r["latency_ms"].items())) # noqa E501
+    if r["server_cpu_s"] is None:
+        print("  server cpu: n/a, needs --server=spawn or --processes")
+
+    else:
+        print(f"  server cpu: {r['server_cpu_s']}s, {r['cpu_us_per_frame']}us per frame delivered") # noqa E501
+
+
+def main(argv=None):
+    args = docopt(__doc__, version=__version__, argv=argv)
+
+    if args["--worker"]:
+        # workers get the address already resolved by the parent
+        print(json.dumps(run(_worker(args), args["--loop"])))
+        return
+
+    runs = [(args["--engine"], args["--loop"], args["--no-socket-tuning"])]
+    if args["--compare"]:
+        loops = ["asyncio"]
+        if loop_factory("auto")[1] == "uvloop":
+            loops.append("uvloop")
+
+        runs = [
+            (e, lp, no_tune)
+            for e in ENGINES for lp in loops for no_tune in (False, True)
+        ]
+
+    # the in-process server talks on stdout, the json report needs it alone
+    quiet = contextlib.redirect_stdout(sys.stderr) if args["--json"] else contextlib.nullcontext() # noqa E501
+    reports = []
+    with quiet:
+        for engine, loop, no_tune in runs:
+            args.update({
+                "--engine": engine,
+                "--loop": loop,
+                "--no-socket-tuning": no_tune,
+            })
+            reports.append(run(bench(dict(args)), loop))
+
+    for i in reports:
+        if args["--json"]:
+            print(json.dumps(i, separators=(",", ":")))
+
+        else:
+            print_report(i)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Pose bus between the worker processes of 'server --workers=<n>'.
+
+every worker publishes records into its own PoseRing, see
+virtualreality.server.ring, and reads the rings of all the other workers,
+a byte down the reader's pipe wakes it up, at most one per loop iteration
+
+whatever a worker routes to its own connections also goes on the bus, the
+other workers route it to theirs as if it came from one of their own, so a
+frame from a poser on one worker reaches drivers on every worker
+
+record layout, little endian:
+    bus_record_t - kind, role sets, flags, destination worker(-1 for all),
+        channel name length, source length
+    channel name, source, payload
+
+kinds:
+    pose - a published frame, newest per source kept for late drivers
+    last - newest frame of a raw poser stream, only kept, not sent
+    send - a message for every connection of some role sets of a channel
+    gone - a pose source left
+    layout - a channel's udu layout
+    presence - a worker's driver, responder, manager and heartbeat driver counts of a channel
+    request - a manager request, replies go back to the asking worker
+    reply - the answer to a request, for one worker only
+    partial - a partial frame for the merging worker
+    resync - send me your state, a reader lost records
+    state - a worker's live sources, its layouts, presence and last frames follow
+
+the rings overwrite records nobody read yet when a burst outruns a reader,
+those are counted in self.lost, a worker that lost records of another one
+asks it to resync, it answers with a state record, every channel layout,
+its presence counts and the newest frame of every source it has, the
+reader drops stand ins of sources the state doesn't list, so layouts, last
+frames and gone sources are never lost for good, lost requests are, the
+manager that asked gives up on them, see manager.REPLY_TIMEOUT
+"""
+import os
+import struct
+import time
+from collections import OrderedDict
+
+from .channels import Channel, ROLE_SETS
+from .manager import ManagerRequest
+from .recording import REC_MANAGER
+
+K_POSE = 1
+K_LAST = 2
+K_SEND = 3
+K_GONE = 4
+K_LAYOUT = 5
+K_PRESENCE = 6
+K_REQUEST = 7
+K_REPLY = 8
+K_PARTIAL = 9
+K_RESYNC = 10
+K_STATE = 11
+
+F_URGENT = 1
+F_RECORD = 2
+F_NO_RESPONDERS = 4
+
+# request modes, which connections of the other workers get it
+TO_RESPONDERS = 1
+TO_MANAGERS = 2
+TO_UPSTREAM = 4  # the primary worker's upstream link
+ONLY_UPSTREAM = 8  # nothing else to ask, answer -100 if the link is down
+
+# presence counts
+DRIVERS = 0
+RESPONDERS = 1
+MANAGERS = 2
+HEARTBEAT_DRIVERS = 3  # 'hello hb=1', they need whole frames
+
+bus_record_t = struct.Struct("<BBBbHH")
+presence_t = struct.Struct("<IIII")
+request_t = struct.Struct("<IB")
+reply_t = struct.Struct("<I")
+
+BUS_SLOT_SIZE = 1 << 15
+BUS_SLOT_COUNT = 256
+
+# seconds before a resync that got no answer is asked for again
+RESYNC_RETRY = 1
+
+
+def source_key(me):
+    """
+    name of a pose source on the bus
+
+    connections and relay sources are unique objects, anything else,
+    udp addresses, 'merge', replay sources, is named by its value
+    """
+    if isinstance(me, tuple) and len(me) == 3:
+        return f"c{id(me):x}"
+
+    return str(me)
+
+
+def role_set_mask(role_sets):
+    """ROLE_SETS names to a bit mask"""
+    ret = 0
+    for i in role_sets:
+        ret |= 1 << ROLE_SETS.index(i)
+
+    return ret
+
+
+def role_set_names(mask):
+    """a bit mask back to ROLE_SETS names"""
+    return [name for i, name in enumerate(ROLE_SETS) if mask & (1 << i)]
+
+
+class PoseBus:
+    """
+    one worker's end of the bus
+
+    example:
+        bus = PoseBus(server, 1, rings, doorbells)
+        server._bus = bus
+        bus.start(loop)
+    """
+
+    def __init__(self, server, worker, rings, doorbells, max_pending=1024):
+        """
+        :server: this worker's Server
+        :worker: index of this worker, stored in self.worker
+        :rings: PoseRing per worker, this worker's own one writable
+        :doorbells: (read fd, write fd) pipe per worker
+        :max_pending: outstanding manager requests kept, the oldest go first
+        """
+        self.server = server
+        self.worker = worker
+        self.max_pending = max_pending
+
+        self.records_in = 0
+        self.records_out = 0
+        self.lost = 0
+        self.too_big = 0
+        self.resyncs = 0
+
+        self._ring = rings[worker]
+        self._peers = [(i, r) for i, r in enumerate(rings) if i != worker]
+        self._seqs = [0] * len(rings)
+        self._wake_fd = doorbells[worker][0]
+        self._bells = [w for i, (_, w) in enumerate(doorbells) if i != worker]
+        self._ringing = False
+        self._loop = None
+
+        self._published = {}  # local source -> its key
+        self._sources = {}  # (worker, key) -> stand in for a remote source
+        self._remote = {}  # stand in -> (worker, key)
+        self._requesters = OrderedDict()  # stand in -> (worker, token)
+        self._presence = {}  # (worker, channel) -> presence_t counts
+        self._presence_sent = {}
+        self._requests = OrderedDict()  # token -> ManagerRequest
+        self._next_token = 1
+        self._resync_asked = {}  # worker -> when
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} worker={self.worker} peers={len(self._peers)} records_out={self.records_out} records_in={self.records_in} object at {hex(id(self))}>" # noqa E501
+
+    def start(self, loop):
+        """start reading the other workers' rings on :loop:"""
+        self._loop = loop
+        os.set_blocking(self._wake_fd, False)
+        for i in self._bells:
+            os.set_blocking(i, False)
+
+        loop.add_reader(self._wake_fd, self._drain)
+        self._drain()
+
+    def stop(self):
+        """stop reading"""
+        if self._loop is not None:
+            self._loop.remove_reader(self._wake_fd)
+            self._loop = None
+
+    def is_remote(self, me):
+        """True if :me: is a stand in for a source or requester of another worker""" # noqa E501
+        return me in self._remote or me in self._requesters
+
+    def remote_count(self, channel, what):
+        """:what: of :channel: on all the other workers, DRIVERS, RESPONDERS, MANAGERS or HEARTBEAT_DRIVERS""" # noqa E501
+        return sum(
+            v[what] for (_, ch), v in self._presence.items() if ch == channel
+        )
+
+    def stats(self):
+        """counters as a json friendly dict"""
+        return {
+            "worker": self.worker,
+            "records_in": self.records_in,
+            "records_out": self.records_out,
+            "lost": self.lost,
+            "too_big": self.too_big,
+            "resyncs": self.resyncs,
+            "remote_sources": len(self._sources),
+            "pending_requests": len(self._requests),
+        }
+
+    def _publish(self, kind, channel, source, payload, sets=0, flags=0, dest=-1): # noqa E501
+        ch = channel.encode("utf-8")
+        src = source.encode("utf-8")
+        rec = bus_record_t.pack(kind, sets, flags, dest, len(ch), len(src)) + ch + src + payload # noqa E501
+        try:
+            self._ring.publish(rec)
+
+        except ValueError:
+            self.too_big += 1
+            return
+
+        self.records_out += 1
+        if not self._ringing and self._loop is not None:
+            self._ringing = True
+            self._loop.call_soon(self._ring_bells)
+
+    def _ring_bells(self):
+        self._ringing = False
+        for i in self._bells:
+            try:
+                os.write(i, b"\x01")
+
+            except (BlockingIOError, BrokenPipeError):
+                pass  # already ringing, or that worker is gone
+
+    def _key(self, me):
+        if me is None:
+            return ""
+
+        key = self._published.get(me)
+        if key is None:
+            key = source_key(me)
+            if isinstance(me, tuple) and len(me) == 3:
+                self._published[me] = key  # gets a 'gone' later
+
+        return key
+
+    def publish_pose(self, frame, me, ch):
+        """a frame published by this worker"""
+        if me not in self._remote:
+            self._publish(K_POSE, ch.name, self._key(me), frame)
+
+    def publish_last(self, frame, me, ch):
+        """newest frame of a raw poser stream of this worker"""
+        if me not in self._remote:
+            self._publish(K_LAST, ch.name, self._key(me), frame)
+
+    def send(self, msg, ch, role_sets, me, urgent=False, record=False, skip_responders=False): # noqa E501
+        """a message for :role_sets: of :ch: on every other worker"""
+        if me in self._remote:
+            return
+
+        flags = (
+            (F_URGENT if urgent else 0)
+            | (F_RECORD if record else 0)
+            | (F_NO_RESPONDERS if skip_responders else 0)
+        )
+        self._publish(
+            K_SEND, ch.name, self._key(me), msg, role_set_mask(role_sets), flags # noqa E501
+        )
+
+    def send_partial(self, frame, me):
+        """a partial frame for the primary worker's merger"""
+        self._publish(K_PARTIAL, self.server.channel_of(me).name, self._key(me), frame, dest=0) # noqa E501
+
+    def forget(self, me):
+        """a source of this worker is gone"""
+        key = self._published.pop(me, None)
+        if key is not None:
+            self._publish(K_GONE, self.server.channel_of(me).name, key, b"")
+
+    def publish_layout(self, ch):
+        """:ch: got a new udu layout on this worker"""
+        self._publish(K_LAYOUT, ch.name, "", ch.udu.encode("utf-8"))
+
+    def update_presence(self, ch, counts):
+        """:counts: of :ch: on this worker, see DRIVERS, only sent when they change""" # noqa E501
+        if self._presence_sent.get(ch.name, (0, 0, 0, 0)) == counts:
+            return
+
+        if any(counts):
+            self._presence_sent[ch.name] = counts
+
+        else:
+            self._presence_sent.pop(ch.name, None)
+
+        self._publish(K_PRESENCE, ch.name, "", presence_t.pack(*counts))
+
+    def send_request(self, msg, ch, req, mode):
+        """
+        hand a manager request to the other workers, :req: is its ManagerRequest,
+        their answer comes back through self.server.answer_manager_request
+        """
+        token = self._next_token
+        self._next_token = token % 0xFFFFFFFF + 1
+        self._requests[token] = req
+        if len(self._requests) > self.max_pending:
+            self._requests.popitem(last=False)
+
+        self._publish(
+            K_REQUEST, ch.name, "", request_t.pack(token, mode) + msg
+        )
+
+    def reply(self, req, reply):
+        """
+        send :reply: back if :req: came from another worker,
+        returns False for requests of this worker
+        """
+        origin = self._requesters.pop(req.requester, None)
+        if origin is None:
+            return False
+
+        worker, token = origin
+        self._publish(
+            K_REPLY, "", "", reply_t.pack(token) + reply, dest=worker
+        )
+        return True
+
+    def _drain(self):
+        try:
+            while os.read(self._wake_fd, 4096):
+                pass
+
+        except BlockingIOError:
+            pass
+
+        for worker, ring in self._peers:
+            seq, records, lost = ring.since(self._seqs[worker])
+            self._seqs[worker] = seq
+            if lost:
+                self.lost += lost
+                self._ask_resync(worker)
+
+            for i in records:
+                self.records_in += 1
+                try:
+                    self._handle(worker, i)
+
+                except Exception as e:
+                    print(f"bad bus record from worker {worker}: {e}")
+
+    def _ask_resync(self, worker):
+        now = time.monotonic()
+        if now - self._resync_asked.get(worker, -RESYNC_RETRY) < RESYNC_RETRY:
+            return  # asked already, its answer might still be on the way
+
+        self._resync_asked[worker] = now
+        self.resyncs += 1
+        self._publish(K_RESYNC, "", "", b"", dest=worker)
+
+    def _resync(self, worker):
+        # everything a reader that lost records needs, see the module docs
+        srv = self.server
+        local = [
+            (ch, source, frame)
+            for ch in list(srv.channels.values())
+            for source, frame in ch.last_frames.items()
+            if source not in self._remote
+        ]
+        keys = set(self._published.values())
+        keys.update(self._key(source) for _, source, _ in local)
+        self._publish(K_STATE, "", "", "\n".join(sorted(keys)).encode("utf-8"), dest=worker) # noqa E501
+
+        for ch in list(srv.channels.values()):
+            if ch.udu is not None:
+                self._publish(K_LAYOUT, ch.name, "", ch.udu.encode("utf-8"), dest=worker) # noqa E501
+
+        for name, counts in self._presence_sent.items():
+            self._publish(K_PRESENCE, name, "", presence_t.pack(*counts), dest=worker) # noqa E501
+
+        for ch, source, frame in local:
+            self._publish(K_LAST, ch.name, self._key(source), frame, dest=worker) # noqa E501
+
+    def _handle_state(self, worker, payload):
+        self._resync_asked.pop(worker, None)
+        keys = set(payload.decode("utf-8").split("\n")) if payload else set()
+        for (w, key), source in list(self._sources.items()):
+            if w == worker and key not in keys:
+                # its gone record was lost
+                del self._sources[(w, key)]
+                del self._remote[source]
+                self.server.source_gone(source)
+
+        # presence records follow, channels without any aren't sent
+        for i in [i for i in self._presence if i[0] == worker]:
+            del self._presence[i]
+
+    def _channel(self, name):
+        ch = self.server.channels.get(name)
+        if ch is None:
+            ch = self.server.channels[name] = Channel(name)
+
+        return ch
+
+    def _source(self, worker, key, ch):
+        if not key:
+            return None
+
+        source = self._sources.get((worker, key))
+        if source is None:
+            source = (f"worker{worker}", None, key)
+            self._sources[(worker, key)] = source
+            self._remote[source] = (worker, key)
+
+        # the channel object changes if it got closed and reopened here
+        self.server._channel_of[source] = ch
+        return source
+
+    def _handle(self, worker, rec):
+        kind, sets, flags, dest, clen, slen = bus_record_t.unpack_from(rec)
+        if dest >= 0 and dest != self.worker:
+            return
+
+        pos = bus_record_t.size
+        channel = bytes(rec[pos:pos + clen]).decode("utf-8")
+        key = bytes(rec[pos + clen:pos + clen + slen]).decode("utf-8")
+        payload = bytes(rec[pos + clen + slen:])
+        srv = self.server
+
+        if kind == K_PRESENCE:
+            counts = presence_t.unpack(payload)
+            if any(counts):
+                self._presence[(worker, channel)] = counts
+
+            else:
+                self._presence.pop((worker, channel), None)
+
+            return
+
+        if kind == K_REPLY:
+            token, = reply_t.unpack_from(payload)
+            req = self._requests.pop(token, None)
+            if req is not None:
+                srv.answer_manager_request(req, payload[reply_t.size:])
+
+            return
+
+        if kind == K_RESYNC:
+            self._resync(worker)
+            return
+
+        if kind == K_STATE:
+            self._handle_state(worker, payload)
+            return
+
+        if kind == K_GONE:
+            source = self._sources.pop((worker, key), None)
+            if source is not None:
+                del self._remote[source]
+                srv.source_gone(source)
+
+            return
+
+        ch = self._channel(channel)
+        if kind == K_POSE:
+            srv.publish_pose_frame(payload, self._source(worker, key, ch))
+
+        elif kind == K_LAST:
+            srv.keep_last_frame(payload, self._source(worker, key, ch), ch)
+
+        elif kind == K_SEND:
+            srv.broadcast(
+                payload, ch, role_set_names(sets), self._source(worker, key, ch), # noqa E501
+                urgent=bool(flags & F_URGENT),
+                record=bool(flags & F_RECORD),
+                skip_responders=bool(flags & F_NO_RESPONDERS)
+            )
+
+        elif kind == K_PARTIAL:
+            srv.handle_pose_frame(payload, self._source(worker, key, ch))
+
+        elif kind == K_LAYOUT:
+            udu = payload.decode("utf-8")
+            if not ch.same_layout(udu):
+                ch.set_layout(udu)
+                srv._compact_layout(ch)
+
+        elif kind == K_REQUEST:
+            token, mode = request_t.unpack_from(payload)
+            requester = (f"worker{worker}", None, f"request{token}")
+            self._requesters[requester] = (worker, token)
+            if len(self._requesters) > self.max_pending:
+                self._requesters.popitem(last=False)
+
+            msg = payload[request_t.size:]
+            srv._record(REC_MANAGER, requester, msg)
+            if not srv.remote_manager_request(msg, ch, ManagerRequest(requester), mode): # noqa E501
+                # nobody here to ask
+                self._requesters.pop(requester, None)
@@ -0,0 +1,105 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Session channels, so independent setups can share one server.
+
+a connection picks its channel in the id message, 'hello channel=rig1',
+connections without one are on the default channel, everything is only
+routed within a channel
+
+id line options are new in 0.10, older servers match id lines as a whole,
+so 'hello channel=rig1' or 'monky role=driver' is an unknown id to them
+"""
+from .merge import parse_udu
+from .relay import POSE_TERMINATOR
+
+DEFAULT_CHANNEL = ""
+
+# connection sets of a channel, one per role
+ROLE_SETS = (
+    "conz",
+    "driver_conz",
+    "sideband_driver_conz",
+    "poser_conz",
+    "manager_conz",
+    "monitor_conz",
+)
+
+
+def parse_id(id_msg):
+    """
+    split an id message into (id, options)
+
+    example:
+        parse_id(b"monitor channel=rig1 rate=30")
+        # (b"monitor", {b"channel": b"rig1", b"rate": b"30"})
+    """
+    base, *opts = id_msg.split(b" ")
+    return base, dict(i.split(b"=", 1) for i in opts if b"=" in i)
+
+
+class Channel:
+    """
+    connections of one channel, per role, and the newest frame of every pose source
+
+    the role sets are dicts used as ordered sets, so membership is O(1)
+    and fan-out only ever touches connections of this channel
+    """
+
+    __slots__ = ["name", "last_frames", "udu", "device_types", "device_sizes", "frame_size", "responders", *ROLE_SETS] # noqa E501
+
+    def __init__(self, name=DEFAULT_CHANNEL):
+        """:name: channel name, stored in self.name"""
+        self.name = name
+        self.last_frames = {}
+        self.udu = None
+        self.device_types = None
+        self.device_sizes = None
+        self.frame_size = None
+        self.responders = {}  # managers that answer requests, the drivers
+        for i in ROLE_SETS:
+            setattr(self, i, {})
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} name={repr(self.name)} connections={len(self)} object at {hex(id(self))}>" # noqa E501
+
+    def __len__(self):
+        return sum(len(getattr(self, i)) for i in ROLE_SETS)
+
+    def set_layout(self, udu_string):
+        """
+        set the channel's udu layout, full frames of any other size are dropped,
+        raises ValueError on a bad udu string
+        """
+        types, sizes = parse_udu(udu_string)
+        self.udu = udu_string
+        self.device_types = types
+        self.device_sizes = sizes
+        self.frame_size = sum(sizes) * 4 + len(POSE_TERMINATOR)
+
+    def same_layout(self, udu_string):
+        """
+        True if :udu_string: is the channel's layout, in either format,
+        'h c c' and 'h13 c22 c22' are the same layout
+        """
+        if self.udu is None:
+            return False
+
+        try:
+            return parse_udu(udu_string) == (self.device_types, self.device_sizes) # noqa E501
+
+        except ValueError:
+            return False
+
+    def add(self, role_set, me):
+        """add a connection to one of ROLE_SETS"""
+        getattr(self, role_set)[me] = None
+
+    def remove(self, me):
+        """forget a connection, whatever its role"""
+        for i in ROLE_SETS:
+            getattr(self, i).pop(me, None)
+
+        self.last_frames.pop(me, None)
+        self.responders.pop(me, None)
@@ -0,0 +1,337 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Compact pose frames, 'enc=q' in the id message.
+
+a float frame spends 4 bytes on every value, buttons included, a compact
+frame quantizes them and groups them by kind, so encoding and decoding are
+a handful of numpy operations whatever the device count:
+
+    b"hvqf"
+    int16 positions, n x 3, in 1/POS_SCALE meters, +-8.19m
+    int16 rotations, n x 3, smallest three quaternion components
+    int16 velocities, m x 6, devices that send them only, 1/VEL_SCALE m/s
+        and 1/ANG_VEL_SCALE rad/s
+    int16 trackpads, k x 2, controllers only
+    uint8 flags, n, bits 0-1 index of the dropped quaternion component,
+        bits 2-7 grip, system, menu, trackpad_click, trackpad_touch,
+        trigger_click, controllers only
+    uint8 triggers, k, controllers only
+    terminator
+
+n devices, m of them with velocities, k controllers, a tracker is 13 bytes,
+25 with velocities, instead of 52, a controller 18 or 30 instead of 88
+
+compact frames have a fixed size, so CompactReader cuts them by size, not
+at the terminator, which a quantized value can contain
+
+posers: 'holla udu=h,c,t enc=q vel=110', vel is one digit per device,
+0 for devices that never send velocities, all 1 if left out, the server
+decodes the frames into normal float frames right away
+drivers: 'hello enc=q udu=h,c,t vel=110', the server encodes their frames
+
+decoded rotations can come back negated, it's the same rotation, w >= 0
+"""
+import numpy as np
+
+from .merge import parse_udu, DEVICE_SIZES
+from .relay import POSE_TERMINATOR
+from .heartbeat import HEARTBEAT_MSG
+
+COMPACT_MAGIC = b"hvqf"
+COMPACT_ENCODING = b"q"
+
+POS_SCALE = 4000  # 0.25mm steps
+VEL_SCALE = 1000
+ANG_VEL_SCALE = 500
+_KEEP = max(len(COMPACT_MAGIC), len(HEARTBEAT_MSG)) - 1
+_QUAT_SCALE = 32767 * np.sqrt(2)  # the smallest three are within +-1/sqrt(2)
+
+# float frame offsets within a device
+_POS = [0, 1, 2]
+_QUAT = [3, 4, 5, 6]
+_VEL = [7, 8, 9, 10, 11, 12]
+_BUTTONS = [13, 14, 15, 16, 20, 21]
+_TRIGGER = 17
+_TRACKPAD = [18, 19]
+
+
+def parse_velocity_mask(mask, devices):
+    """
+    'vel=110' option value -> list of bools, one per device,
+    None is all True, raises ValueError if it doesn't fit :devices:
+    """
+    if mask is None:
+        return [True] * devices
+
+    if isinstance(mask, bytes):
+        mask = mask.decode("utf-8", "replace")
+
+    if len(mask) != devices or set(mask) - {"0", "1"}:
+        raise ValueError(f"velocity mask {repr(mask)} doesn't fit {devices} device(s)") # noqa E501
+
+    return [i == "1" for i in mask]
+
+
+def velocity_mask(velocity):
+    """list of bools -> 'vel=110' option value"""
+    return "".join("1" if i else "0" for i in velocity)
+
+
+class CompactCodec:
+    """
+    converts between float frames and compact frames of one layout
+
+    example:
+        codec = CompactCodec("h c c", velocity=[True, False, False])
+        compact = codec.encode_frame(float_frame)
+        codec.decode_frame(compact) == float_frame  # give or take quantization
+
+    encode_frame and decode_frame return reused buffers,
+    copy them if they have to outlive the next call
+    """
+
+    def __init__(self, udu_string, velocity=None, terminator=POSE_TERMINATOR):
+        """
+        :udu_string: device layout, 'h c c' or 'h13 c22 c22', default sizes only
+        :velocity: a bool per device, False for devices that never send
+            velocities, None is all True, stored in self.velocity
+        :terminator: frame terminator
+        """
+        self.device_types, sizes = parse_udu(udu_string)
+        if sizes != [DEVICE_SIZES[i] for i in self.device_types]:
+            raise ValueError(f"compact frames need default device sizes, not {repr(udu_string)}") # noqa E501
+
+        if velocity is None:
+            velocity = [True] * len(sizes)
+
+        if len(velocity) != len(sizes):
+            raise ValueError(f"{len(velocity)} velocity flag(s) for {len(sizes)} device(s)") # noqa E501
+
+        self.velocity = list(velocity)
+        self.terminator = terminator
+        self.clipped = 0
+
+        offsets = np.cumsum([0] + sizes[:-1])
+        ctrl = offsets[[i == "c" for i in self.device_types]]
+        vel = offsets[self.velocity]
+        n, m, k = len(offsets), len(vel), len(ctrl)
+
+        # flat float frame indices of every block
+        self._pos_idx = offsets[:, None] + _POS
+        self._quat_idx = offsets[:, None] + _QUAT
+        self._vel_idx = vel[:, None] + _VEL
+        self._button_idx = ctrl[:, None] + _BUTTONS
+        self._trigger_idx = ctrl + _TRIGGER
+        self._trackpad_idx = ctrl[:, None] + _TRACKPAD
+        self._ctrl = np.array([i == "c" for i in self.device_types])
+        self._vel_scale = np.array([VEL_SCALE] * 3 + [ANG_VEL_SCALE] * 3, dtype=np.float32) # noqa E501
+        self._button_bits = (1 << np.arange(2, 8)).astype(np.uint8)
+
+        self.values = sum(sizes)
+        self.float_size = self.values * 4 + len(terminator)
+        self._floats = np.zeros(self.values, dtype=np.float32)
+        self._float_buff = bytearray(self.float_size)
+        self._float_buff[-len(terminator):] = terminator
+        self._float_view = np.frombuffer(self._float_buff, dtype=np.float32, count=self.values) # noqa E501
+
+        # compact frame blocks, int16 ones first so they stay aligned
+        blocks = [
+            ("pos", np.int16, (n, 3)),
+            ("quat", np.int16, (n, 3)),
+            ("vel", np.int16, (m, 6)),
+            ("trackpad", np.int16, (k, 2)),
+            ("flags", np.uint8, (n,)),
+            ("trigger", np.uint8, (k,)),
+        ]
+        off = len(COMPACT_MAGIC)
+        self._blocks = []
+        for name, dtype, shape in blocks:
+            count = int(np.prod(shape))
+            self._blocks.append((name, dtype, shape, off, count))
+            off += count * np.dtype(dtype).itemsize
+
+        self.size = off + len(terminator)
+        self._buff = bytearray(COMPACT_MAGIC + bytes(off - len(COMPACT_MAGIC)) + terminator) # noqa E501
+        self._views = self._map(self._buff)
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} devices={len(self.device_types)} size={self.size} float_size={self.float_size} object at {hex(id(self))}>" # noqa E501
+
+    def _map(self, buff):
+        return {
+            name: np.frombuffer(buff, dtype=dtype, count=count, offset=off).reshape(shape) # noqa E501
+            for name, dtype, shape, off, count in self._blocks
+        }
+
+    def _quantize(self, out, vals, scale, lo=-32767, hi=32767):
+        scaled = np.rint(vals * scale)
+        clipped = (scaled < lo) | (scaled > hi)
+        if clipped.any():
+            self.clipped += int(clipped.sum())
+            np.clip(scaled, lo, hi, out=scaled)
+
+        out[...] = scaled
+
+    def encode(self, values):
+        """
+        float32 values of a whole frame, no terminator, -> compact frame,
+        raises ValueError if they don't fit the layout
+        """
+        if len(values) != self.values:
+            raise ValueError(f"{len(values)} values, {repr(self)} takes {self.values}") # noqa E501
+
+        v = self._views
+        self._quantize(v["pos"], values[self._pos_idx], POS_SCALE)
+
+        # smallest three, the largest component is dropped and made positive
+        q = values[self._quat_idx].astype(np.float64)
+        norm = np.sqrt((q * q).sum(axis=1, keepdims=True))
+        q = np.where(norm > 0, q / np.where(norm > 0, norm, 1), [1, 0, 0, 0])
+        largest = np.abs(q).argmax(axis=1)
+        q *= np.where(q[np.arange(len(q)), largest] < 0, -1, 1)[:, None]
+        drop = np.arange(4) == largest[:, None]
+        self._quantize(v["quat"], q[~drop].reshape(-1, 3), _QUAT_SCALE)
+
+        self._quantize(v["vel"], values[self._vel_idx], self._vel_scale)
+        self._quantize(
+            v["trackpad"], np.clip(values[self._trackpad_idx], -1, 1), 32767
+        )
+        v["trigger"][...] = np.rint(np.clip(values[self._trigger_idx], 0, 1) * 255) # noqa E501
+
+        flags = largest.astype(np.uint8)
+        pressed = values[self._button_idx] > 0.5
+        flags[self._ctrl] |= (pressed * self._button_bits).sum(axis=1).astype(np.uint8) # noqa E501
+        v["flags"][...] = flags
+        return self._buff
+
+    def encode_frame(self, frame):
+        """float frame, terminator optional -> compact frame, None if it doesn't fit""" # noqa E501
+        if len(frame) not in (self.float_size, self.float_size - len(self.terminator)): # noqa E501
+            return None
+
+        return self.encode(np.frombuffer(frame, dtype=np.float32, count=self.values)) # noqa E501
+
+    def decode(self, frame):
+        """
+        compact frame, terminator optional -> float32 values,
+        raises ValueError if it isn't one of this layout
+        """
+        if len(frame) not in (self.size, self.size - len(self.terminator)) or not frame.startswith(COMPACT_MAGIC): # noqa E501
+            raise ValueError(f"not a compact frame of {repr(self)}")
+
+        v = self._map(frame)
+        out = self._floats
+        out[self._pos_idx] = v["pos"] / POS_SCALE
+
+        flags = v["flags"]
+        rest = v["quat"] / _QUAT_SCALE
+        largest = np.sqrt(np.maximum(0, 1 - (rest * rest).sum(axis=1)))
+        drop = np.arange(4) == (flags & 3)[:, None]
+        q = np.empty((len(flags), 4))
+        q[drop] = largest
+        q[~drop] = rest.ravel()
+        q *= np.where(q[:, 0] < 0, -1, 1)[:, None]
+        out[self._quat_idx] = q
+
+        out[self._vel_idx] = v["vel"] / self._vel_scale
+        out[self._trackpad_idx] = v["trackpad"] / 32767
+        out[self._trigger_idx] = v["trigger"] / 255
+        out[self._button_idx] = (flags[self._ctrl][:, None] & self._button_bits) != 0 # noqa E501
+        return out
+
+    def decode_frame(self, frame):
+        """compact frame -> float frame, terminator included, None if it isn't one""" # noqa E501
+        try:
+            self._float_view[:] = self.decode(frame)
+
+        except ValueError:
+            return None
+
+        return self._float_buff
+
+
+class CompactReader:
+    """
+    cuts compact frames out of a stream and decodes them into float frames
+
+    example:
+        r = CompactReader(CompactCodec("h c c"))
+        r.feed(data)  # -> [float frame, ..]
+
+    anything between frames is skipped, heartbeats there are counted in
+    self.heartbeats, frames that don't end in the terminator in self.malformed
+    """
+
+    __slots__ = ["codec", "max_size", "overflows", "malformed", "heartbeats", "_buff"] # noqa E501
+
+    def __init__(self, codec, max_size=1 << 16):
+        """
+        :codec: CompactCodec of the stream, stored in self.codec
+        :max_size: most bytes kept around without a frame in them
+        """
+        self.codec = codec
+        self.max_size = max_size
+        self.overflows = 0
+        self.malformed = 0
+        self.heartbeats = 0
+        self._buff = bytearray()
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} size={self.codec.size} malformed={self.malformed} object at {hex(id(self))}>" # noqa E501
+
+    def feed(self, data):
+        """feed a chunk, returns a list of decoded float frames, terminators included""" # noqa E501
+        self._buff.extend(data)
+        buff = self._buff
+        size = self.codec.size
+        frames = []
+        start = 0
+        while 1:
+            i = buff.find(COMPACT_MAGIC, start)
+            if i == -1:
+                # count every whole heartbeat, keep only what could be the
+                # start of a frame or a heartbeat at the very end
+                self._skip(start, len(buff))
+                last = buff.rfind(HEARTBEAT_MSG, start)
+                if last != -1:
+                    start = last + len(HEARTBEAT_MSG)
+
+                start = max(start, len(buff) - _KEEP)
+                break
+
+            self._skip(start, i)
+            if len(buff) - i < size:
+                start = i
+                break
+
+            frame = bytes(buff[i:i + size])
+            if not frame.endswith(self.codec.terminator):
+                # not a frame start after all, look further
+                self.malformed += 1
+                start = i + 1
+                continue
+
+            decoded = self.codec.decode_frame(frame)
+            if decoded is not None:
+                frames.append(bytes(decoded))
+
+            start = i + size
+
+        if start:
+            del buff[:start]
+
+        if len(buff) > self.max_size:
+            buff.clear()
+            self.overflows += 1
+
+        return frames
+
+    def _skip(self, start, end):
+        if end > start:
+            self.heartbeats += self._buff.count(HEARTBEAT_MSG, start, end)
+
+    def pending(self):
+        """number of buffered bytes that are not a complete frame yet"""
+        return len(self._buff)
@@ -0,0 +1,312 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""Per connection outbound queues, so one slow reader can't stall the others."""
+import asyncio
+import time
+from collections import deque
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+DISCONNECT = "disconnect"
+
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+
+class Subscriber:
+    """
+    bounded outbound queue and writer task of a single connection
+
+    messages are only queued by self.put, the actual writes and drains
+    happen in a separate task, so whoever calls self.put never waits
+
+    messages put with a :key: are coalesced, if a message with the same
+    key is still queued it is replaced in place(latest wins)
+
+    urgent messages(manager traffic) skip the queue and go straight into the
+    transport, ahead of whatever poses are still queued, they are never
+    dropped or coalesced
+
+    overflow policies:
+        drop-oldest - throw away the oldest queued message
+        drop-newest - throw away the message being put
+        disconnect - close the connection
+    """
+
+    def __init__(self, me, maxsize=64, policy=DROP_OLDEST):
+        """
+        :me: connection tuple (addr, writer, name), stored in self.me
+        :maxsize: max number of queued messages, stored in self.maxsize
+        :policy: overflow policy, one of OVERFLOW_POLICIES, stored in self.policy
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {repr(policy)}")
+
+        self.me = me
+        self.maxsize = maxsize
+        self.policy = policy
+
+        self.dropped = 0
+        self.closed = False
+        self.bytes_out = 0
+        self.msgs_out = 0
+        self.urgent_out = 0
+
+        self._queue = deque()
+        self._keyed = {}
+        self._ready = asyncio.Event()
+        self._task = self._start()
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} addr={self.me[0]} queued={len(self._queue)} dropped={self.dropped} policy={repr(self.policy)} object at {hex(id(self))}>" # noqa E501
+
+    def __len__(self):
+        return len(self._queue)
+
+    def buffer_size(self):
+        """bytes sitting in the transport's write buffer"""
+        try:
+            writer = self.me[1]
+            return getattr(writer, "transport", writer).get_write_buffer_size()
+
+        except Exception:
+            return 0
+
+    def put(self, msg, key=None, urgent=False):
+        """
+        queue a message, never blocks
+
+        returns False if the message was dropped or the subscriber is closed
+        """
+        if self.closed:
+            return False
+
+        if urgent:
+            try:
+                self.me[1].write(msg)
+
+            except Exception as e:
+                print(f"urgent write to {self.me[0]} failed: {e}")
+                return False
+
+            self.bytes_out += len(msg)
+            self.msgs_out += 1
+            self.urgent_out += 1
+            return True
+
+        if key is not None:
+            entry = self._keyed.get(key)
+            if entry is not None:
+                entry[1] = msg
+                self.dropped += 1
+                return True
+
+        if len(self._queue) >= self.maxsize:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+
+            elif self.policy == DROP_OLDEST:
+                old = self._queue.popleft()
+                if old[0] is not None:
+                    self._keyed.pop(old[0], None)
+                self.dropped += 1
+
+            else:
+                print(f"{self.me[0]} outbound queue overflow, disconnecting")
+                self.close()
+                return False
+
+        entry = [key, msg]
+        self._queue.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+
+        self._ready.set()
+        return True
+
+    def close(self):
+        """stop the writer task and close the connection's writer"""
+        if self.closed:
+            return
+
+        self.closed = True
+        self._queue.clear()
+        self._keyed.clear()
+        if self._task is not None:
+            self._task.cancel()
+        try:
+            self.me[1].close()
+
+        except Exception:
+            pass
+
+    def _start(self):
+        return asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        writer = self.me[1]
+        try:
+            while 1:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+
+                # everything queued goes out in one write
+                batch = []
+                while self._queue:
+                    key, msg = self._queue.popleft()
+                    if key is not None:
+                        self._keyed.pop(key, None)
+                    batch.append(msg)
+
+                msg = b"".join(batch)
+                writer.write(msg)
+                self.bytes_out += len(msg)
+                self.msgs_out += len(batch)
+                await writer.drain()
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            print(f"writer for {self.me[0]} broke: {e}")
+            self.closed = True
+
+
+class TransportSubscriber(Subscriber):
+    """
+    Subscriber of the protocol engine, :me: holds a transport instead of a writer
+
+    messages go straight into the transport while it takes them, once it asks
+    for a pause they are queued(coalesced, overflow policy, all the same) and go
+    out in a single writelines when it resumes, there is no writer task
+    """
+
+    def __init__(self, me, maxsize=64, policy=DROP_OLDEST):
+        """see Subscriber"""
+        super().__init__(me, maxsize, policy)
+        self.paused = False
+
+    def _start(self):
+        return None
+
+    def put(self, msg, key=None, urgent=False):
+        """write or queue a message, never blocks, see Subscriber.put"""
+        if self.closed:
+            return False
+
+        if not urgent and (self.paused or self._queue):
+            return super().put(msg, key)
+
+        try:
+            self.me[1].write(msg)
+
+        except Exception as e:
+            print(f"writer for {self.me[0]} broke: {e}")
+            self.closed = True
+            return False
+
+        self.bytes_out += len(msg)
+        self.msgs_out += 1
+        if urgent:
+            self.urgent_out += 1
+
+        return True
+
+    def pause(self):
+        """the transport's buffer is full"""
+        self.paused = True
+
+    def resume(self):
+        """the transport's buffer drained, flush whatever queued up"""
+        self.paused = False
+        if not self._queue or self.closed:
+            return
+
+        batch = []
+        while self._queue:
+            key, msg = self._queue.popleft()
+            if key is not None:
+                self._keyed.pop(key, None)
+            batch.append(msg)
+
+        self.me[1].writelines(batch)
+        self.bytes_out += sum(len(i) for i in batch)
+        self.msgs_out += len(batch)
+
+
+class Decimator:
+    """
+    per source rate limiter for monitor connections
+
+    either at most :rate: frames per second or one frame in :every:, per source
+
+    example:
+        d = Decimator.from_spec(b"rate=30")
+        if d.accept(source):
+            sub.put(frame, key=source)
+    """
+
+    __slots__ = ["rate", "every", "_last"]
+
+    def __init__(self, rate=10, every=None):
+        """
+        :rate: max frames per second per source, stored in self.rate
+        :every: pass one frame in this many instead, stored in self.every
+
+        raises ValueError if the one in use isn't positive
+        """
+        if every is not None and not every >= 1:
+            raise ValueError(f"every has to be 1 or more, not {every}")
+
+        if every is None and not rate > 0:
+            raise ValueError(f"rate has to be positive, not {rate}")
+
+        self.rate = rate
+        self.every = every
+        self._last = {}
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} rate={self.rate} every={self.every} object at {hex(id(self))}>" # noqa E501
+
+    @classmethod
+    def from_spec(cls, spec, default_rate=10):
+        """
+        build one from the options of a monitor id message,
+        b"rate=30", b"every=4" or nothing for :default_rate:,
+        bad or non positive values get :default_rate: too
+        """
+        opts = dict(
+            i.split(b"=", 1) for i in spec.split() if b"=" in i
+        )
+        try:
+            if b"every" in opts:
+                return cls(every=max(int(opts[b"every"]), 1))
+
+            return cls(rate=float(opts.get(b"rate", default_rate)))
+
+        except ValueError:
+            print(f"bad monitor options {repr(spec)}, using {default_rate}Hz")
+            return cls(rate=default_rate)
+
+    def accept(self, source, now=None):
+        """True if a frame from :source: should go out now"""
+        if self.every is not None:
+            n = self._last.get(source, 0) + 1
+            self._last[source] = n % self.every
+            return n == 1 or self.every == 1
+
+        if now is None:
+            now = time.monotonic()
+
+        last = self._last.get(source)
+        if last is not None and now - last < 1 / self.rate:
+            return False
+
+        self._last[source] = now
+        return True
+
+    def forget(self, source):
+        """forget everything about :source:"""
+        self._last.pop(source, None)
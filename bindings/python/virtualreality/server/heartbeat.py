@@ -0,0 +1,138 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Heartbeats and dead connection reaping.
+
+a half open connection, a poser laptop that went to sleep, a crashed driver,
+looks alive until a write fails, which can take minutes, so the server checks
+every connection every heartbeat interval:
+
+    stalled - bytes sit in the transport's write buffer and it hasn't gone
+        down for the idle timeout, works for every client, old ones too
+    silent - connections that asked for heartbeats, 'hello hb=1', get
+        HEARTBEAT_MSG every interval and have to say something, anything,
+        within the idle timeout, the usual answer is HEARTBEAT_MSG back
+
+HEARTBEAT_MSG ends like a pose frame and like a line, drivers, posers and
+'ids=1' managers can all pick it out of what they read, the server never
+forwards it, a heartbeat cut in two by the reads is put back together
+first, see HeartbeatFilter
+"""
+import time
+
+HEARTBEAT_MSG = b"HBEAT\t\r\n"
+
+
+class HeartbeatFilter:
+    """
+    takes heartbeats out of a connection's stream
+
+    a read can end in the middle of a heartbeat, what could be the start of
+    one is held back until the next read says what it is
+
+    example:
+        f = HeartbeatFilter()
+        f.feed(b"abc\\t\\r\\nHBE")  # -> b"abc\\t\\r\\n"
+        f.feed(b"AT\\t\\r\\ndef")  # -> b"def"
+    """
+
+    __slots__ = ["heartbeats", "_tail"]
+
+    def __init__(self):
+        self.heartbeats = 0
+        self._tail = b""
+
+    def feed(self, data):
+        """feed a chunk, returns it without heartbeats, can be empty"""
+        if self._tail:
+            data = self._tail + data
+            self._tail = b""
+
+        if HEARTBEAT_MSG in data:
+            self.heartbeats += data.count(HEARTBEAT_MSG)
+            data = data.replace(HEARTBEAT_MSG, b"")
+
+        for i in range(min(len(HEARTBEAT_MSG) - 1, len(data)), 0, -1):
+            if data.endswith(HEARTBEAT_MSG[:i]):
+                self._tail = data[-i:]
+                return data[:-i]
+
+        return data
+
+
+class Reaper:
+    """
+    finds dead connections, see the module docs
+
+    example:
+        reaper = Reaper(idle_timeout=5)
+        for conn, reason in reaper.sweep(connections, subscribers):
+            ...  # close conn
+    """
+
+    def __init__(self, idle_timeout=5):
+        """:idle_timeout: seconds a connection can be stalled or silent, stored in self.idle_timeout""" # noqa E501
+        self.idle_timeout = idle_timeout
+        self.heartbeats_out = 0
+        self.stalled = 0
+        self.silent = 0
+
+        self._stalls = {}  # me -> (stalled since, write buffer size)
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} idle_timeout={self.idle_timeout} stalled={self.stalled} silent={self.silent} object at {hex(id(self))}>" # noqa E501
+
+    def sweep(self, conns, subscribers):
+        """
+        check :conns:, server.Connection objects, and send heartbeats
+
+        :subscribers: connection tuple -> its Subscriber
+        returns a list of (connection, reason) to close
+        """
+        now = time.monotonic()
+        ret = []
+        for conn in conns:
+            sub = subscribers.get(conn.me)
+            if sub is None:
+                continue
+
+            size = sub.buffer_size()
+            stall = self._stalls.get(conn.me)
+            if not size:
+                self._stalls.pop(conn.me, None)
+
+            elif stall is None or size < stall[1]:
+                # new, or going down, so still moving
+                self._stalls[conn.me] = (now, size)
+
+            elif now - stall[0] > self.idle_timeout:
+                self.stalled += 1
+                ret.append((conn, f"nothing written for {now - stall[0]:.1f}s")) # noqa E501
+                continue
+
+            if not conn.heartbeat:
+                continue
+
+            if now - conn.stats.last_seen > self.idle_timeout:
+                self.silent += 1
+                ret.append((conn, f"silent for {now - conn.stats.last_seen:.1f}s")) # noqa E501
+                continue
+
+            if sub.put(HEARTBEAT_MSG, urgent=True):
+                self.heartbeats_out += 1
+
+        return ret
+
+    def forget(self, me):
+        """a connection is gone"""
+        self._stalls.pop(me, None)
+
+    def stats(self):
+        """counters as a json friendly dict"""
+        return {
+            "idle_timeout": self.idle_timeout,
+            "heartbeats_out": self.heartbeats_out,
+            "stalled": self.stalled,
+            "silent": self.silent,
+        }
@@ -0,0 +1,264 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Manager requests and driver replies, matched up so replies only go back to whoever asked.
+
+the driver answers every settings manager message with '2000' or '-100', in
+order and without an id, so the server keeps a queue of outstanding requests
+per connection it sent them to, each reply takes the oldest one, requests
+that waited longer than REPLY_TIMEOUT are dropped first, their reply got
+lost, so one lost reply doesn't shift every later one onto the wrong request,
+a reconnecting driver is a new connection with a queue of its own
+
+managers that say 'monky ids=1' get request ids on top of that:
+    up - request_header_t(magic b"hvmq", request id), then the message as usual
+    down - reply_t(magic b"hvmr", request id, 4 byte reply)
+
+the server confirms with a reply to request id 0 right after the id line,
+servers before 0.10 don't know id line options at all, 'monky ids=1' is an
+unknown id to them, managers that don't get the reply start over with a
+plain 'monky' on a new connection
+"""
+import struct
+import time
+from collections import deque
+
+REQUEST_MAGIC = b"hvmq"
+REPLY_MAGIC = b"hvmr"
+
+request_header_t = struct.Struct("<4sI")
+reply_t = struct.Struct("<4sI4s")
+
+MANAGER_REPLIES = (b"2000", b"-100")
+IDS_ACK = reply_t.pack(REPLY_MAGIC, 0, b"2000")
+
+# settings manager message plus terminator, see templates.template_base.settManager_Message_t # noqa E501
+MANAGER_MSG_SIZE = 130 * 4 + 3
+
+STATS_MSG = b"STATS\n"
+
+# seconds a request waits for its reply, managers give up after as long
+REPLY_TIMEOUT = 5
+
+
+def pack_request(rid, msg):
+    """a terminated manager message with a request id"""
+    return request_header_t.pack(REQUEST_MAGIC, rid) + msg
+
+
+def pack_reply(rid, reply):
+    """a 4 byte driver reply with a request id"""
+    return reply_t.pack(REPLY_MAGIC, rid, reply)
+
+
+class PlainRequestReader:
+    """
+    server side of a plain manager connection, cuts the stream into messages
+
+    messages are cut by size, MANAGER_MSG_SIZE, never by the terminator,
+    its bytes can show up in the uint32 values, STATS queries come out as
+    STATS_MSG
+
+    example:
+        r = PlainRequestReader()
+        for msg in r.feed(data):
+            ...
+    """
+
+    __slots__ = ["_buff"]
+
+    def __init__(self):
+        """init"""
+        self._buff = bytearray()
+
+    def feed(self, data):
+        """add received bytes, returns a list of whole messages"""
+        self._buff += data
+        ret = []
+        pos = 0
+        while 1:
+            if self._buff.startswith(STATS_MSG, pos):
+                ret.append(STATS_MSG)
+                pos += len(STATS_MSG)
+                continue
+
+            end = pos + MANAGER_MSG_SIZE
+            if len(self._buff) < end:
+                break
+
+            ret.append(bytes(self._buff[pos:end]))
+            pos = end
+
+        del self._buff[:pos]
+        return ret
+
+    def pending(self):
+        """number of buffered bytes that are not a whole message yet"""
+        return len(self._buff)
+
+
+class RequestReader:
+    """
+    server side of an 'ids=1' manager connection, turns a byte stream back into requests
+
+    yields (request id, message), STATS queries come out as (None, STATS_MSG)
+
+    example:
+        r = RequestReader()
+        for rid, msg in r.feed(data):
+            ...
+    """
+
+    __slots__ = ["_buff"]
+
+    def __init__(self):
+        """init"""
+        self._buff = bytearray()
+
+    def feed(self, data):
+        """
+        add received bytes, returns a list of (request id, message)
+
+        raises ValueError if the stream is not a request stream
+        """
+        self._buff += data
+        ret = []
+        pos = 0
+        while 1:
+            if self._buff.startswith(STATS_MSG, pos):
+                ret.append((None, STATS_MSG))
+                pos += len(STATS_MSG)
+                continue
+
+            end = pos + request_header_t.size + MANAGER_MSG_SIZE
+            if len(self._buff) < end:
+                break
+
+            magic, rid = request_header_t.unpack_from(self._buff, pos)
+            if magic != REQUEST_MAGIC:
+                raise ValueError("bad manager request header")
+
+            ret.append((rid, bytes(self._buff[pos + request_header_t.size:end]))) # noqa E501
+            pos = end
+
+        del self._buff[:pos]
+        return ret
+
+
+class ReplyReader:
+    """
+    manager side of an 'ids=1' connection
+
+    yields (request id, reply), anything that is not a reply, like a STATS
+    report line, comes out as (None, line)
+    """
+
+    __slots__ = ["_buff"]
+
+    def __init__(self):
+        """init"""
+        self._buff = bytearray()
+
+    def feed(self, data):
+        """add received bytes, returns a list of (request id, reply)"""
+        self._buff += data
+        ret = []
+        pos = 0
+        while len(self._buff) - pos >= 4:
+            if self._buff.startswith(REPLY_MAGIC, pos):
+                if len(self._buff) - pos < reply_t.size:
+                    break
+
+                _, rid, reply = reply_t.unpack_from(self._buff, pos)
+                ret.append((rid, reply))
+                pos += reply_t.size
+                continue
+
+            end = self._buff.find(b"\n", pos)
+            if end == -1:
+                break
+
+            ret.append((None, bytes(self._buff[pos:end + 1])))
+            pos = end + 1
+
+        del self._buff[:pos]
+        return ret
+
+
+class ManagerRequest:
+    """an outstanding request, answered by the first reply that comes back"""
+
+    __slots__ = ["requester", "rid", "t0", "answered"]
+
+    def __init__(self, requester, rid=None):
+        """
+        :requester: connection the reply goes back to
+        :rid: request id, None for managers without ids
+        """
+        self.requester = requester
+        self.rid = rid
+        self.t0 = time.monotonic()
+        self.answered = False
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} rid={self.rid} answered={self.answered} object at {hex(id(self))}>" # noqa E501
+
+
+class ReplyRouter:
+    """
+    outstanding requests per connection they were sent to
+
+    example:
+        router = ReplyRouter()
+        req = ManagerRequest(me, rid)
+        router.sent(driver, req)
+        ...
+        req = router.replied(driver)  # None if nothing was outstanding
+    """
+
+    def __init__(self, max_pending=64, timeout=REPLY_TIMEOUT):
+        """
+        :max_pending: outstanding requests kept per connection, the oldest go first
+        :timeout: seconds a request waits for its reply, stored in self.timeout
+        """
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.expired = 0
+        self._pending = {}
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} pending={len(self)} expired={self.expired} object at {hex(id(self))}>" # noqa E501
+
+    def __len__(self):
+        return sum(len(i) for i in self._pending.values())
+
+    def sent(self, target, req):
+        """:req: went out to :target:"""
+        q = self._pending.get(target)
+        if q is None:
+            q = self._pending[target] = deque(maxlen=self.max_pending)
+
+        q.append(req)
+
+    def replied(self, target, now=None):
+        """
+        a reply came from :target:, returns its ManagerRequest or None,
+        requests older than self.timeout are dropped and counted in self.expired
+        """
+        q = self._pending.get(target)
+        if not q:
+            return None
+
+        if now is None:
+            now = time.monotonic()
+
+        while q and now - q[0].t0 > self.timeout:
+            q.popleft()
+            self.expired += 1
+
+        return q.popleft() if q else None
+
+    def forget(self, conn):
+        """a connection is gone, so are the requests waiting on it"""
+        self._pending.pop(conn, None)
@@ -0,0 +1,149 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Multi poser device merge.
+
+a partial pose frame covers only some device slots of the full udu layout:
+    partial_header_t - magic b"hvpt", number of slots n
+    n uint16 slot indices
+    device data of those slots, in the same order, same layout as a full frame
+    terminator
+"""
+import re
+import struct
+
+PARTIAL_MAGIC = b"hvpt"
+
+partial_header_t = struct.Struct("<4sH")
+_slot_t = struct.Struct("<H")
+_float_t = struct.Struct("f")
+
+# settings manager messages, see templates.template_base.settManager_Message_t
+_settings_msg_t = struct.Struct("130I")
+EMSG_UDU_STRING = 20
+_MSG_DEVICE_TYPES = {0: "h", 1: "c", 2: "t"}
+
+# default device sizes, used if the udu string has none
+DEVICE_SIZES = {"h": 13, "c": 22, "t": 13}
+
+
+def pack_partial_header(slots):
+    """header of a partial frame covering :slots:"""
+    return partial_header_t.pack(PARTIAL_MAGIC, len(slots)) + b"".join(
+        _slot_t.pack(i) for i in slots
+    )
+
+
+def parse_udu(udu_string):
+    """
+    parse a udu string into (device types, device sizes)
+
+    takes both the driver format 'h13 c22 c22' and the poser format 'h c c'
+    """
+    if not re.fullmatch(r"([htc][0-9]*[ ])*([htc][0-9]*)", udu_string or ""):
+        raise ValueError(f"invalid udu string: {repr(udu_string)}")
+
+    types = []
+    sizes = []
+    for i in udu_string.split(" "):
+        types.append(i[0])
+        sizes.append(int(i[1:]) if len(i) > 1 else DEVICE_SIZES[i[0]])
+
+    return types, sizes
+
+
+def udu_from_settings_message(msg, terminator=b"\t\r\n"):
+    """
+    the udu string of an Emsg_uduString settings manager message, 'h13 c22 c22',
+    None if :msg: is something else, :msg: may have junk in front of it
+    """
+    size = _settings_msg_t.size + len(terminator)
+    if len(msg) < size or not msg.endswith(terminator):
+        return None
+
+    vals = _settings_msg_t.unpack_from(msg, len(msg) - size)
+    if vals[0] != EMSG_UDU_STRING or not 0 < vals[1] <= 64:
+        return None
+
+    ret = []
+    for i in range(vals[1]):
+        kind, n = vals[2 + i * 2], vals[3 + i * 2]
+        if kind not in _MSG_DEVICE_TYPES or not n:
+            return None
+
+        ret.append(f"{_MSG_DEVICE_TYPES[kind]}{n}")
+
+    return " ".join(ret)
+
+
+class FrameMerger:
+    """
+    keeps the full frame of a udu layout and patches partial frames into it
+
+    example:
+        m = FrameMerger("h13 t13 t13")
+        m.update(pack_partial_header([1, 2]) + tracker_data + b"\\t\\r\\n")
+        m.frame()  # full frame, terminator included
+    """
+
+    def __init__(self, udu_string, terminator=b"\t\r\n"):
+        """
+        :udu_string: full device layout, see parse_udu
+        :terminator: pose frame terminator
+        """
+        self.device_types, self.device_sizes = parse_udu(udu_string)
+        self.terminator = terminator
+
+        self._offsets = []
+        off = 0
+        for i in self.device_sizes:
+            self._offsets.append(off)
+            off += i * _float_t.size
+
+        self._frame = bytearray(off)
+        for i in self._offsets:
+            _float_t.pack_into(self._frame, i + 3 * _float_t.size, 1)  # r_w
+
+        self.updates = 0
+        self.rejected = 0
+        self.dirty = False
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} devices={len(self.device_sizes)} updates={self.updates} rejected={self.rejected} object at {hex(id(self))}>" # noqa E501
+
+    def update(self, partial):
+        """patch a partial frame in, returns False if it doesn't fit the layout"""
+        try:
+            magic, n = partial_header_t.unpack_from(partial)
+            if magic != PARTIAL_MAGIC:
+                raise ValueError("not a partial frame")
+
+            pos = partial_header_t.size
+            slots = [
+                _slot_t.unpack_from(partial, pos + i * _slot_t.size)[0]
+                for i in range(n)
+            ]
+            pos += n * _slot_t.size
+
+            size = sum(self.device_sizes[i] for i in slots) * _float_t.size
+            if len(partial) - pos - len(self.terminator) != size:
+                raise ValueError("size mismatch")
+
+        except (ValueError, IndexError, struct.error):
+            self.rejected += 1
+            return False
+
+        for i in slots:
+            ln = self.device_sizes[i] * _float_t.size
+            self._frame[self._offsets[i]:self._offsets[i] + ln] = partial[pos:pos + ln] # noqa E501
+            pos += ln
+
+        self.updates += 1
+        self.dirty = True
+        return True
+
+    def frame(self):
+        """the full merged frame, terminator included, clears self.dirty"""
+        self.dirty = False
+        return bytes(self._frame) + self.terminator
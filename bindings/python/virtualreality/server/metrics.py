@@ -0,0 +1,254 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""Per connection and per role counters for the server."""
+import json
+import math
+import time
+
+ROLES = ("driver", "poser", "manager", "monitor", "relay", "unidentified")
+
+# the numbers that get summed up per role
+_SUMMED = ("bytes_in", "bytes_out", "frames_in", "frames_out", "dropped", "malformed", "out_buffer") # noqa E501
+
+# seconds frame rates are averaged over, at least
+RATE_WINDOW = 1
+
+
+class ConnectionStats:
+    """
+    counters of a single connection
+
+    incoming traffic is recorded with self.record_in, outgoing traffic and
+    drops are taken from the connection's Subscriber when self.as_dict is called
+    """
+
+    __slots__ = [
+        "addr",
+        "role",
+        "channel",
+        "bytes_in",
+        "frames_in",
+        "dropped_in",
+        "malformed",
+        "connected_at",
+        "last_seen",
+        "last_seen_at",
+        "_rate_t",
+        "_rate_frames_in",
+        "_rate_frames_out",
+        "_fps_in",
+        "_fps_out",
+    ]
+
+    def __init__(self, addr, role, channel=""):
+        """
+        :addr: peer address, stored in self.addr
+        :role: one of ROLES, stored in self.role
+        :channel: channel name, stored in self.channel
+        """
+        self.addr = addr
+        self.role = role
+        self.channel = channel
+        self.bytes_in = 0
+        self.frames_in = 0
+        self.dropped_in = 0
+        self.malformed = 0
+        self.connected_at = time.time()
+        # monotonic, a wall clock step mustn't make everyone look silent,
+        # self.last_seen_at is the same moment on the wall clock, for reports
+        self.last_seen = time.monotonic()
+        self.last_seen_at = self.connected_at
+
+        self._rate_t = time.monotonic()
+        self._rate_frames_in = 0
+        self._rate_frames_out = 0
+        self._fps_in = 0
+        self._fps_out = 0
+
+    def record_in(self, nbytes, nframes):
+        """count a received chunk"""
+        self.bytes_in += nbytes
+        self.frames_in += nframes
+        self.last_seen = time.monotonic()
+        self.last_seen_at = time.time()
+
+    def as_dict(self, sub=None):
+        """
+        current counters as a json friendly dict, :sub: is the connection's Subscriber
+
+        frame rates are averaged over at least RATE_WINDOW seconds, calls in
+        between get the same rates, so the stats dump and STATS queries don't
+        shorten each other's windows
+        """
+        frames_out = sub.msgs_out if sub is not None else 0
+        now = time.monotonic()
+        idle = now - self.last_seen
+        dt = now - self._rate_t
+        if dt >= RATE_WINDOW:
+            self._fps_in = round((self.frames_in - self._rate_frames_in) / dt, 2) # noqa E501
+            self._fps_out = round((frames_out - self._rate_frames_out) / dt, 2) # noqa E501
+            self._rate_t = now
+            self._rate_frames_in = self.frames_in
+            self._rate_frames_out = frames_out
+
+        ret = {
+            "addr": f"{self.addr[0]}:{self.addr[1]}" if isinstance(self.addr, tuple) else str(self.addr), # noqa E501
+            "role": self.role,
+            "channel": self.channel,
+            "bytes_in": self.bytes_in,
+            "bytes_out": sub.bytes_out if sub is not None else 0,
+            "frames_in": self.frames_in,
+            "frames_out": frames_out,
+            "urgent_out": sub.urgent_out if sub is not None else 0,
+            "fps_in": self._fps_in,
+            "fps_out": self._fps_out,
+            "dropped": self.dropped_in + (sub.dropped if sub is not None else 0), # noqa E501
+            "malformed": self.malformed,
+            "queued": len(sub) if sub is not None else 0,
+            "out_buffer": sub.buffer_size() if sub is not None else 0,
+            "connected_for": round(time.time() - self.connected_at, 3),
+            "last_seen": round(self.last_seen_at, 3),
+            "idle": round(idle, 3),
+        }
+
+        return ret
+
+
+class LatencyHistogram:
+    """
+    log bucketed latency histogram, about 2% resolution, mergeable across processes
+
+    example:
+        h = LatencyHistogram()
+        h.add(0.00042)
+        h.percentile(99)  # seconds
+    """
+
+    RESOLUTION = 1.02
+
+    def __init__(self):
+        """init"""
+        self.buckets = {}
+        self.count = 0
+        self.max = 0
+
+    def add(self, seconds):
+        """add a sample"""
+        us = max(seconds * 1e6, 1)
+        k = int(math.log(us) / math.log(self.RESOLUTION))
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """add every sample of another histogram"""
+        for k, v in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + v
+
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """upper bound of the :p: percentile in seconds, 0 if empty"""
+        if not self.count:
+            return 0
+
+        want = self.count * p / 100
+        seen = 0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if seen >= want:
+                return min(self.RESOLUTION ** (k + 1) / 1e6, self.max)
+
+        return self.max
+
+    def as_dict(self):
+        """json friendly"""
+        return {
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "count": self.count,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """inverse of self.as_dict"""
+        ret = cls()
+        ret.buckets = {int(k): v for k, v in d["buckets"].items()}
+        ret.count = d["count"]
+        ret.max = d["max"]
+        return ret
+
+
+class ManagerRtt:
+    """
+    round trip times of manager requests, request to driver reply
+
+    example:
+        rtt = ManagerRtt()
+        rtt.add(0.0021)
+        rtt.as_dict()
+    """
+
+    def __init__(self):
+        """init"""
+        self.hist = LatencyHistogram()
+        self.last = 0
+        self.unmatched = 0
+        self.expired = 0
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} count={self.hist.count} last={self.last} object at {hex(id(self))}>" # noqa E501
+
+    def add(self, seconds):
+        """a reply came back :seconds: after its request"""
+        self.last = seconds
+        self.hist.add(seconds)
+
+    def as_dict(self):
+        """json friendly, in milliseconds"""
+        return {
+            "count": self.hist.count,
+            "unmatched": self.unmatched,
+            "expired": self.expired,
+            "last_ms": round(self.last * 1e3, 3),
+            "p50_ms": round(self.hist.percentile(50) * 1e3, 3),
+            "p99_ms": round(self.hist.percentile(99) * 1e3, 3),
+            "max_ms": round(self.hist.max * 1e3, 3),
+        }
+
+
+def snapshot(stats, subscribers, udp_endpoint=None):
+    """
+    build a full metrics report
+
+    :stats: dict of connection -> ConnectionStats
+    :subscribers: dict of connection -> Subscriber
+    :udp_endpoint: PoseDatagramProtocol or None
+    """
+    conz = [v.as_dict(subscribers.get(k)) for k, v in stats.items()]
+
+    roles = {}
+    for role in ROLES:
+        mine = [i for i in conz if i["role"] == role]
+        roles[role] = {key: sum(i[key] for i in mine) for key in _SUMMED}
+        roles[role]["connections"] = len(mine)
+        roles[role]["fps_in"] = round(sum(i["fps_in"] for i in mine), 2)
+        roles[role]["fps_out"] = round(sum(i["fps_out"] for i in mine), 2)
+
+    ret = {
+        "time": round(time.time(), 3),
+        "roles": roles,
+        "connections": conz,
+    }
+
+    if udp_endpoint is not None:
+        ret["udp"] = udp_endpoint.stats()
+
+    return ret
+
+
+def to_json_line(report):
+    """one report, one line"""
+    return json.dumps(report, separators=(",", ":")) + "\n"
@@ -0,0 +1,104 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Event loop backends and socket options for pose connections.
+
+loop backends:
+    asyncio - the default loop
+    uvloop - uvloop, if installed(pip install virtualreality[uvloop])
+    auto - uvloop if installed, asyncio otherwise
+
+the low latency socket profile:
+    TCP_NODELAY - frames go out right away, no nagle
+    SO_SNDBUF - a small send buffer, stale frames pile up in the server's
+        coalescing queues instead of the kernel
+    TCP_QUICKACK - no delayed acks at the start of a connection, linux only,
+        the kernel can turn it back off later
+"""
+import asyncio
+import socket
+
+LOOPS = ("auto", "asyncio", "uvloop")
+
+SEND_BUFFER = 1 << 15
+
+
+def loop_factory(backend="auto"):
+    """
+    event loop factory for :backend:, one of LOOPS
+
+    returns (factory, name of the backend actually used), falls back to
+    asyncio when uvloop isn't installed
+    """
+    if backend not in LOOPS:
+        raise ValueError(f"unknown event loop {repr(backend)}, expected one of {LOOPS}") # noqa E501
+
+    if backend != "asyncio":
+        try:
+            import uvloop
+            return uvloop.new_event_loop, "uvloop"
+
+        except ImportError:
+            if backend == "uvloop":
+                print("uvloop is not installed, using the asyncio event loop")
+
+    return asyncio.new_event_loop, "asyncio"
+
+
+def new_event_loop(backend="auto"):
+    """a new event loop of :backend:, set as the current one"""
+    factory, _ = loop_factory(backend)
+    loop = factory()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def run(coro, backend="auto"):
+    """
+    asyncio.run with a choice of event loop
+
+    example:
+        net.run(poser.main(), "uvloop")
+    """
+    loop = new_event_loop(backend)
+    try:
+        return loop.run_until_complete(coro)
+
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+def tune_socket(sock, send_buffer=SEND_BUFFER):
+    """
+    apply the low latency profile to a connected tcp socket,
+    options the platform doesn't have are skipped
+
+    :sock: socket, or None which does nothing,
+        writer.get_extra_info("socket") of a connection
+    :send_buffer: SO_SNDBUF in bytes, None leaves it alone
+    """
+    if sock is None:
+        return
+
+    opts = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.IPPROTO_TCP, getattr(socket, "TCP_QUICKACK", None), 1),
+    ]
+    if send_buffer:
+        opts.append((socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer))
+
+    for level, opt, value in opts:
+        if opt is None:
+            continue
+
+        try:
+            sock.setsockopt(level, opt, value)
+
+        except OSError:
+            pass
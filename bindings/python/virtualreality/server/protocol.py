@@ -0,0 +1,96 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Callback based server engine, 'server --engine=protocol'.
+
+same id handshake, same roles and routing as the streams engine, both end up
+in Server.open_connection/connection_data/connection_lost, the difference is
+how bytes get in and out:
+    in - every connection reads into its own preallocated buffer,
+        no coroutine, no StreamReader, no await per read
+    out - writes go straight into the transport, see fanout.TransportSubscriber,
+        only while the transport is paused do they queue up
+"""
+import asyncio
+
+from .fanout import TransportSubscriber
+
+
+class ServerProtocol(asyncio.BufferedProtocol):
+    """
+    a single connection of the protocol engine
+
+    example:
+        loop.create_server(lambda: ServerProtocol(server), host, port)
+    """
+
+    def __init__(self, server, buffer_size=1 << 16):
+        """
+        :server: the Server instance, stored in self.server
+        :buffer_size: receive buffer size in bytes
+        """
+        self.server = server
+        self.transport = None
+        self.conn = None
+
+        self._buff = memoryview(bytearray(buffer_size))
+        self._id = b""
+        self._addr = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} addr={self._addr} conn={self.conn} object at {hex(id(self))}>" # noqa E501
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._addr = transport.get_extra_info("peername")
+
+    def get_buffer(self, sizehint):
+        return self._buff
+
+    def buffer_updated(self, nbytes):
+        data = bytes(self._buff[:nbytes])
+        if self.conn is None:
+            self._id += data
+            if self.server.id_incomplete(self._id):
+                return
+
+            self.conn, data = self.server.open_connection(
+                self._addr, self.transport, self._id, TransportSubscriber
+            )
+            self._id = b""
+            if not data:
+                return
+
+        try:
+            if not self.server.connection_data(self.conn, data):
+                self.transport.close()
+
+        except Exception as e:
+            self.server.connection_broke(self.conn, e)
+            self.transport.close()
+
+    def eof_received(self):
+        return False  # close
+
+    def pause_writing(self):
+        sub = self._subscriber()
+        if sub is not None:
+            sub.pause()
+
+    def resume_writing(self):
+        sub = self._subscriber()
+        if sub is not None:
+            sub.resume()
+
+    def connection_lost(self, exc):
+        if self.conn is None:
+            return
+
+        self.server.connection_lost(self.conn)
+        self.conn = None
+        print(f"connection to {self._addr} closed")
+
+    def _subscriber(self):
+        if self.conn is not None:
+            return self.server._subscribers.get(self.conn.me)
@@ -0,0 +1,229 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Binary recording of the traffic the server forwards, and reading it back.
+
+log file layout, little endian, append only:
+    rec_header_t - magic, wall clock time the recording started
+    any number of:
+        record_header_t - seconds since start(monotonic), source id, kind, length
+        length bytes of data
+
+kinds:
+    REC_POSE - a whole pose frame, terminator included, raw poser streams are
+        split into frames before they are recorded
+    REC_MANAGER - manager message
+    REC_SOURCE - name of a new source id, utf-8
+
+every INDEX_INTERVAL seconds a (time, offset) entry is appended to the
+sparse index file next to the log(path + ".idx"), seeking is a bisect over it,
+whatever part of the log the index doesn't cover, all of it if the index is
+missing, is indexed by scanning the log from the last entry on
+"""
+import bisect
+import os
+import struct
+import time
+
+REC_MAGIC = b"hvrec\x00\x00\x01"
+
+REC_POSE = 0
+REC_MANAGER = 1
+REC_SOURCE = 2
+
+rec_header_t = struct.Struct("<8sd")
+record_header_t = struct.Struct("<dIBI")
+index_entry_t = struct.Struct("<dQ")
+
+INDEX_INTERVAL = 0.25
+
+
+class PoseRecorder:
+    """
+    append only recorder
+
+    example:
+        r = PoseRecorder("session.hvrec")
+        r.record(REC_POSE, addr, frame)
+        r.close()
+    """
+
+    def __init__(self, path, index_interval=INDEX_INTERVAL):
+        """
+        :path: log file path, stored in self.path, the index goes to path + '.idx'
+        :index_interval: seconds between index entries, stored in self.index_interval
+        """
+        self.path = path
+        self.index_interval = index_interval
+        self.records = 0
+
+        self._file = open(path, "wb")
+        self._index = open(path + ".idx", "wb")
+        self._file.write(rec_header_t.pack(REC_MAGIC, time.time()))
+
+        self._t0 = time.monotonic()
+        self._next_index = 0
+        self._sources = {}
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} path={repr(self.path)} records={self.records} object at {hex(id(self))}>" # noqa E501
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exp):
+        self.close()
+
+    def _source_id(self, source, t):
+        sid = self._sources.get(source)
+        if sid is None:
+            sid = len(self._sources)
+            self._sources[source] = sid
+            name = str(source).encode("utf-8")
+            self._file.write(
+                record_header_t.pack(t, sid, REC_SOURCE, len(name)) + name
+            )
+
+        return sid
+
+    def record(self, kind, source, data):
+        """
+        append a record
+
+        :kind: REC_POSE or REC_MANAGER
+        :source: anything hashable that identifies the sender, gets a numeric id
+        :data: bytes
+        """
+        t = time.monotonic() - self._t0
+        if t >= self._next_index:
+            # index entries point at record boundaries, the log is flushed
+            # along with them so a crash loses at most one interval
+            self._file.flush()
+            self._index.write(index_entry_t.pack(t, self._file.tell()))
+            self._index.flush()
+            self._next_index = t + self.index_interval
+
+        sid = self._source_id(source, t)
+        self._file.write(record_header_t.pack(t, sid, kind, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+    def close(self):
+        """flush and close the log and its index"""
+        self._file.close()
+        self._index.close()
+
+
+class PoseLog:
+    """
+    reader for PoseRecorder logs
+
+    example:
+        log = PoseLog("session.hvrec")
+        for t, source, kind, data in log.records(start=12.5):
+            ...
+    """
+
+    def __init__(self, path):
+        """:path: log file path, stored in self.path"""
+        self.path = path
+        self._file = open(path, "rb")
+
+        head = self._file.read(rec_header_t.size)
+        if len(head) != rec_header_t.size or head[:8] != REC_MAGIC:
+            self._file.close()
+            raise RuntimeError(f"{repr(path)} is not a pose recording")
+
+        self.started_at = rec_header_t.unpack(head)[1]
+        self.sources = {}
+
+        self._times, self._offsets = self._load_index()
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} path={repr(self.path)} index_entries={len(self._times)} object at {hex(id(self))}>" # noqa E501
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exp):
+        self.close()
+
+    def _load_index(self):
+        times = []
+        offsets = []
+        size = os.path.getsize(self.path)
+        try:
+            with open(self.path + ".idx", "rb") as f:
+                raw = f.read()
+
+            n = len(raw) // index_entry_t.size
+            for t, off in index_entry_t.iter_unpack(raw[:n * index_entry_t.size]): # noqa E501
+                if off > size:
+                    break
+
+                times.append(t)
+                offsets.append(off)
+
+        except OSError:
+            pass
+
+        if not offsets:
+            print(f"no index for {repr(self.path)}, scanning the log")
+
+        return self._build_index(times, offsets)
+
+    def _build_index(self, times, offsets):
+        # extend the index over the rest of the log, a current index only
+        # leaves the last interval to scan
+        start = offsets[-1] if offsets else rec_header_t.size
+        next_t = times[-1] + INDEX_INTERVAL if times else 0
+        for t, _, _, _, off in self._scan(start):
+            if t >= next_t:
+                times.append(t)
+                offsets.append(off)
+                next_t = t + INDEX_INTERVAL
+
+        return times, offsets
+
+    def _scan(self, offset):
+        """yields (t, source id, kind, data, offset of the record)"""
+        f = self._file
+        f.seek(offset)
+        while 1:
+            head = f.read(record_header_t.size)
+            if len(head) != record_header_t.size:
+                return  # end of the log, or a torn last record
+
+            t, sid, kind, ln = record_header_t.unpack(head)
+            data = f.read(ln)
+            if len(data) != ln:
+                return
+
+            yield t, sid, kind, data, offset
+            offset += record_header_t.size + ln
+
+    def seek(self, t):
+        """offset of the index entry at or right before :t:, O(log n)"""
+        i = bisect.bisect_right(self._times, t) - 1
+        return self._offsets[i] if i >= 0 else rec_header_t.size
+
+    def records(self, start=0):
+        """
+        yields (t, source, kind, data) for every pose and manager record at or after :start:
+
+        source names seen along the way end up in self.sources
+        """
+        for t, sid, kind, data, _ in self._scan(self.seek(start)):
+            if kind == REC_SOURCE:
+                self.sources[sid] = data.decode("utf-8", "replace")
+                continue
+
+            if t < start:
+                continue
+
+            yield t, sid, kind, data
+
+    def close(self):
+        """close the log file"""
+        self._file.close()
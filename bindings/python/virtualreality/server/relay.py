@@ -0,0 +1,58 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""Pose frame reassembly for the server."""
+
+POSE_TERMINATOR = b"\t\r\n"
+
+
+class FrameSplitter:
+    """
+    reassembles terminated frames from arbitrary stream chunks
+
+    example:
+        s = FrameSplitter()
+        s.feed(b"abc")  # -> []
+        s.feed(b"\\t\\r\\ndef\\t\\r\\n")  # -> [b"abc\\t\\r\\n", b"def\\t\\r\\n"]
+    """
+
+    __slots__ = ["terminator", "max_size", "overflows", "_buff"]
+
+    def __init__(self, terminator=POSE_TERMINATOR, max_size=1 << 16):
+        """
+        :terminator: frame terminator, stored in self.terminator
+        :max_size: max size of an incomplete frame in bytes,
+                    anything bigger is thrown away and counted in self.overflows
+        """
+        self.terminator = terminator
+        self.max_size = max_size
+        self.overflows = 0
+        self._buff = bytearray()
+
+    def feed(self, data):
+        """feed a chunk, returns a list of complete frames, terminators included"""
+        self._buff.extend(data)
+
+        frames = []
+        start = 0
+        tl = len(self.terminator)
+        while 1:
+            end = self._buff.find(self.terminator, start)
+            if end == -1:
+                break
+
+            frames.append(bytes(self._buff[start:end + tl]))
+            start = end + tl
+
+        if start:
+            del self._buff[:start]
+
+        if len(self._buff) > self.max_size:
+            self._buff.clear()
+            self.overflows += 1
+
+        return frames
+
+    def pending(self):
+        """number of buffered bytes that are not a complete frame yet"""
+        return len(self._buff)
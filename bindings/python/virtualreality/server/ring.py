@@ -0,0 +1,228 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Same host pose transport, a single producer ring of pose frames in a mmap'd file.
+
+file layout, little endian:
+    ring_header_t - magic, slot size, slot count, sequence number of the last frame
+    slot_count times:
+        ring_slot_header_t - sequence number of the frame in this slot, frame length
+        slot_size bytes of frame data
+
+frame n(starting from 1) goes to slot (n - 1) % slot_count, a slot's sequence
+number is zeroed while it's being written, readers check it before and after
+copying a frame and throw away anything torn
+
+a producer reuses an existing ring file of the right size in place and
+never shrinks one, if the layout changes a new file is swapped in, readers
+should reopen when self.replaced() says so, on windows the swap fails
+while a reader has the old file mapped
+
+frames are stored as is, terminator included, the c++ driver reads the same file
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+RING_MAGIC = b"hvring\x00\x01"
+
+ring_header_t = struct.Struct("<8sIIQ40x")
+ring_slot_header_t = struct.Struct("<QI4x")
+_seq_t = struct.Struct("<Q")
+_len_t = struct.Struct("<I")
+
+# offset of the last frame's sequence number in the header
+_WRITE_SEQ_OFFSET = 16
+
+DEFAULT_RING_PATH = os.path.join(tempfile.gettempdir(), "hobovr_pose_ring")
+
+
+class PoseRing:
+    """
+    shared pose frame ring, one producer, any number of readers
+
+    example:
+        # poser side
+        r = PoseRing(create=True)
+        r.publish(frame)
+
+        # driver side
+        r = PoseRing()
+        seq = 0
+        new = r.latest(seq)
+        if new is not None:
+            seq, frame = new
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_RING_PATH,
+        *,
+        create=False,
+        slot_size=1 << 14,
+        slot_count=8
+    ):
+        """
+        :path: ring file path, stored in self.path
+        :create: True for the producer, creates or resets the ring file
+        :slot_size: max frame size in bytes, only used with :create:
+        :slot_count: number of slots, only used with :create:
+        """
+        self.path = path
+        self._seq = 0
+
+        if create:
+            size = ring_header_t.size + slot_count * (ring_slot_header_t.size + slot_size) # noqa E501
+            if os.path.exists(path) and os.path.getsize(path) == size:
+                self._file = open(path, "r+b")
+
+            else:
+                # never shrink a file someone might have mapped,
+                # build a new one and swap it in instead
+                with open(path + ".new", "wb") as f:
+                    f.truncate(size)
+
+                try:
+                    os.replace(path + ".new", path)
+
+                except PermissionError:
+                    # windows won't replace a file someone has mapped
+                    os.remove(path + ".new")
+                    raise RuntimeError(
+                        f"{repr(path)} is in use with a different layout, close whatever reads it(the driver) or keep slot_size and slot_count as they were" # noqa E501
+                    )
+
+                self._file = open(path, "r+b")
+
+            self._mm = mmap.mmap(self._file.fileno(), size)
+
+            # readers of a reused file still have its last sequence number,
+            # carry on from there so they don't wait for it to come around
+            magic, _, _, seq = ring_header_t.unpack_from(self._mm)
+            if magic == RING_MAGIC:
+                self._seq = seq
+
+            self._mm[:size] = bytes(size)
+            ring_header_t.pack_into(
+                self._mm, 0, RING_MAGIC, slot_size, slot_count, self._seq
+            )
+
+        else:
+            self._file = open(path, "rb")
+            self._mm = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+            magic, slot_size, slot_count, _ = ring_header_t.unpack_from(self._mm)
+            if magic != RING_MAGIC:
+                self.close()
+                raise RuntimeError(f"{repr(path)} is not a pose ring")
+
+        self.slot_size = slot_size
+        self.slot_count = slot_count
+        self._stride = ring_slot_header_t.size + slot_size
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} path={repr(self.path)} slot_size={self.slot_size} slot_count={self.slot_count} object at {hex(id(self))}>" # noqa E501
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exp):
+        self.close()
+
+    def _slot_offset(self, seq):
+        return ring_header_t.size + ((seq - 1) % self.slot_count) * self._stride
+
+    def publish(self, frame):
+        """write a frame into the next slot, producer only"""
+        if len(frame) > self.slot_size:
+            raise ValueError(
+                f"frame too big for the ring, {len(frame)} > {self.slot_size}"
+            )
+
+        self._seq += 1
+        off = self._slot_offset(self._seq)
+        data = off + ring_slot_header_t.size
+
+        _seq_t.pack_into(self._mm, off, 0)  # slot is being written
+        self._mm[data:data + len(frame)] = frame
+        _len_t.pack_into(self._mm, off + _seq_t.size, len(frame))
+        _seq_t.pack_into(self._mm, off, self._seq)
+        _seq_t.pack_into(self._mm, _WRITE_SEQ_OFFSET, self._seq)
+
+    def latest(self, last_seq=0):
+        """
+        get the newest frame if its not :last_seq:
+
+        returns (seq, frame) or None if there is nothing new
+        or the frame got overwritten while reading it
+        """
+        seq = _seq_t.unpack_from(self._mm, _WRITE_SEQ_OFFSET)[0]
+        if seq == 0 or seq == last_seq:
+            return None
+
+        off = self._slot_offset(seq)
+        before, length = ring_slot_header_t.unpack_from(self._mm, off)
+        if before != seq or length > self.slot_size:
+            return None
+
+        data = off + ring_slot_header_t.size
+        frame = self._mm[data:data + length]
+
+        if _seq_t.unpack_from(self._mm, off)[0] != seq:
+            return None
+
+        return seq, frame
+
+    def since(self, last_seq=0):
+        """
+        every frame after :last_seq: that is still in the ring, oldest first
+
+        returns (seq of the newest frame, list of frames, number of frames lost),
+        lost frames got overwritten before they could be read
+        """
+        seq = _seq_t.unpack_from(self._mm, _WRITE_SEQ_OFFSET)[0]
+        if seq <= last_seq:
+            return last_seq, [], 0
+
+        first = max(last_seq + 1, seq - self.slot_count + 1)
+        lost = first - last_seq - 1
+        frames = []
+        for n in range(first, seq + 1):
+            off = self._slot_offset(n)
+            before, length = ring_slot_header_t.unpack_from(self._mm, off)
+            if before != n or length > self.slot_size:
+                lost += 1
+                continue
+
+            data = off + ring_slot_header_t.size
+            frame = self._mm[data:data + length]
+
+            if _seq_t.unpack_from(self._mm, off)[0] != n:
+                lost += 1
+                continue
+
+            frames.append(frame)
+
+        return seq, frames, lost
+
+    def replaced(self):
+        """True if the ring file at self.path is not the one this ring has mapped"""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino # noqa E501
+
+        except OSError:
+            return True
+
+    def close(self):
+        """unmap and close the ring file"""
+        try:
+            self._mm.close()
+
+        except Exception:
+            pass
+
+        self._file.close()
@@ -3,218 +3,1343 @@
 
 """Server loop that communicates between the driver and posers."""
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from .__init__ import __version__
+from .relay import FrameSplitter, POSE_TERMINATOR
+from .fanout import Subscriber, Decimator, DROP_OLDEST
+from .udp import PoseDatagramProtocol
+from .metrics import ConnectionStats, ManagerRtt, snapshot, to_json_line
+from .merge import FrameMerger, PARTIAL_MAGIC, parse_udu, udu_from_settings_message
+from .recording import PoseRecorder, PoseLog, REC_POSE, REC_MANAGER
+from .stages import PoseProcessor
+from .channels import Channel, DEFAULT_CHANNEL, parse_id
+from .upstream import UpstreamLink, RelayFrameReader
+from .manager import IDS_ACK, ManagerRequest, PlainRequestReader, ReplyRouter, RequestReader, pack_reply # noqa E501
+from .protocol import ServerProtocol
+from .net import loop_factory, tune_socket
+from .heartbeat import HeartbeatFilter, Reaper
+from .compact import CompactCodec, CompactReader, COMPACT_ENCODING, parse_velocity_mask # noqa E501
+from . import workers
+from .bus import DRIVERS, RESPONDERS, MANAGERS, HEARTBEAT_DRIVERS, TO_RESPONDERS, TO_MANAGERS, TO_UPSTREAM, ONLY_UPSTREAM # noqa E501
 
 DOMAIN = (None, 6969)
 
+_ROLE_NAMES = ("unidentified", "driver", "poser", "unidentified", "manager", "monitor", "relay") # noqa E501
+
+
+def _default_channel_set(name):
+    return property(
+        lambda self: getattr(self.channels[DEFAULT_CHANNEL], name),
+        doc=f"{name} of the default channel, see virtualreality.server.channels" # noqa E501
+    )
+
+
+class Connection:
+    """per connection state, shared by both engines"""
+
+    __slots__ = [
+        "me",
+        "role",
+        "ch",
+        "stats",
+        "splitter",
+        "relay",
+        "requests",
+        "relay_reader",
+        "sources",
+        "heartbeat",
+        "heartbeats",
+        "codec",
+    ]
+
+    def __init__(self, me, role, ch):
+        """
+        :me: connection tuple (addr, writer, name)
+        :role: whatAmI, 1 driver, 2 poser, 3 unidentified, 4 manager, 5 monitor, 6 relay
+        :ch: the connection's Channel
+        """
+        self.me = me
+        self.role = role
+        self.ch = ch
+        self.stats = None
+        self.splitter = None
+        self.relay = False
+        self.requests = None
+        self.relay_reader = None
+        self.sources = None
+        self.heartbeat = False  # 'hb=1', see virtualreality.server.heartbeat
+        self.heartbeats = None  # its HeartbeatFilter when self.heartbeat
+        self.codec = None  # 'enc=q', see virtualreality.server.compact
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} addr={self.me[0]} role={_ROLE_NAMES[self.role]} object at {hex(id(self))}>" # noqa E501
+
 
 class Server:
+    conz = _default_channel_set("conz")
+    driver_conz = _default_channel_set("driver_conz")
+    sideband_driver_conz = _default_channel_set("sideband_driver_conz")
+    poser_conz = _default_channel_set("poser_conz")
+    manager_conz = _default_channel_set("manager_conz")
+    monitor_conz = _default_channel_set("monitor_conz")
+
     def __init__(self):
         """
         im not sure about this on chief,
         looks like a destructor to me
         """
-        self.conz = []
-        self.driver_conz = []
-        self.poser_conz = []
-        self.manager_conz = []
+        self.channels = {DEFAULT_CHANNEL: Channel(DEFAULT_CHANNEL)}
         self.debug = False
+        self.engine = "streams"
+        self.event_loop = "auto"
+        self.socket_tuning = True
+        self.frame_relay = False
+        self.queue_size = 64
+        self.overflow_policy = DROP_OLDEST
+        self.udp = False
+        self.stats_file = None
+        self.stats_interval = 1
+        self.merge_udu = None
+        self.merge_rate = 100
+        self.record_file = None
+        self.replay_file = None
+        self.replay_speed = 1
+        self.replay_from = 0
+        self.monitor_rate = 10
+        self.monitor_queue_size = 4
+        self.process_udu = None
+        self.stages = []
+        self.upstream = None
+        self.upstream_channel = None
+        self.validate_frames = True
+        self.malformed_frames = 0
+        self.stage_skipped = 0
+        self.heartbeat_interval = 1
+        self.idle_timeout = 5
+        self.workers = 1
+        self.worker = None  # index of this worker process, see virtualreality.server.workers # noqa E501
 
         self._driver_idz = [
             b"hello",
         ]
+        # drivers that get poses some other way(udp, pose ring),
+        # their connection only carries driver messages
+        self._sideband_driver_idz = [
+            b"hello_udp",
+            b"hello_ring",
+        ]
         self._poser_idz = [
             b"holla",
         ]
         self._manager_idz = [
             b"monky"
         ]
+        # read only, decimated pose stream, 'monitor rate=30' or 'monitor every=4'
+        self._monitor_idz = [
+            b"monitor",
+        ]
+        # another server relaying its posers, see virtualreality.server.upstream
+        self._relay_idz = [
+            b"relay",
+        ]
         self._terminator = b"\n"
         self._close_msg = b"CLOSE\n"
+        self._stats_msg = b"STATS\n"
+        self._manager_replies = (b"2000", b"-100")
         self._read_size = 400
+        self._pose_terminator = POSE_TERMINATOR
+        self._subscribers = {}
+        self._udp_endpoint = None
+        self._stats = {}
+        self._mergers = None  # channel name -> FrameMerger, while merging
+        self._recorder = None
+        self._record_splitters = {}  # raw poser stream -> FrameSplitter
+        self._channel_of = {}
+        self._decimators = {}
+        self._processors = {}
+        self._stage_pending = {}
+        self._stage_executor = None
+        self._upstream = None
+        self._manager_rtt = ManagerRtt()
+        self._manager_router = ReplyRouter()
+        self._id_managers = {}
+        self._bus = None
+        self._connections = {}
+        self._compact_drivers = {}  # me -> CompactCodec, 'hello enc=q'
+        self._heartbeat_drivers = {}  # 'hello hb=1', used as an ordered set
+        self._reaper = None
 
     def __repr__(self):
         """do i need to explain this?"""
-        return f"<{self.__class__.__module__}.{self.__class__.__name__} debug={self.debug} active_conz={len(self.conz)} object at {hex(id(self))}>" # noqa E501
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} debug={self.debug} frame_relay={self.frame_relay} channels={len(self.channels)} active_conz={len(self._subscribers)} object at {hex(id(self))}>" # noqa E501
+
+    def _fan_out(self, msg, targets, me, key=None, urgent=False):
+        """queue a message on every target's subscriber, never waits on a slow one"""
+        for i in targets:
+            if i == me:
+                continue
+
+            sub = self._subscribers.get(i)
+            if sub is not None:
+                sub.put(msg, key, urgent)
+
+    def broadcast(self, msg, ch, role_sets, me, urgent=False, record=False, skip_responders=False): # noqa E501
+        """
+        fan a message out to every connection of :role_sets: of :ch:,
+        on every worker
+
+        :role_sets: names out of virtualreality.server.channels.ROLE_SETS
+        :record: record it as a pose frame
+        :skip_responders: leave out the channel's responders
+        """
+        for i in role_sets:
+            targets = getattr(ch, i)
+            if skip_responders:
+                targets = [j for j in targets if j not in ch.responders]
+
+            if i == "driver_conz" and self._compact_drivers:
+                # raw poser streams, compact drivers only get whole frames
+                targets = [j for j in targets if j not in self._compact_drivers] # noqa E501
+
+            self._fan_out(msg, targets, me, urgent=urgent)
+
+        if record:
+            self._record_raw(me, msg)
+
+        if self._bus is not None:
+            self._bus.send(msg, ch, role_sets, me, urgent, record, skip_responders) # noqa E501
+
+    @property
+    def primary(self):
+        """
+        True unless this is a worker other than the first one,
+        only the primary records, replays, merges, serves udp and relays upstream
+        """
+        return not self.worker
+
+    def channel_of(self, me):
+        """channel of a connection or pose source, the default one for sources without one"""
+        return self._channel_of.get(me) or self.channels[DEFAULT_CHANNEL]
 
     async def send_to_all(self, msg, me):
         """send a message to all registered connections that are not self"""
-        try:
-            for i in self.conz:
-                if i != me:
-                    i[1].write(msg)
-                    await i[1].drain()
-
-        except Exception as e:
-            print(f"message from {me[0]} lost: {e}")
+        self.broadcast(msg, self.channel_of(me), ("conz",), me)
 
     async def send_to_all_poser(self, msg, me):
         """send a message to all registered connections that are not self, for poser messages only"""
+        self.broadcast(msg, self.channel_of(me), ("driver_conz",), me)
+
+    def _record(self, kind, me, data):
+        if self._recorder is not None:
+            self._recorder.record(
+                kind, me[0] if isinstance(me, tuple) and len(me) == 3 else me, data # noqa E501
+            )
+
+    def start_recording(self):
+        """record forwarded pose frames and manager messages to self.record_file"""
+        self._recorder = PoseRecorder(self.record_file)
+        print(f"recording to {repr(self.record_file)}")
+
+    def stop_recording(self):
+        """stop recording, if recording"""
+        if self._recorder is not None:
+            self._recorder.close()
+            print(f"recorded {self._recorder.records} record(s) to {repr(self.record_file)}") # noqa E501
+            self._recorder = None
+            self._record_splitters.clear()
+
+    def _record_raw(self, me, chunk):
+        # raw poser chunks can end mid frame, only whole frames are recorded,
+        # so replay can publish them one by one
+        if self._recorder is None:
+            return
+
+        splitter = self._record_splitters.get(me)
+        if splitter is None:
+            splitter = self._record_splitters[me] = FrameSplitter(self._pose_terminator) # noqa E501
+
+        for i in splitter.feed(chunk):
+            self._record(REC_POSE, me, i)
+
+    def publish_pose_frame(self, frame, me):
+        """
+        hand a complete pose frame over to every driver,
+        only the newest frame per poser is kept if a driver is behind
+        """
+        ch = self.channel_of(me)
+        self._record(REC_POSE, me, frame)
+        ch.last_frames[me] = frame
+        self._fan_out_drivers(frame, me, ch)
+        self._fan_out_monitors(frame, me, ch)
+
+        self._fan_out_udp(frame, ch)
+        if self._upstream is not None and ch.name == DEFAULT_CHANNEL:
+            self._upstream.publish(frame, me)
+
+        if self._bus is not None:
+            self._bus.publish_pose(frame, me, ch)
+
+    def keep_last_frame(self, frame, me, ch):
+        """
+        newest frame of a raw poser stream, kept for drivers that connect
+        later and sent to monitors, the stream itself is fanned out as is
+        """
+        ch.last_frames[me] = frame
+        self._fan_out_monitors(frame, me, ch)
+        if self._bus is not None:
+            self._bus.publish_last(frame, me, ch)
+
+    def source_gone(self, source):
+        """forget a pose source, its connection, if any, is already gone"""
+        if self._bus is not None:
+            self._bus.forget(source)
+
+        # udp posers are on the default channel without being registered
+        ch = self._channel_of.pop(source, None) or self.channels[DEFAULT_CHANNEL] # noqa E501
+        ch.last_frames.pop(source, None)
+        if not len(ch) and not ch.last_frames and ch.name != DEFAULT_CHANNEL:
+            self.channels.pop(ch.name, None)
+
+        self._drop_processor(source)
+        self._record_splitters.pop(source, None)
+        self._forget_decimated(source)
+        if self._upstream is not None:
+            self._upstream.forget(source)
+
+    def _forget_decimated(self, source):
+        # monitors keep the time of the last frame of every source
+        for i in self._decimators.values():
+            i.forget(source)
+
+    def _fan_out_drivers(self, frame, me, ch):
+        """a whole frame to every driver, compact drivers get it encoded"""
+        if not self._compact_drivers:
+            self._fan_out(frame, ch.driver_conz, me, key=me)
+            return
+
+        encoded = {}  # drivers of the same layout share a codec
+        for i in ch.driver_conz:
+            sub = self._subscribers.get(i)
+            if i == me or sub is None:
+                continue
+
+            codec = self._compact_drivers.get(i)
+            if codec is None:
+                sub.put(frame, me)
+                continue
+
+            if codec not in encoded:
+                msg = codec.encode_frame(frame)
+                encoded[codec] = None if msg is None else bytes(msg)
+
+            if encoded[codec] is not None:
+                sub.put(encoded[codec], me)
+
+    def _fan_out_udp(self, frame, ch):
+        """every frame to udp subscribers, raw poser streams included"""
+        # datagrams carry no channel, udp is the default channel only
+        if self._udp_endpoint is not None and ch.name == DEFAULT_CHANNEL:
+            self._udp_endpoint.send_frame(frame)
+
+    def _fan_out_monitors(self, frame, me, ch):
+        """decimated copy for monitors, after the drivers got theirs"""
+        for i in ch.monitor_conz:
+            if self._decimators[i].accept(me):
+                self._subscribers[i].put(frame, key=me)
+
+    def send_last_frames(self, me):
+        """
+        queue the newest frame of every poser to a single driver,
+        so a (re)connected driver doesn't wait for the next send tick
+        """
+        sub = self._subscribers.get(me)
+        if sub is not None:
+            codec = self._compact_drivers.get(me)
+            for source, frame in list(self.channel_of(me).last_frames.items()): # noqa E501
+                if codec is not None:
+                    frame = codec.encode_frame(frame)
+                    if frame is None:
+                        continue
+
+                    frame = bytes(frame)
+
+                sub.put(frame, key=source)
+
+    def add_stage(self, stage, **kwargs):
+        """
+        add a processing stage, see virtualreality.server.stages
+
+        stages run on every frame before it is published, in order, each pose
+        source gets its own instances, frames are decoded with the udu layout
+        of the source's channel, self.process_udu until the channel has one,
+        merged frames with self.merge_udu
+        """
+        self.stages.append((stage, kwargs))
+
+    def forward_pose_frame(self, frame, me):
+        """run the stages on a frame if there are any, then publish it"""
+        udu = self._stage_layout(me) if self.stages else None
+        if udu is None:
+            self.publish_pose_frame(frame, me)
+            return
+
+        if me in self._stage_pending:
+            # still busy with this source, newest frame wins
+            self._stage_pending[me] = frame
+            return
+
+        proc = self._processors.get(me)
+        if proc is None or proc.udu != udu and proc.sizes != parse_udu(udu)[1]: # noqa E501
+            # new source or the channel layout changed, stages start over
+            self._drop_processor(me)
+            self._processors[me] = PoseProcessor(
+                udu, self.stages, self._pose_terminator
+            )
+
+        if self._stage_executor is None:
+            self._stage_executor = ThreadPoolExecutor(
+                1, thread_name_prefix="pose_stages"
+            )
+
+        self._stage_pending[me] = None
+        self._run_stages(frame, me)
+
+    def _stage_layout(self, me):
+        # merged frames have the merge layout, everything else the channel's
+        if self.merge_udu and isinstance(me, str) and (me == "merge" or me.startswith("merge/")): # noqa E501
+            return self.merge_udu
+
+        return self.channel_of(me).udu or self.process_udu or self.merge_udu
+
+    def _drop_processor(self, me):
+        # skipped frames of gone processors still count in the stats
+        proc = self._processors.pop(me, None)
+        if proc is not None:
+            self.stage_skipped += proc.skipped
+
+    def _run_stages(self, frame, me):
+        # one worker thread, so frames of a source stay in order
+        loop = asyncio.get_event_loop()
+        fut = loop.run_in_executor(
+            self._stage_executor, self._processors[me].process, frame, loop.time() # noqa E501
+        )
+        fut.add_done_callback(lambda f: self._stages_done(f, me))
+
+    def _stages_done(self, fut, me):
         try:
-            for i in self.driver_conz:
-                i[1].write(msg)
-                await i[1].drain()
+            frame = fut.result()
 
         except Exception as e:
-            print(f"message from {me[0]} poser lost: {e}")
+            print(f"pose stages broke on a frame from {me[0] if isinstance(me, tuple) else me}: {e}") # noqa E501
+            frame = None
+
+        if me not in self._processors:
+            # the poser left in the meantime
+            self._stage_pending.pop(me, None)
+            return
+
+        if frame is not None:
+            self.publish_pose_frame(frame, me)
+
+        pending = self._stage_pending.get(me)
+        if pending is None:
+            del self._stage_pending[me]
+
+        else:
+            self._stage_pending[me] = None
+            self._run_stages(pending, me)
+
+    def set_layout(self, ch, udu_string, who):
+        """set the udu layout of a channel, frames are checked against it from now on""" # noqa E501
+        if ch.same_layout(udu_string):
+            return
+
+        try:
+            ch.set_layout(udu_string)
+
+        except ValueError as e:
+            print(f"ignoring udu layout from {who}: {e}")
+            return
+
+        print(f"channel {repr(ch.name)} udu layout is now {repr(udu_string)}, {ch.frame_size} byte frames, from {who}") # noqa E501
+        self._compact_layout(ch)
+        if self._bus is not None:
+            self._bus.publish_layout(ch)
+
+    def _compact_layout(self, ch):
+        # compact posers follow the channel layout, like the templates do,
+        # velocity flags survive if the device count stays the same
+        for me in ch.poser_conz:
+            conn = self._connections.get(me)
+            if conn is None or conn.codec is None:
+                continue
+
+            velocity = conn.codec.velocity
+            if len(velocity) != len(ch.udu.split(" ")):
+                velocity = None
+
+            try:
+                conn.codec = CompactCodec(ch.udu, velocity, self._pose_terminator) # noqa E501
+
+            except ValueError as e:
+                print(f"compact poser {me[0]} can't follow the new layout: {e}") # noqa E501
+                continue
+
+            conn.splitter.codec = conn.codec
+
+    def _compact_codec(self, id_opts, who):
+        # 'enc=q udu=h,c,c vel=100' -> CompactCodec, None without enc=q
+        if id_opts.get(b"enc") != COMPACT_ENCODING:
+            return None
+
+        try:
+            udu = id_opts.get(b"udu", b"").decode("utf-8", "replace").replace(",", " ") # noqa E501
+            velocity = parse_velocity_mask(id_opts.get(b"vel"), len(udu.split(" "))) # noqa E501
+            return CompactCodec(udu, velocity, self._pose_terminator)
+
+        except ValueError as e:
+            print(f"ignoring compact encoding from {who}: {e}")
+            return None
+
+    def manager_request(self, msg, me, rid=None):
+        """
+        route a manager request from :me:, to the channel's drivers if known,
+        every other manager otherwise, the reply only goes back to :me:
+
+        :rid: request id for 'ids=1' managers, None for the rest
+        """
+        ch = self.channel_of(me)
+        self._record(REC_MANAGER, me, msg)
+        self._learn_layout([msg], ch, me[0])
+
+        req = ManagerRequest(me, rid)
+        bus = self._bus
+        remote = 0
+        targets = [i for i in ch.responders if i != me]
+        if targets or bus is not None and bus.remote_count(ch.name, RESPONDERS): # noqa E501
+            mode = TO_RESPONDERS
+
+        else:
+            # no driver known yet, 'ids=1' managers never answer
+            mode = TO_MANAGERS
+            targets = self._plain_managers(ch, me)
+
+        if bus is not None:
+            remote = bus.remote_count(ch.name, RESPONDERS if mode == TO_RESPONDERS else MANAGERS) # noqa E501
+
+        sent = self._send_request(msg, targets, req)
+
+        if self.upstream and ch.name == DEFAULT_CHANNEL and mode == TO_MANAGERS: # noqa E501
+            if self._upstream is not None:
+                sent = self._upstream.send_manager(msg, req) or sent
+
+            elif bus is not None and not self.primary:
+                # the link lives on the primary worker
+                mode |= TO_UPSTREAM | (0 if sent or remote else ONLY_UPSTREAM)
+                remote = 1
+
+        if remote:
+            bus.send_request(msg, ch, req, mode)
+            sent = True
+
+        if not sent:
+            # nobody to ask, don't leave the requester hanging
+            self.answer_manager_request(req, self._manager_replies[1])
+
+    def remote_manager_request(self, msg, ch, req, mode):
+        """
+        a manager request another worker routed here, see manager_request
+        and virtualreality.server.bus.TO_RESPONDERS
+
+        returns False if it didn't go anywhere
+        """
+        if mode & TO_RESPONDERS:
+            targets = list(ch.responders)
+
+        else:
+            targets = self._plain_managers(ch, None)
+
+        sent = self._send_request(msg, targets, req)
+        if mode & TO_UPSTREAM and self._upstream is not None:
+            if self._upstream.send_manager(msg, req):
+                sent = True
+
+            elif mode & ONLY_UPSTREAM:
+                self.answer_manager_request(req, self._manager_replies[1])
+                sent = True
+
+        return sent
+
+    def _plain_managers(self, ch, me):
+        return [
+            i for i in ch.manager_conz
+            if i != me and i not in self._id_managers and i not in ch.responders # noqa E501
+        ]
+
+    def _send_request(self, msg, targets, req):
+        sent = False
+        for i in targets:
+            sub = self._subscribers.get(i)
+            if sub is not None and sub.put(msg, urgent=True):
+                self._manager_router.sent(i, req)
+                sent = True
+
+        return sent
+
+    def _update_presence(self, ch):
+        if self._bus is not None:
+            self._bus.update_presence(ch, (
+                len(ch.driver_conz) + len(ch.sideband_driver_conz),
+                len(ch.responders),
+                len(self._plain_managers(ch, None)),
+                sum(i in self._heartbeat_drivers for i in ch.driver_conz),
+            ))
+
+    def manager_replies(self, data, me):
+        """replies from a driver's manager connection, each goes back to the oldest request sent there""" # noqa E501
+        ch = self.channel_of(me)
+        if me not in ch.responders:
+            ch.responders[me] = None
+            self._update_presence(ch)
+
+        for i in range(0, len(data), 4):
+            reply = data[i:i + 4]
+            req = self._manager_router.replied(me)
+            self._manager_rtt.expired = self._manager_router.expired
+            if req is None:
+                # nothing outstanding, old behaviour, to every other manager
+                self._manager_rtt.unmatched += 1
+                self.broadcast(
+                    reply, ch, ("manager_conz",), me,
+                    urgent=True, skip_responders=True
+                )
+
+            else:
+                self.answer_manager_request(req, reply)
+
+    def answer_manager_request(self, req, reply):
+        """send :reply: to whoever made the ManagerRequest :req:, only the first answer counts""" # noqa E501
+        if req.answered:
+            return
+
+        req.answered = True
+        if self._bus is not None and self._bus.reply(req, reply):
+            return  # the asking worker times the round trip
+
+        self._manager_rtt.add(time.monotonic() - req.t0)
+        sub = self._subscribers.get(req.requester)
+        if sub is not None:
+            sub.put(
+                reply if req.rid is None else pack_reply(req.rid, reply),
+                urgent=True
+            )
+
+    def _count_replies(self, data):
+        # driver replies, '2000' or '-100', have no terminator
+        if len(data) % 4:
+            return 0
+
+        for i in range(0, len(data), 4):
+            if data[i:i + 4] not in self._manager_replies:
+                return 0
+
+        return len(data) // 4
+
+    def _learn_layout(self, msgs, ch, addr):
+        for i in msgs:
+            udu = udu_from_settings_message(i, self._pose_terminator)
+            if udu is not None:
+                self.set_layout(ch, udu, f"manager {addr}")
+
+    def _validating(self, ch):
+        return self.validate_frames and ch.frame_size is not None
+
+    def _whole_frames(self, ch):
+        # raw chunks can end mid frame, a heartbeat written after one would
+        # land inside a frame, compact drivers need whole frames to encode
+        return (
+            self._validating(ch)
+            or self._compact_drivers
+            or self._heartbeat_drivers
+            or self._bus is not None and self._bus.remote_count(ch.name, HEARTBEAT_DRIVERS) # noqa E501
+        )
+
+    def _handle_newest(self, frames, me):
+        for i in reversed(frames):
+            if self.handle_pose_frame(i, me):
+                return
+
+    def handle_pose_frame(self, frame, me):
+        """
+        route a complete pose frame from a poser,
+        partial frames go into the merged frame, everything else is published
+
+        returns False if the frame was malformed and dropped
+        """
+        if self._mergers is not None and frame.startswith(PARTIAL_MAGIC):
+            # every channel has a merged frame of its own
+            name = self.channel_of(me).name
+            merger = self._mergers.get(name)
+            if merger is None:
+                merger = self._mergers[name] = FrameMerger(
+                    self.merge_udu, self._pose_terminator
+                )
+
+            if not merger.update(frame) and self.debug:
+                print(f"partial frame from {me[0]} doesn't fit {repr(self.merge_udu)}") # noqa E501
+
+            return True
+
+        if self._bus is not None and self.merge_udu and not self.primary and frame.startswith(PARTIAL_MAGIC): # noqa E501
+            # merged on the primary worker
+            self._bus.send_partial(frame, me)
+            return True
+
+        if self.validate_frames:
+            size = self.channel_of(me).frame_size
+            if size is not None and len(frame) != size:
+                self.malformed_frames += 1
+                stats = self._stats.get(me)
+                if stats is not None:
+                    stats.malformed += 1
+
+                if self.debug:
+                    print(f"dropped a {len(frame)} byte frame from {me[0]}, expected {size}") # noqa E501
+
+                return False
+
+        self.forward_pose_frame(frame, me)
+        return True
+
+    async def merge_loop(self):
+        """
+        merge partial frames from many posers into one self.merge_udu frame
+        per channel and publish it self.merge_rate times a second, if it changed
+        """
+        self._mergers = {}
+        print(f"merging partial frames into {repr(self.merge_udu)} at {self.merge_rate}Hz") # noqa E501
+
+        loop = asyncio.get_event_loop()
+        period = 1 / self.merge_rate
+        deadline = loop.time()
+        try:
+            while 1:
+                deadline += period
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+
+                for name, merger in list(self._mergers.items()):
+                    if merger.dirty:
+                        self.forward_pose_frame(merger.frame(), self._merge_source(name)) # noqa E501
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            self._mergers = None
+
+    def _merge_source(self, name):
+        # 'merge' on the default channel, 'merge/<name>' on the others
+        if name == DEFAULT_CHANNEL:
+            return "merge"
+
+        source = f"merge/{name}"
+        ch = self.channels.get(name)
+        if ch is not None:
+            self._channel_of[source] = ch
+
+        return source
+
+    async def replay_loop(self):
+        """
+        stream self.replay_file to drivers and managers, starting at self.replay_from seconds
+
+        waits for a driver first, paced at self.replay_speed times the
+        recorded speed, 0 is as fast as possible
+        """
+        log = PoseLog(self.replay_file)
+        try:
+            while not self.driver_conz and not (self._udp_endpoint and self._udp_endpoint.subscribers) and not (self._bus and self._bus.remote_count(DEFAULT_CHANNEL, DRIVERS)): # noqa E501
+                await asyncio.sleep(0.1)
+
+            print(f"replaying {repr(self.replay_file)} from {self.replay_from}s at {self.replay_speed}x") # noqa E501
+            loop = asyncio.get_event_loop()
+            t0 = loop.time()
+            n = 0
+            for t, source, kind, data in log.records(self.replay_from):
+                if self.replay_speed > 0:
+                    delay = t0 + (t - self.replay_from) / self.replay_speed - loop.time() # noqa E501
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                elif n % 64 == 0:
+                    await asyncio.sleep(0)  # let the writers catch up
+
+                if kind == REC_POSE:
+                    self.publish_pose_frame(data, f"replay{source}")
+
+                elif kind == REC_MANAGER:
+                    self.broadcast(
+                        data, self.channels[DEFAULT_CHANNEL], ("manager_conz",), None # noqa E501
+                    )
+
+                n += 1
+
+            print(f"replay done, {n} record(s) in {loop.time() - t0:.3f}s")
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            log.close()
 
     async def send_to_all_driver(self, msg, me):
         """send a message to all registered connections that are not self, for driver messages only"""
+        self.broadcast(msg, self.channel_of(me), ("poser_conz",), me)
+
+    async def send_to_all_manager(self, msg, me):
+        """
+        send a message to all registered connections that are not self,
+        manager messages skip the outbound queues, see Subscriber.put
+
+        requests should go through self.manager_request, so replies find their way back
+        """
+        self.broadcast(
+            msg, self.channel_of(me), ("manager_conz",), me, urgent=True
+        )
+
+    async def relay_loop(self):
+        """
+        forward the default channel's frames and manager messages to self.upstream,
+        'host:port', reconnects forever
+        """
+        addr, _, port = self.upstream.rpartition(":")
+        self._upstream = UpstreamLink(
+            self, addr or "127.0.0.1", int(port), self.upstream_channel
+        )
         try:
-            for i in self.poser_conz:
-                i[1].write(msg)
-                await i[1].drain()
+            await self._upstream.run()
 
-        except Exception as e:
-            print(f"message from {me[0]} driver lost: {e}")
+        finally:
+            self._upstream = None
 
-    async def send_to_all_manager(self, msg, me):
-        """send a message to all registered connections that are not self"""
+    def get_stats(self):
+        """
+        metrics report, per connection and per role counters
+        see virtualreality.server.metrics.snapshot
+        """
+        ret = snapshot(self._stats, self._subscribers, self._udp_endpoint)
+        ret["channels"] = {k: len(v) for k, v in self.channels.items()}
+        ret["layouts"] = {
+            k: {"udu": v.udu, "frame_size": v.frame_size}
+            for k, v in self.channels.items() if v.udu is not None
+        }
+        ret["malformed"] = self.malformed_frames
+        ret["manager_rtt"] = self._manager_rtt.as_dict()
+        if self._upstream is not None:
+            ret["upstream"] = self._upstream.stats()
+        if self._bus is not None:
+            ret["bus"] = self._bus.stats()
+        if self._reaper is not None:
+            ret["reaper"] = self._reaper.stats()
+        if self.stages:
+            ret["stages"] = {
+                "sources": len(self._processors),
+                "skipped": self.stage_skipped + sum(i.skipped for i in self._processors.values()), # noqa E501
+            }
+        if self._mergers is not None:
+            ret["merge"] = {
+                "udu": self.merge_udu,
+                "channels": len(self._mergers),
+                "updates": sum(i.updates for i in self._mergers.values()),
+                "rejected": sum(i.rejected for i in self._mergers.values()),
+            }
+
+        return ret
+
+    async def stats_dump_loop(self):
+        """append a json line metrics report to self.stats_file every self.stats_interval seconds, '-' is stdout""" # noqa E501
+        out = None
         try:
-            for i in self.manager_conz:
-                if i != me:
-                    i[1].write(msg)
-                    await i[1].drain()
+            if self.stats_file != "-":
+                out = open(self.stats_file, "a")
+
+            while 1:
+                await asyncio.sleep(self.stats_interval)
+                line = to_json_line(self.get_stats())
+                if out is None:
+                    print(line, end="", flush=True)
+
+                else:
+                    out.write(line)
+                    out.flush()
+
+        except asyncio.CancelledError:
+            pass
 
         except Exception as e:
-            print(f"message from {me[0]} lost: {e}")
+            print(f"stats dump broke: {e}")
 
-    async def __call__(self, reader, writer):
-        """this is will run for each incoming connection"""
+        finally:
+            if out is not None:
+                out.close()
 
-        addr = writer.get_extra_info("peername")
+    async def reap_loop(self):
+        """
+        send heartbeats and close dead connections every self.heartbeat_interval seconds,
+        udp posers that went quiet are forgotten too, see virtualreality.server.heartbeat
+        """
+        self._reaper = Reaper(self.idle_timeout)
         try:
-            first_msg = await reader.read(50)
+            while 1:
+                await asyncio.sleep(self.heartbeat_interval)
+                for conn, reason in self._reaper.sweep(list(self._connections.values()), self._subscribers): # noqa E501
+                    self.reap(conn, reason)
+
+                # udp posers have no connection to close, just forget them
+                if self._udp_endpoint is not None:
+                    for addr in self._udp_endpoint.expire_sources(self.idle_timeout): # noqa E501
+                        print(f"udp poser {addr} silent for {self.idle_timeout}s, forgetting it") # noqa E501
+                        self.source_gone(addr)
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            self._reaper = None
+
+    def reap(self, conn, reason):
+        """drop a dead connection, whatever is still buffered for it included"""
+        print(f"reaping {_ROLE_NAMES[conn.role]} {conn.me[0]}, {reason}")
+        writer = conn.me[1]
+        try:
+            # close() would wait for the buffer to drain, which never happens
+            getattr(writer, "transport", writer).abort()
 
         except Exception as e:
-            print(f'pipe {addr} broke on id, reason: {e}')
-            return
+            print(f"error reaping {conn.me[0]}: {e}")
 
+    def id_incomplete(self, first_msg):
+        """
+        True while :first_msg: looks like the start of an id line without its end
+
+        long id lines, 'holla channel=rig1 udu=h,c,c,t,t,..', can take
+        more than one read, only wait for the rest if it looks like one
+        """
+        return bool(
+            first_msg
+            and self._terminator not in first_msg
+            and len(first_msg) < 256
+            and first_msg.isascii()
+            and b"\t" not in first_msg
+        )
+
+    def open_connection(self, addr, writer, first_msg, subscriber_cls=Subscriber): # noqa E501
+        """
+        register a new connection from its first bytes, id line included
+
+        :writer: anything with write and close, a StreamWriter or a transport
+        :subscriber_cls: outbound queue class, see virtualreality.server.fanout
+
+        returns (Connection, leftover bytes for self.connection_data)
+        """
         if self._terminator in first_msg:
-            id_msg, first_msg = first_msg.split(self._terminator, 1)
+            id_line, first_msg = first_msg.split(self._terminator, 1)
 
         else:
-            id_msg = b""
+            id_line = b""
+
+        # 'hello channel=rig1' -> b"hello", {b"channel": b"rig1"}
+        id_msg, id_opts = parse_id(id_line)
 
         me = (
             addr,
             writer,
-            f"lol{len(self.conz)}",
+            f"lol{len(self._subscribers)}",
         )
 
+        channel_name = id_opts.get(b"channel", b"").decode("utf-8", "replace")
+        ch = self.channels.get(channel_name)
+        if ch is None:
+            ch = self.channels[channel_name] = Channel(channel_name)
+            print(f"new channel {repr(channel_name)}")
+
+        self._channel_of[me] = ch
+
         print(f"new connection from {addr}")
         whatAmI = 0
-        if id_msg in self._driver_idz and me not in self.driver_conz:
+        if id_msg in self._driver_idz:
             whatAmI = 1
-            self.driver_conz.append(me)
+            ch.add("driver_conz", me)
 
-        elif id_msg in self._poser_idz and me not in self.poser_conz:
+        elif id_msg in self._sideband_driver_idz:
+            whatAmI = 1
+            ch.add("sideband_driver_conz", me)
+
+        elif id_msg in self._poser_idz:
             whatAmI = 2
-            self.poser_conz.append(me)
+            ch.add("poser_conz", me)
+            if b"udu" in id_opts:
+                # 'holla udu=h13,c22,c22', the layout this poser sends
+                self.set_layout(
+                    ch,
+                    id_opts[b"udu"].decode("utf-8", "replace").replace(",", " "),
+                    f"poser {addr}"
+                )
 
-        elif id_msg in self._manager_idz and me not in self.manager_conz:
+        elif id_msg in self._manager_idz:
             whatAmI = 4
-            self.manager_conz.append(me)
+            ch.add("manager_conz", me)
+            if id_opts.get(b"role") == b"driver":
+                # 'monky role=driver', requests go here
+                ch.responders[me] = None
+
+        elif id_msg in self._relay_idz:
+            # driver messages go down the link like to any poser
+            whatAmI = 6
+            ch.add("poser_conz", me)
+
+        elif id_msg in self._monitor_idz:
+            whatAmI = 5
+            self._decimators[me] = Decimator.from_spec(
+                id_line, self.monitor_rate
+            )
+            ch.add("monitor_conz", me)
 
-        elif me not in self.conz:
+        else:
             whatAmI = 3
-            self.conz.append(me)
+            ch.add("conz", me)
+
+        if whatAmI == 5:
+            # monitors are never worth waiting for, tiny queue, drops freely
+            self._subscribers[me] = subscriber_cls(
+                me, self.monitor_queue_size, DROP_OLDEST
+            )
 
-        if first_msg:
-            await self.send_to_all(first_msg, me)
+        else:
+            self._subscribers[me] = subscriber_cls(
+                me, self.queue_size, self.overflow_policy
+            )
+
+        if self.socket_tuning and whatAmI in (1, 2, 6):
+            # pose connections only, see virtualreality.server.net
+            tune_socket(writer.get_extra_info("socket"))
+
+        conn = Connection(me, whatAmI, ch)
+        conn.heartbeat = id_opts.get(b"hb") == b"1"
+        if id_msg in self._driver_idz or whatAmI == 2:
+            conn.codec = self._compact_codec(id_opts, addr)
+
+        if conn.heartbeat and not (whatAmI == 2 and conn.codec is not None):
+            # compact poser streams skip them while cutting frames
+            conn.heartbeats = HeartbeatFilter()
+        self._connections[me] = conn
+        conn.stats = ConnectionStats(addr, _ROLE_NAMES[whatAmI], channel_name)
+        self._stats[me] = conn.stats
+        conn.stats.record_in(len(id_line) + len(first_msg), 0)
+
+        # poser streams are always split, without frame relay just to keep
+        # the newest frame around for drivers that connect later,
+        # once the channel has a udu layout frames are checked one by one
+        if whatAmI == 2 and conn.codec is not None:
+            # decoded into float frames right away, only whole ones
+            conn.splitter = CompactReader(conn.codec)
+            conn.relay = True
+
+        elif whatAmI == 2:
+            conn.splitter = FrameSplitter(self._pose_terminator)
+            conn.relay = bool(
+                self.frame_relay or self.merge_udu or self.stages or self.upstream
+            )
+
+        elif conn.codec is not None:
+            self._compact_drivers[me] = conn.codec
+
+        elif whatAmI == 1 and conn.heartbeat and me in ch.driver_conz:
+            self._heartbeat_drivers[me] = None
+
+        elif whatAmI == 4:
+            # whole messages only, requests are routed one by one
+            conn.splitter = PlainRequestReader()
+            if id_opts.get(b"ids") == b"1":
+                conn.requests = RequestReader()
+                self._id_managers[me] = None
+                self._subscribers[me].put(IDS_ACK, urgent=True)
+
+        elif whatAmI == 6:
+            # every remote poser is a pose source of its own
+            conn.relay_reader = RelayFrameReader()
+            conn.sources = {}
+
+        leftover = b""
+        if whatAmI in (4, 6):
+            leftover = first_msg  # handled like any other data
+
+        elif first_msg and (conn.relay or self._whole_frames(ch) and conn.splitter is not None): # noqa E501
+            self._handle_newest(conn.splitter.feed(first_msg), me)
+
+        elif first_msg:
+            if conn.splitter is not None:
+                frames = conn.splitter.feed(first_msg)
+                for i in frames:
+                    self._fan_out_udp(i, ch)
+
+                if frames:
+                    self.keep_last_frame(frames[-1], me, ch)
+
+            self.broadcast(first_msg, ch, ("conz",), me)
+
+        if id_msg in self._driver_idz or whatAmI == 5:
+            self.send_last_frames(me)
+
+        if whatAmI in (1, 4):
+            self._update_presence(ch)
 
         # this is does nothing but looks pretty
+        if channel_name:
+            print(f"on channel {repr(channel_name)}")
+
         if id_msg in self._driver_idz:
             print("its a driver")
+            if conn.codec is not None:
+                print(f"compact frames, {conn.codec.size} bytes instead of {conn.codec.float_size}") # noqa E501
+
+        elif id_msg in self._sideband_driver_idz:
+            print(f"its a driver, poses go over {id_msg[6:].decode()}")
 
         elif id_msg in self._poser_idz:
             print("its a poser")
+            if conn.codec is not None:
+                print(f"compact frames, {conn.codec.size} bytes instead of {conn.codec.float_size}") # noqa E501
 
         elif id_msg in self._manager_idz:
             print("its a manager")
 
-        # main receive/transmit loop
-        if whatAmI == 1:
-            while 1:
-                try:
-                    data = await reader.read(self._read_size)
+        elif whatAmI == 6:
+            print("its a relay server")
 
-                    if not data or self._close_msg in data:
-                        break
+        elif whatAmI == 5:
+            d = self._decimators[me]
+            print(f"its a monitor, {f'1 in {d.every}' if d.every else f'{d.rate}Hz'} per poser") # noqa E501
 
-                    await self.send_to_all_driver(data, me)  # to all posers
+        return conn, leftover
 
-                    if self.debug:
-                        print(f"{repr(data)} from {addr}")
+    def connection_data(self, conn, data):
+        """
+        handle bytes received on a connection, b"" is the end of the stream
 
-                except Exception as e:
-                    print(f"driver {addr} broke: {e}")
-                    break
+        returns False once the connection should be closed,
+        raises whatever the role's handling raises
+        """
+        me = conn.me
+        addr = me[0]
+        stats = conn.stats
+        whatAmI = conn.role
+        if not data or (whatAmI != 6 and self._close_msg in data):
+            return False
 
-        elif whatAmI == 2:
-            while 1:
-                try:
-                    data = await reader.read(self._read_size)
+        if conn.heartbeats is not None:
+            # a heartbeat can be cut in two by the reads
+            data = conn.heartbeats.feed(data)
+            if not data:
+                stats.record_in(0, 0)  # still counts as alive
+                return True
 
-                    if not data or self._close_msg in data:
-                        break
+        if whatAmI == 1:
+            stats.record_in(len(data), data.count(self._terminator))
+            self.broadcast(data, conn.ch, ("poser_conz",), me)  # to all posers
 
-                    await self.send_to_all_poser(data, me)  # to all drivers
+        elif whatAmI == 2:
+            ch = conn.ch
+            frames = conn.splitter.feed(data)
+            stats.record_in(len(data), len(frames))
+            stats.dropped_in = conn.splitter.overflows
+            if conn.relay or self._whole_frames(ch):
+                # only whole frames, only the newest good one
+                self._handle_newest(frames, me)
 
-                    if self.debug:
-                        print(f"{repr(data)} from {addr}")
+            else:
+                # drivers get the stream as is, datagrams need whole frames
+                for i in frames:
+                    self._fan_out_udp(i, ch)
 
-                except Exception as e:
-                    print(f"poser {addr} broke: {e}")
-                    break
+                if frames:
+                    self.keep_last_frame(frames[-1], me, ch)
+
+                # to all drivers
+                self.broadcast(data, ch, ("driver_conz",), me, record=True)
 
         elif whatAmI == 3:
-            while 1:
-                try:
-                    data = await reader.read(self._read_size)
+            stats.record_in(len(data), data.count(self._terminator))
+            # to posers too, and all not identified
+            self.broadcast(data, conn.ch, ("poser_conz", "conz"), me)
 
-                    if not data or self._close_msg in data:
-                        break
+        elif whatAmI == 4:
+            stats.record_in(len(data), data.count(self._pose_terminator))
 
-                    await self.send_to_all_driver(data, me)  # to posers too
-                    await self.send_to_all(data, me)  # to all not identified
+            if conn.requests is not None:
+                # 'monky ids=1', replies go back with the same id
+                for rid, msg in conn.requests.feed(data):
+                    if rid is None:
+                        self._subscribers[me].put(
+                            to_json_line(self.get_stats()).encode("utf-8"),
+                            urgent=True
+                        )
 
-                    if self.debug:
-                        print(f"{repr(data)} from {addr}")
+                    else:
+                        self.manager_request(msg, me, rid)
 
-                except Exception as e:
-                    print(f"{addr} broke: {e}")
-                    break
+                return True
 
-        elif whatAmI == 4:
-            while 1:
-                try:
-                    data = await reader.read(self._read_size)
+            if not conn.splitter.pending() and self._count_replies(data):
+                self._record(REC_MANAGER, me, data)
+                self.manager_replies(data, me)
+
+            else:
+                for msg in conn.splitter.feed(data):
+                    if msg == self._stats_msg:
+                        # metrics query, answered to the asking manager only
+                        self._subscribers[me].put(
+                            to_json_line(self.get_stats()).encode("utf-8"),
+                            urgent=True
+                        )
+
+                    else:
+                        self.manager_request(msg, me)
+
+        elif whatAmI == 5:
+            # read only, whatever a monitor says goes nowhere
+            stats.record_in(len(data), 0)
+
+        elif whatAmI == 6:
+            frames = conn.relay_reader.feed(data)
+            stats.record_in(len(data), len(frames))
+            for sid, frame in frames:
+                if not frame:
+                    # the source is gone, its id might be reused
+                    source = conn.sources.pop(sid, None)
+                    if source is not None:
+                        self.source_gone(source)
 
-                    if not data or self._close_msg in data:
-                        break
+                    continue
 
-                    await self.send_to_all_manager(data, me)  # to all managers
+                source = conn.sources.get(sid)
+                if source is None:
+                    source = conn.sources[sid] = (addr, None, f"{me[2]}/{sid}") # noqa E501
+                    self._channel_of[source] = conn.ch
 
-                    if self.debug:
-                        print(f"{repr(data)} from {addr}")
+                self.handle_pose_frame(frame, source)
+
+        if self.debug and whatAmI != 6:
+            print(f"{repr(data)} from {addr}")
+
+        return True
+
+    def connection_broke(self, conn, e):
+        """report an exception out of self.connection_data"""
+        if conn.role == 3:
+            print(f"{conn.me[0]} broke: {e}")
+
+        else:
+            print(f"{_ROLE_NAMES[conn.role]} {conn.me[0]} broke: {e}")
 
-                except Exception as e:
-                    print(f"manager {addr} broke: {e}")
+    def connection_lost(self, conn):
+        """forget a connection, doesn't close it"""
+        me = conn.me
+        ch = conn.ch
+        if conn.sources:
+            for source in conn.sources.values():
+                self.source_gone(source)
+
+        if self._bus is not None:
+            self._bus.forget(me)
+
+        ch.remove(me)
+        del self._channel_of[me]
+        self._decimators.pop(me, None)
+        if conn.role == 2:
+            self._forget_decimated(me)
+        if not len(ch) and ch.name != DEFAULT_CHANNEL:
+            del self.channels[ch.name]
+            if self._mergers is not None:
+                self._mergers.pop(ch.name, None)
+                self._channel_of.pop(f"merge/{ch.name}", None)
+
+            print(f"channel {repr(ch.name)} closed")
+
+        self._subscribers.pop(me).close()
+        self._stats.pop(me, None)
+        self._connections.pop(me, None)
+        self._compact_drivers.pop(me, None)
+        self._heartbeat_drivers.pop(me, None)
+        self._record_splitters.pop(me, None)
+        if self._reaper is not None:
+            self._reaper.forget(me)
+        self._drop_processor(me)
+        self._manager_router.forget(me)
+        self._id_managers.pop(me, None)
+        if self._upstream is not None:
+            self._upstream.forget(me)
+
+        if conn.role in (1, 4):
+            self._update_presence(ch)
+
+    def start_server(self, host, port):
+        """
+        coroutine that starts listening on :host:, :port: with self.engine,
+        workers share the port
+
+        engines:
+            streams - StreamReader/StreamWriter, a coroutine per connection
+            protocol - callbacks only, see virtualreality.server.protocol
+        """
+        reuse_port = True if self.worker is not None else None
+        if self.engine == "protocol":
+            return asyncio.get_event_loop().create_server(
+                lambda: ServerProtocol(self), host, port, reuse_port=reuse_port # noqa E501
+            )
+
+        if self.engine != "streams":
+            raise ValueError(f"unknown engine: {repr(self.engine)}")
+
+        return asyncio.start_server(self, host, port, reuse_port=reuse_port)
+
+    async def __call__(self, reader, writer):
+        """this is will run for each incoming connection, streams engine"""
+
+        addr = writer.get_extra_info("peername")
+        try:
+            first_msg = await reader.read(50)
+            while self.id_incomplete(first_msg):
+                more = await reader.read(50)
+                if not more:
                     break
 
-        if me in self.conz:
-            self.conz.remove(me)
+                first_msg += more
+
+        except Exception as e:
+            print(f'pipe {addr} broke on id, reason: {e}')
+            return
+
+        conn, data = self.open_connection(addr, writer, first_msg)
+
+        # main receive/transmit loop
+        while 1:
+            try:
+                if not data:
+                    data = await reader.read(self._read_size)
+
+                if not self.connection_data(conn, data):
+                    break
 
-        if me in self.driver_conz:
-            self.driver_conz.remove(me)
+                data = b""
 
-        if me in self.poser_conz:
-            self.poser_conz.remove(me)
+            except Exception as e:
+                self.connection_broke(conn, e)
+                break
 
-        if me in self.manager_conz:
-            self.manager_conz.remove(me)
+        self.connection_lost(conn)
 
         try:
             writer.close()
@@ -227,22 +1352,68 @@ class Server:
 
 def run_til_dead(poser=None, conn_handle=Server()):
     """Run the server until it dies."""
-    loop = asyncio.get_event_loop()
-    coro = asyncio.start_server(conn_handle, *DOMAIN, loop=loop)
-    server = loop.run_until_complete(coro)
+    if conn_handle.workers > 1 and conn_handle.worker is None:
+        if poser is not None:
+            raise ValueError("an in-process poser can't run with workers")
+
+        return workers.run_workers(conn_handle, run_til_dead)
+
+    factory, backend = loop_factory(conn_handle.event_loop)
+    loop = factory()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(conn_handle.start_server(*DOMAIN))
+    primary = conn_handle.primary
+
+    if conn_handle._bus is not None:
+        conn_handle._bus.start(loop)
+
+    udp_transport = None
+    if conn_handle.udp and primary:
+        udp_transport, _ = loop.run_until_complete(
+            loop.create_datagram_endpoint(
+                lambda: PoseDatagramProtocol(conn_handle),
+                local_addr=(DOMAIN[0] or "0.0.0.0", DOMAIN[1])
+            )
+        )
+        print("udp pose transport on {}".format(udp_transport.get_extra_info("sockname"))) # noqa E501
+
+    if conn_handle.stats_file:
+        loop.create_task(conn_handle.stats_dump_loop())
+
+    if conn_handle.heartbeat_interval > 0 and conn_handle.idle_timeout > 0:
+        loop.create_task(conn_handle.reap_loop())
+
+    if conn_handle.merge_udu and primary:
+        loop.create_task(conn_handle.merge_loop())
+
+    if conn_handle.record_file and primary:
+        conn_handle.start_recording()
+
+    if conn_handle.replay_file and primary:
+        loop.create_task(conn_handle.replay_loop())
+
+    if conn_handle.upstream and primary:
+        loop.create_task(conn_handle.relay_loop())
 
     if poser is not None:
         asyncio.run_coroutine_threadsafe(poser.main(), loop)
 
     # Serve requests until Ctrl+C is pressed
-    print(f"server version: {repr(__version__)}")
+    print(f"server version: {repr(__version__)}, {conn_handle.engine} engine, {backend} event loop{'' if conn_handle.worker is None else f', worker {conn_handle.worker}'}") # noqa E501
     print("Serving on {}".format(server.sockets[0].getsockname()))
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         pass
 
+    conn_handle.stop_recording()
+    if conn_handle._bus is not None:
+        conn_handle._bus.stop()
+
     # Close the server
+    if udp_transport is not None:
+        udp_transport.close()
+
     server.close()
     loop.run_until_complete(server.wait_closed())
     loop.close()
@@ -0,0 +1,271 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Server side pose processing stages.
+
+a frame of a known udu layout is decoded into (devices, n) arrays:
+    pos - x, y, z
+    rot - r_w, r_x, r_y, r_z
+    vel - vel_x, vel_y, vel_z
+    ang_vel - ang_vel_x, ang_vel_y, ang_vel_z(world space, radians/second)
+
+stages work on all their devices at once, so a frame with 3 devices and a
+frame with 60 cost about the same, controller inputs are never touched
+
+stages keep state, every pose source gets its own copies
+"""
+import numpy as np
+
+from .merge import parse_udu
+
+
+def _quat_mul(a, b):
+    """hamilton product of (n, 4) w, x, y, z quaternions"""
+    aw, ax, ay, az = a.T
+    bw, bx, by, bz = b.T
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=1)
+
+
+def _normalize(q):
+    n = np.linalg.norm(q, axis=1, keepdims=True)
+    n[n == 0] = 1
+    return q / n
+
+
+class PoseBatch:
+    """decoded device fields of one frame, see the module docs"""
+
+    __slots__ = ["pos", "rot", "vel", "ang_vel"]
+
+    def __init__(self, pos, rot, vel, ang_vel):
+        self.pos = pos
+        self.rot = rot
+        self.vel = vel
+        self.ang_vel = ang_vel
+
+
+class Stage:
+    """
+    base of all stages
+
+    subclasses implement self.process, it gets the fields of self.devices
+    only and changes them in place
+
+    example:
+        class Freeze(Stage):
+            def process(self, batch, dt):
+                batch.vel[:] = 0
+    """
+
+    def __init__(self, devices=None):
+        """:devices: device indices this stage works on, None is all of them"""
+        self.devices = None if devices is None else np.asarray(devices, dtype=int) # noqa E501
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} devices={self.devices} object at {hex(id(self))}>" # noqa E501
+
+    def __call__(self, batch, dt):
+        if self.devices is None:
+            self.process(batch, dt)
+            return
+
+        sub = PoseBatch(*(getattr(batch, i)[self.devices] for i in PoseBatch.__slots__)) # noqa E501
+        self.process(sub, dt)
+        for i in PoseBatch.__slots__:
+            getattr(batch, i)[self.devices] = getattr(sub, i)
+
+    def process(self, batch, dt):
+        """:batch: PoseBatch, :dt: seconds since the previous frame of this source, 0 on the first one""" # noqa E501
+        raise NotImplementedError
+
+
+class Smooth(Stage):
+    """exponential smoothing of position and rotation, :alpha: is the weight of the new sample""" # noqa E501
+
+    def __init__(self, alpha=0.5, devices=None):
+        super().__init__(devices)
+        self.alpha = float(alpha)
+        self._pos = None
+        self._rot = None
+
+    def process(self, batch, dt):
+        if self._pos is None or self._pos.shape != batch.pos.shape:
+            self._pos = batch.pos.copy()
+            self._rot = batch.rot.copy()
+            return
+
+        self._pos += self.alpha * (batch.pos - self._pos)
+
+        # shortest way around, q and -q are the same rotation
+        rot = np.where(
+            np.sum(batch.rot * self._rot, axis=1, keepdims=True) < 0,
+            -batch.rot,
+            batch.rot
+        )
+        self._rot = _normalize(self._rot + self.alpha * (rot - self._rot))
+
+        batch.pos[:] = self._pos
+        batch.rot[:] = self._rot
+
+
+class EstimateVelocity(Stage):
+    """replaces velocity and angular velocity with finite differences of the pose""" # noqa E501
+
+    def __init__(self, alpha=1, devices=None):
+        """:alpha: weight of the new estimate, below 1 smooths the velocities"""
+        super().__init__(devices)
+        self.alpha = float(alpha)
+        self._pos = None
+        self._rot = None
+        self._vel = None
+        self._ang_vel = None
+
+    def process(self, batch, dt):
+        if self._pos is None or self._pos.shape != batch.pos.shape or dt <= 0: # noqa E501
+            self._pos = batch.pos.copy()
+            self._rot = batch.rot.copy()
+            self._vel = np.zeros_like(batch.vel)
+            self._ang_vel = np.zeros_like(batch.ang_vel)
+            return
+
+        vel = (batch.pos - self._pos) / dt
+
+        # rotation since the last frame, in world space
+        conj = self._rot * np.array([1, -1, -1, -1], dtype=self._rot.dtype)
+        delta = _quat_mul(batch.rot, conj)
+        delta[delta[:, 0] < 0] *= -1
+        ang = 2 * np.arctan2(
+            np.linalg.norm(delta[:, 1:], axis=1), delta[:, 0]
+        )
+        axis = _normalize(delta[:, 1:])
+        ang_vel = axis * (ang / dt)[:, None]
+
+        self._vel += self.alpha * (vel - self._vel)
+        self._ang_vel += self.alpha * (ang_vel - self._ang_vel)
+        self._pos = batch.pos.copy()
+        self._rot = batch.rot.copy()
+
+        batch.vel[:] = self._vel
+        batch.ang_vel[:] = self._ang_vel
+
+
+class Predict(Stage):
+    """constant velocity prediction, :horizon: seconds ahead"""
+
+    def __init__(self, horizon=0.02, devices=None):
+        super().__init__(devices)
+        self.horizon = float(horizon)
+
+    def process(self, batch, dt):
+        batch.pos += batch.vel * self.horizon
+
+        rotvec = batch.ang_vel * self.horizon
+        ang = np.linalg.norm(rotvec, axis=1)
+        axis = _normalize(rotvec)
+        delta = np.concatenate([
+            np.cos(ang / 2)[:, None], axis * np.sin(ang / 2)[:, None]
+        ], axis=1)
+        batch.rot[:] = _normalize(_quat_mul(delta, batch.rot))
+
+
+STAGES = {
+    "smooth": Smooth,
+    "velocity": EstimateVelocity,
+    "predict": Predict,
+}
+
+
+def parse_stage_spec(spec):
+    """
+    'name:key=value:...' into (stage class, kwargs)
+
+    example:
+        parse_stage_spec("smooth:alpha=0.3:devices=0,1")
+    """
+    name, *opts = spec.split(":")
+    if name not in STAGES:
+        raise ValueError(f"unknown stage {repr(name)}, expected one of {list(STAGES)}") # noqa E501
+
+    kwargs = {}
+    for i in opts:
+        key, _, value = i.partition("=")
+        if key == "devices":
+            kwargs[key] = [int(d) for d in value.split(",")]
+
+        else:
+            kwargs[key] = float(value)
+
+    return STAGES[name], kwargs
+
+
+class PoseProcessor:
+    """
+    runs a list of stages over the frames of one pose source
+
+    example:
+        p = PoseProcessor("h13 c22 c22", [(Smooth, {"alpha": 0.3}), (Predict, {})])
+        frame = p.process(frame, time.monotonic())
+    """
+
+    def __init__(self, udu_string, stages, terminator=b"\t\r\n"):
+        """
+        :udu_string: frame layout, see virtualreality.server.merge.parse_udu
+        :stages: list of (stage class, kwargs), instantiated for this source only
+        :terminator: pose frame terminator
+        """
+        types, sizes = parse_udu(udu_string)
+        self.udu = udu_string
+        self.sizes = sizes
+        self.terminator = terminator
+        self.stages = [cls(**kwargs) for cls, kwargs in stages]
+        self.size = sum(sizes) * 4 + len(terminator)
+        self.skipped = 0
+
+        starts = np.cumsum([0] + sizes[:-1])[:, None]
+        self._pos_idx = starts + np.arange(0, 3)
+        self._rot_idx = starts + np.arange(3, 7)
+        self._vel_idx = starts + np.arange(7, 10)
+        self._ang_vel_idx = starts + np.arange(10, 13)
+        self._n = sum(sizes)
+        self._last_t = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} stages={self.stages} skipped={self.skipped} object at {hex(id(self))}>" # noqa E501
+
+    def process(self, frame, t):
+        """
+        run all stages on a frame received at :t: seconds(monotonic),
+        frames that don't fit the layout are returned as is
+        """
+        if len(frame) != self.size:
+            if not self.skipped:
+                print(f"pose stages skip {len(frame)} byte frames, the layout has {self.size}") # noqa E501
+
+            self.skipped += 1
+            return frame
+
+        dt = 0 if self._last_t is None else t - self._last_t
+        self._last_t = t
+
+        data = np.frombuffer(frame, dtype=np.float32, count=self._n).astype(np.float64) # noqa E501
+        batch = PoseBatch(
+            data[self._pos_idx],
+            data[self._rot_idx],
+            data[self._vel_idx],
+            data[self._ang_vel_idx],
+        )
+        for i in self.stages:
+            i(batch, dt)
+
+        data[self._pos_idx] = batch.pos
+        data[self._rot_idx] = batch.rot
+        data[self._vel_idx] = batch.vel
+        data[self._ang_vel_idx] = batch.ang_vel
+
+        return data.astype(np.float32).tobytes() + self.terminator
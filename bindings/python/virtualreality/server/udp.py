@@ -0,0 +1,207 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Datagram pose transport.
+
+one pose frame per datagram, every datagram starts with dgram_header_t:
+    magic - b"hv"
+    kind - DGRAM_POSE, DGRAM_SUBSCRIBE or DGRAM_UNSUBSCRIBE
+    seq - uint32 sequence number, per sender
+
+the pose frame payload is sent as is, terminator included,
+so receivers can treat it exactly like a frame read from tcp
+"""
+import asyncio
+import struct
+import time
+
+DGRAM_MAGIC = b"hv"
+
+DGRAM_POSE = 0
+DGRAM_SUBSCRIBE = 1
+DGRAM_UNSUBSCRIBE = 2
+
+dgram_header_t = struct.Struct("<2sBxI")
+
+SEQ_MASK = 0xFFFFFFFF
+# a sequence number this far behind the last one means the sender restarted
+SEQ_RESET_WINDOW = 1024
+
+
+def pack_dgram(kind, seq, payload=b""):
+    """build a datagram"""
+    return dgram_header_t.pack(DGRAM_MAGIC, kind, seq & SEQ_MASK) + payload
+
+
+def unpack_dgram(data):
+    """split a datagram into (kind, seq, payload), returns None if its not one of ours"""
+    if len(data) < dgram_header_t.size:
+        return None
+
+    magic, kind, seq = dgram_header_t.unpack_from(data)
+    if magic != DGRAM_MAGIC:
+        return None
+
+    return kind, seq, data[dgram_header_t.size:]
+
+
+def seq_newer(seq, last):
+    """True if :seq: comes after :last:, wrap around safe"""
+    return 0 < ((seq - last) & SEQ_MASK) < 0x80000000
+
+
+class SequenceFilter:
+    """
+    drops out of order and stale datagrams, per source
+
+    example:
+        f = SequenceFilter()
+        f.accept("a", 1)  # True
+        f.accept("a", 3)  # True
+        f.accept("a", 2)  # False, late
+    """
+
+    __slots__ = ["dropped", "_last"]
+
+    def __init__(self):
+        """init"""
+        self.dropped = 0
+        self._last = {}
+
+    def accept(self, source, seq):
+        """returns True if :seq: is the newest from :source: so far"""
+        last = self._last.get(source)
+        if (
+            last is None
+            or seq_newer(seq, last)
+            or ((last - seq) & SEQ_MASK) > SEQ_RESET_WINDOW  # noqa break before or, its unreadable otherwise
+        ):
+            self._last[source] = seq
+            return True
+
+        self.dropped += 1
+        return False
+
+    def forget(self, source):
+        """forget everything about :source:"""
+        self._last.pop(source, None)
+
+
+class PoseDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    server side of the datagram transport
+
+    pose datagrams from posers are filtered and handed to
+    server.handle_pose_frame, from there they reach tcp drivers and
+    every address that subscribed with a DGRAM_SUBSCRIBE datagram
+
+    subscriptions expire if they are not renewed within self.subscription_timeout,
+    posers that went quiet are dropped by the server's reap loop, see self.expire_sources
+    """
+
+    def __init__(self, server, subscription_timeout=5):
+        """
+        :server: the Server instance this endpoint belongs to
+        :subscription_timeout: seconds, stored in self.subscription_timeout
+        """
+        self.server = server
+        self.subscription_timeout = subscription_timeout
+        self.transport = None
+        self.subscribers = {}
+        self.sources = {}  # poser address -> last pose datagram
+        self.filter = SequenceFilter()
+        self._seq = 0
+
+        self.datagrams_in = 0
+        self.datagrams_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server._udp_endpoint = self
+
+    def connection_lost(self, exc):
+        if self.server._udp_endpoint is self:
+            self.server._udp_endpoint = None
+
+    def datagram_received(self, data, addr):
+        self.datagrams_in += 1
+        self.bytes_in += len(data)
+
+        dgram = unpack_dgram(data)
+        if dgram is None:
+            return
+
+        kind, seq, payload = dgram
+        if kind == DGRAM_POSE:
+            self.sources[addr] = time.monotonic()
+            if self.filter.accept(addr, seq):
+                self.server.handle_pose_frame(payload, addr)
+
+        elif kind == DGRAM_SUBSCRIBE:
+            new = addr not in self.subscribers
+            self.subscribers[addr] = time.monotonic()
+            if new:
+                print(f"new udp subscriber {addr}")
+                for frame in list(self.server.channel_of(addr).last_frames.values()): # noqa E501
+                    self._send_to(addr, frame)
+
+        elif kind == DGRAM_UNSUBSCRIBE:
+            self.subscribers.pop(addr, None)
+            self.filter.forget(addr)
+            print(f"udp subscriber {addr} left")
+
+    def error_received(self, exc):
+        print(f"udp endpoint error: {exc}")
+
+    def _send_to(self, addr, frame):
+        self._seq = (self._seq + 1) & SEQ_MASK
+        dgram = pack_dgram(DGRAM_POSE, self._seq, frame)
+        self.transport.sendto(dgram, addr)
+        self.datagrams_out += 1
+        self.bytes_out += len(dgram)
+
+    def send_frame(self, frame):
+        """send a pose frame to every live subscriber"""
+        if not self.subscribers:
+            return
+
+        self._seq = (self._seq + 1) & SEQ_MASK
+        dgram = pack_dgram(DGRAM_POSE, self._seq, frame)
+        now = time.monotonic()
+        for addr, last_seen in list(self.subscribers.items()):
+            if now - last_seen > self.subscription_timeout:
+                del self.subscribers[addr]
+                print(f"udp subscriber {addr} timed out")
+                continue
+
+            self.transport.sendto(dgram, addr)
+            self.datagrams_out += 1
+            self.bytes_out += len(dgram)
+
+    def expire_sources(self, idle_timeout):
+        """
+        forget posers that sent nothing for :idle_timeout: seconds,
+        returns their addresses, for server.source_gone
+        """
+        now = time.monotonic()
+        gone = [i for i, t in self.sources.items() if now - t > idle_timeout]
+        for i in gone:
+            del self.sources[i]
+            self.filter.forget(i)
+
+        return gone
+
+    def stats(self):
+        """counters as a json friendly dict"""
+        return {
+            "subscribers": len(self.subscribers),
+            "sources": len(self.sources),
+            "datagrams_in": self.datagrams_in,
+            "datagrams_out": self.datagrams_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "dropped": self.filter.dropped,
+        }
@@ -0,0 +1,311 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Server to server relay, for tracking nodes with their own local posers.
+
+a relay server keeps one persistent, reconnecting link to an upstream server
+and forwards the frames of its local posers over it, the upstream server fans
+them out as if the posers were its own
+
+pose link, id 'relay', optionally with 'channel=<name>':
+    up - relay_header_t(magic b"hvrl", source id, frame length), frame
+        a 0 length frame means the source is gone, its id can come back
+        for a new source later
+    down - driver messages, as is, for the relay's local posers
+
+manager link, id 'monky ids=1', same channel:
+    local manager requests go up with a request id, see
+    virtualreality.server.manager, replies come back to whoever asked,
+    anything else from upstream goes to the local managers as is
+
+only the newest frame of every source is kept while the link is busy or down,
+whatever piled up goes out in one write
+"""
+import asyncio
+import struct
+
+from .channels import DEFAULT_CHANNEL
+from .manager import ReplyReader, pack_request
+from .net import tune_socket
+
+RELAY_MAGIC = b"hvrl"
+
+relay_header_t = struct.Struct("<4sHI")
+
+
+def pack_relay_frame(source_id, frame):
+    """one frame on the pose link"""
+    return relay_header_t.pack(RELAY_MAGIC, source_id, len(frame)) + frame
+
+
+def pack_relay_gone(source_id):
+    """a source is gone, on the pose link"""
+    return relay_header_t.pack(RELAY_MAGIC, source_id, 0)
+
+
+class RelayFrameReader:
+    """
+    upstream side of the pose link, turns a byte stream back into frames,
+    gone records come out as empty frames
+
+    example:
+        r = RelayFrameReader()
+        for source_id, frame in r.feed(data):
+            ...
+    """
+
+    __slots__ = ["max_size", "_buff"]
+
+    def __init__(self, max_size=1 << 16):
+        """:max_size: biggest frame accepted, stored in self.max_size"""
+        self.max_size = max_size
+        self._buff = bytearray()
+
+    def feed(self, data):
+        """
+        add received bytes, returns a list of (source id, frame)
+
+        raises ValueError if the stream is not a relay stream
+        """
+        self._buff += data
+        ret = []
+        pos = 0
+        while len(self._buff) - pos >= relay_header_t.size:
+            magic, sid, ln = relay_header_t.unpack_from(self._buff, pos)
+            if magic != RELAY_MAGIC or ln > self.max_size:
+                raise ValueError("bad relay frame header")
+
+            end = pos + relay_header_t.size + ln
+            if end > len(self._buff):
+                break
+
+            ret.append((sid, bytes(self._buff[pos + relay_header_t.size:end])))
+            pos = end
+
+        del self._buff[:pos]
+        return ret
+
+
+class UpstreamLink:
+    """
+    relay side, the link to the upstream server
+
+    frames are handed over with self.publish, they never wait on the link
+    """
+
+    def __init__(self, server, addr, port, channel=None, reconnect_delay=1):
+        """
+        :server: the local Server instance
+        :addr: upstream address, stored in self.addr
+        :port: upstream port, stored in self.port
+        :channel: upstream channel to join, stored in self.channel
+        :reconnect_delay: seconds between reconnect attempts, doubles up to 8x
+        """
+        self.server = server
+        self.addr = addr
+        self.port = port
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+
+        self.connected = False
+        self.reconnects = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+
+        self._source_ids = {}
+        self._free_ids = []  # ids of gone sources, for new ones
+        self._latest = {}
+        self._pending = set()
+        self._gone = set()
+        self._ready = asyncio.Event()
+        self._manager_writer = None
+        self._requests = {}
+        self._next_rid = 1
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} upstream={self.addr}:{self.port} connected={self.connected} sources={len(self._source_ids)} object at {hex(id(self))}>" # noqa E501
+
+    def publish(self, frame, source):
+        """queue a frame of a local source, the newest one per source wins"""
+        sid = self._source_ids.get(source)
+        if sid is None:
+            if self._free_ids:
+                sid = self._free_ids.pop()
+
+            elif len(self._source_ids) > 0xFFFF:
+                return  # out of ids, the header only has 16 bits
+
+            else:
+                sid = len(self._source_ids)
+
+            self._source_ids[source] = sid
+
+        self._latest[sid] = frame
+        self._pending.add(sid)
+        self._ready.set()
+
+    def forget(self, source):
+        """a local source is gone, upstream forgets it too, its id is up for reuse"""
+        sid = self._source_ids.pop(source, None)
+        if sid is not None:
+            self._latest.pop(sid, None)
+            self._pending.discard(sid)
+            self._free_ids.append(sid)
+            if self.connected:
+                self._gone.add(sid)
+                self._ready.set()
+
+    def send_manager(self, msg, req):
+        """
+        forward a local manager request, :req: is its ManagerRequest,
+        returns False while the link is down
+        """
+        if self._manager_writer is None:
+            return False
+
+        rid = self._next_rid
+        self._next_rid = rid % 0xFFFFFFFF + 1
+        self._requests[rid] = req
+        self._manager_writer.write(pack_request(rid, msg))
+        return True
+
+    def _fail_requests(self):
+        # the link went down, nothing outstanding will be answered
+        for req in self._requests.values():
+            self.server.answer_manager_request(req, b"-100")
+
+        self._requests.clear()
+
+    def stats(self):
+        """counters as a json friendly dict"""
+        return {
+            "upstream": f"{self.addr}:{self.port}",
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "sources": len(self._latest),
+            "frames_out": self.frames_out,
+            "bytes_out": self.bytes_out,
+        }
+
+    def _id(self, name):
+        return f"{name} channel={self.channel}\n" if self.channel else f"{name}\n" # noqa E501
+
+    async def run(self):
+        """keep the link up forever"""
+        delay = self.reconnect_delay
+        while 1:
+            try:
+                reader, writer = await asyncio.open_connection(
+                    self.addr, self.port
+                )
+                m_reader, m_writer = await asyncio.open_connection(
+                    self.addr, self.port
+                )
+
+            except OSError as e:
+                print(f"upstream {self.addr}:{self.port} unreachable: {e}, retrying in {delay}s") # noqa E501
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_delay * 8)
+                continue
+
+            except asyncio.CancelledError:
+                return
+
+            if self.server.socket_tuning:
+                tune_socket(writer.get_extra_info("socket"))
+
+            writer.write(self._id("relay").encode("utf-8"))
+            m_writer.write(self._id("monky ids=1").encode("utf-8"))
+            self._manager_writer = m_writer
+            self.connected = True
+            delay = self.reconnect_delay
+            print(f"relaying to {self.addr}:{self.port}")
+
+            # the upstream side starts from scratch, resend everything we have
+            self._gone.clear()
+            self._pending.update(self._latest)
+            self._ready.set()
+
+            tasks = [
+                asyncio.ensure_future(self._send_loop(writer)),
+                asyncio.ensure_future(self._down_loop(reader, False)),
+                asyncio.ensure_future(self._down_loop(m_reader, True)),
+            ]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            except asyncio.CancelledError:
+                return
+
+            finally:
+                for i in tasks:
+                    i.cancel()
+
+                self.connected = False
+                self._manager_writer = None
+                self._fail_requests()
+                for i in (writer, m_writer):
+                    try:
+                        i.close()
+
+                    except Exception:
+                        pass
+
+            self.reconnects += 1
+            print(f"upstream link to {self.addr}:{self.port} lost, reconnecting")
+            await asyncio.sleep(delay)
+
+    async def _send_loop(self, writer):
+        try:
+            while 1:
+                await self._ready.wait()
+                self._ready.clear()
+
+                # gone first, a reused id is a new source
+                gone = [pack_relay_gone(i) for i in self._gone]
+                self._gone.clear()
+                batch = [
+                    pack_relay_frame(i, self._latest[i]) for i in self._pending
+                    if i in self._latest
+                ]
+                self._pending.clear()
+                self.frames_out += len(batch)
+                batch = gone + batch
+                batch = b"".join(batch)
+                if not batch:
+                    continue
+
+                writer.write(batch)
+                self.bytes_out += len(batch)
+                await writer.drain()
+
+        except Exception as e:
+            print(f"upstream send failed: {e}")
+
+    async def _down_loop(self, reader, manager):
+        replies = ReplyReader()
+        ch = self.server.channels[DEFAULT_CHANNEL]
+        try:
+            while 1:
+                data = await reader.read(self.server._read_size)
+                if not data:
+                    return
+
+                if not manager:
+                    self.server.broadcast(data, ch, ("poser_conz",), None)
+                    continue
+
+                for rid, reply in replies.feed(data):
+                    if rid is None:
+                        self.server.broadcast(
+                            reply, ch, ("manager_conz",), None, urgent=True
+                        )
+
+                    elif rid in self._requests:
+                        self.server.answer_manager_request(
+                            self._requests.pop(rid), reply
+                        )
+
+        except Exception as e:
+            print(f"upstream receive failed: {e}")
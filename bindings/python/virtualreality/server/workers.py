@@ -0,0 +1,116 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Multi process server, 'server --workers=<n>'.
+
+n worker processes listen on the same port with SO_REUSEPORT, the kernel
+spreads new connections over them, and route to each other over the pose bus,
+see virtualreality.server.bus, a driver gets the frames of every poser no
+matter which worker either of them landed on
+
+the first worker is the primary one, only it records, replays, merges,
+serves udp and keeps the upstream link, the others hand it what it needs
+
+stats reports only count the reporting worker's own connections, 'bus' in
+the report says which worker that is
+
+linux only, needs fork and SO_REUSEPORT
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from .bus import PoseBus, BUS_SLOT_SIZE, BUS_SLOT_COUNT
+from .ring import PoseRing
+
+
+def supported():
+    """True if this platform can run workers"""
+    return (
+        hasattr(socket, "SO_REUSEPORT")
+        and "fork" in multiprocessing.get_all_start_methods()
+    )
+
+
+def _worker(conn_handle, run, index, rings, doorbells):
+    conn_handle.worker = index
+    conn_handle._bus = PoseBus(conn_handle, index, rings, doorbells)
+    try:
+        run(conn_handle=conn_handle)
+
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(conn_handle, run):
+    """
+    run :conn_handle: in conn_handle.workers processes until they die
+
+    :run: runs a single worker, virtualreality.server.server.run_til_dead
+    """
+    if not supported():
+        raise SystemExit("workers need fork and SO_REUSEPORT, linux only")
+
+    n = conn_handle.workers
+    paths = [
+        os.path.join(tempfile.gettempdir(), f"hobovr_bus_{os.getpid()}_{i}")
+        for i in range(n)
+    ]
+    # made before forking, so every ring exists before anyone reads it
+    rings = [
+        PoseRing(i, create=True, slot_size=BUS_SLOT_SIZE, slot_count=BUS_SLOT_COUNT) # noqa E501
+        for i in paths
+    ]
+    doorbells = [os.pipe() for _ in range(n)]
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [
+        ctx.Process(
+            target=_worker,
+            args=(conn_handle, run, i, rings, doorbells),
+            name=f"pose_worker{i}",
+        )
+        for i in range(n)
+    ]
+    print(f"starting {n} workers")
+    for i in procs:
+        i.start()
+
+    # a plain kill shouldn't leave the workers behind
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        # one goes, they all go
+        while all(i.is_alive() for i in procs):
+            time.sleep(0.2)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for i in procs:
+            if i.is_alive():
+                i.terminate()
+
+        for i in procs:
+            i.join()
+
+        for i in rings:
+            i.close()
+
+        for i in paths:
+            try:
+                os.remove(i)
+
+            except OSError:
+                pass
+
+        for r, w in doorbells:
+            os.close(r)
+            os.close(w)
+
+    print(f"workers done, exit codes {[i.exitcode for i in procs]}")
@@ -0,0 +1,115 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+pose frame encoder microbenchmark.
+
+per frame cost of the old per device struct.pack against FrameEncoder,
+devices alternate between trackers(13 values) and controllers(22 values)
+
+the update columns also move every device first, attribute by attribute
+into FrameEncoder, against one vectorized write into a PoseStore
+
+usage:
+    encoder_bench [options]
+
+options:
+    -h --help               shows this message
+    -d --devices=<n>        comma separated device counts [default: 3,16,64]
+    -n --frames=<n>         frames encoded per measurement [default: 20000]
+    -r --repeat=<n>         measurements per device count, the best one counts [default: 5]
+    --rate=<hz>             send rate the cpu share is shown for [default: 250]
+    --json                  print the report as a single json line
+"""
+import json
+import struct
+import time
+
+from docopt import docopt
+
+import numpy as np
+
+from .encoder import FrameEncoder
+from .pose_store import PoseStore
+from .poses import Pose, ControllerState
+
+TERMINATOR = b"\t\r\n"
+
+
+def encode_per_device(poses):
+    """what UduPoserTemplate.send used to do every tick"""
+    return b"".join(
+        [struct.pack(f"{len(i)}f", *i.get_vals()) for i in poses]
+    ) + TERMINATOR
+
+
+def _best(fn, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(frames):
+            fn()
+
+        t = (time.perf_counter() - t0) / frames
+        best = t if best is None else min(best, t)
+
+    return best
+
+
+def measure(devices, frames=20000, repeat=5):
+    """per frame seconds of both encoders for :devices: devices"""
+    poses = [ControllerState() if i % 2 else Pose() for i in range(devices)]
+    enc = FrameEncoder.for_poses(poses, terminator=TERMINATOR)
+    if bytes(enc.encode(poses)) != encode_per_device(poses):
+        raise RuntimeError("encoders disagree")
+
+    store = PoseStore(" ".join("c" if i % 2 else "t" for i in range(devices)))
+    if bytes(store.frame()) != encode_per_device(poses):
+        raise RuntimeError("pose store disagrees")
+
+    positions = np.random.rand(devices, 3).astype(np.float32)
+    rows = positions.tolist()
+    idx = store.index("x", "y", "z")
+
+    def attr_update():
+        for p, (x, y, z) in zip(poses, rows):
+            p.x = x
+            p.y = y
+            p.z = z
+
+        return enc.encode(poses)
+
+    def store_update():
+        store.values[idx] = positions
+        return store.frame()
+
+    return {
+        "devices": devices,
+        "frame_size": len(enc),
+        "per_device_us": round(_best(lambda: encode_per_device(poses), frames, repeat) * 1e6, 3), # noqa E501
+        "encoder_us": round(_best(lambda: enc.encode(poses), frames, repeat) * 1e6, 3), # noqa E501
+        "attr_update_us": round(_best(attr_update, frames, repeat) * 1e6, 3),
+        "store_update_us": round(_best(store_update, frames, repeat) * 1e6, 3), # noqa E501
+    }
+
+
+def main():
+    """cli entry point"""
+    args = docopt(__doc__)
+    rate = float(args["--rate"])
+    reports = [
+        measure(int(i), int(args["--frames"]), int(args["--repeat"]))
+        for i in args["--devices"].split(",")
+    ]
+    if args["--json"]:
+        print(json.dumps(reports))
+        return
+
+    print(f"per frame cost, best of {args['--repeat']} x {args['--frames']} frames, cpu share at {rate:g}Hz") # noqa E501
+    for r in reports:
+        print(f"  {r['devices']:>3} device(s), {r['frame_size']:>5} byte frames: per device pack {r['per_device_us']}us ({r['per_device_us'] * rate / 1e4:.3f}%), encoder {r['encoder_us']}us ({r['encoder_us'] * rate / 1e4:.3f}%), {r['per_device_us'] / r['encoder_us']:.2f}x") # noqa E501
+        print(f"      update + encode: attributes {r['attr_update_us']}us, pose store {r['store_update_us']}us, {r['attr_update_us'] / r['store_update_us']:.2f}x") # noqa E501
+
+
+if __name__ == "__main__":
+    main()
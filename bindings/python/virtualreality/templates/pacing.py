@@ -0,0 +1,125 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Deadline based loop pacing.
+
+'await asyncio.sleep(delay)' after the work runs a loop at 1/(work + delay)
+and whatever the event loop adds on top, a Pacer sleeps until an absolute
+monotonic deadline instead, every tick one period after the last deadline,
+so the rate holds no matter how long the work took, as long as it fits
+
+a tick that overran its deadline:
+    SKIP - runs right away, the ticks it missed are dropped, counted in
+        self.skipped, the next deadline is a whole period after it
+    CATCH_UP - runs right away, so do the missed ones, back to back, until
+        the loop is on time again, at most a second worth of them
+
+lateness, how long after its deadline a tick actually ran, goes into a
+LatencyHistogram, see virtualreality.server.metrics
+"""
+import asyncio
+import time
+
+from ..server.metrics import LatencyHistogram
+
+SKIP = "skip"
+CATCH_UP = "catch_up"
+POLICIES = (SKIP, CATCH_UP)
+
+
+class Pacer:
+    """
+    sleeps until the next deadline of a loop
+
+    example:
+        pacer = Pacer(1 / 90)
+        while 1:
+            do_work()
+            await pacer.wait()
+    """
+
+    __slots__ = ["period", "policy", "ticks", "skipped", "late", "_deadline", "_t0"] # noqa E501
+
+    def __init__(self, period, policy=SKIP):
+        """
+        :period: seconds between deadlines, stored in self.period
+        :policy: SKIP or CATCH_UP, what to do about overruns, stored in self.policy
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"unknown pacing policy {repr(policy)}, one of {POLICIES}") # noqa E501
+
+        self.period = period
+        self.policy = policy
+        self.ticks = 0
+        self.skipped = 0
+        self.late = LatencyHistogram()
+
+        self._deadline = None
+        self._t0 = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} period={self.period} policy={self.policy} ticks={self.ticks} skipped={self.skipped} object at {hex(id(self))}>" # noqa E501
+
+    def _next(self, now):
+        # the next deadline, and how long to sleep until it
+        if self._deadline is None:
+            self._deadline = self._t0 = now
+
+        period = self.period
+        self._deadline += period
+        behind = now - self._deadline
+        if behind > 0 and period > 0:
+            missed = int(behind // period)
+            if missed and (self.policy == SKIP or missed * period > 1):
+                self._deadline += missed * period
+                self.skipped += missed
+
+        return self._deadline - now
+
+    def _tick(self):
+        self.ticks += 1
+        self.late.add(max(time.monotonic() - self._deadline, 0))
+
+    async def wait(self, period=None):
+        """
+        sleep until the next deadline, or yield once if it already passed
+
+        :period: new period, from now on
+        """
+        if period is not None:
+            self.period = period
+
+        await asyncio.sleep(max(self._next(time.monotonic()), 0))
+        self._tick()
+
+    def wait_sync(self, period=None):
+        """self.wait for loops in executor threads"""
+        if period is not None:
+            self.period = period
+
+        delay = self._next(time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+
+        self._tick()
+
+    def rate(self):
+        """ticks per second so far"""
+        if not self.ticks:
+            return 0
+
+        return self.ticks / max(time.monotonic() - self._t0, 1e-9)
+
+    def stats(self):
+        """json friendly, in milliseconds"""
+        return {
+            "target_hz": round(1 / self.period, 2) if self.period else None,
+            "rate_hz": round(self.rate(), 2),
+            "policy": self.policy,
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "late_p50_ms": round(self.late.percentile(50) * 1e3, 3),
+            "late_p99_ms": round(self.late.percentile(99) * 1e3, 3),
+            "late_max_ms": round(self.late.max * 1e3, 3),
+        }
@@ -0,0 +1,138 @@
+# (c) 2021 Okawo
+# This code is licensed under MIT license (see LICENSE for details)
+
+"""
+Contiguous pose store, every device's values in one float32 array.
+
+the array lives inside the frame buffer itself, between the header(partial
+frames only) and the terminator, so the frame is always ready to send, no
+get_vals, no packing
+
+self.poses are Pose/ControllerState views into the array, same attributes,
+same get_vals, so existing poser code keeps working, while trackers that
+have many devices can write them all at once:
+
+    store = PoseStore("t t t t")
+    store.values[store.index("x", "y", "z")] = positions  # (4, 3) array
+    store.poses[0].r_w = 1
+
+values are float32, a value read back is the float32 the driver gets,
+not always the float that was written
+
+with on_change every write through a view calls it, writes straight into
+self.values can't be seen, call it yourself after those
+"""
+import numpy as np
+
+from .poses import Pose, ControllerState, tracked_class
+
+DEVICE_CLASSES = {"h": Pose, "t": Pose, "c": ControllerState}
+
+
+def _view_property(i):
+    def _get(self):
+        return float(self._vals[i])
+
+    def _set(self, val):
+        self._vals[i] = val
+
+    return property(_get, _set)
+
+
+def _view_class(base):
+    # properties shadow the base class slots, self.__slots__ still lists the
+    # fields, so __getitem__, __setitem__ and __repr__ work unchanged
+    def __init__(self, vals, *args, **kwargs):
+        self._vals = vals
+        base.__init__(self, *args, **kwargs)
+
+    def get_vals(self):
+        return self._vals.tolist()
+
+    attrs = {key: _view_property(i) for i, key in enumerate(base.__slots__)}
+    attrs["__init__"] = __init__
+    attrs["get_vals"] = get_vals
+    attrs["__doc__"] = f"{base.__name__} that lives in a PoseStore"
+    return type(f"{base.__name__}View", (base,), attrs)
+
+
+PoseView = _view_class(Pose)
+ControllerStateView = _view_class(ControllerState)
+
+_VIEW_CLASSES = {Pose: PoseView, ControllerState: ControllerStateView}
+_TRACKED_VIEW_CLASSES = {k: tracked_class(v) for k, v in _VIEW_CLASSES.items()}
+
+
+class PoseStore:
+    """
+    pose values of all devices in a single frame buffer, see the module docs
+
+    example:
+        store = PoseStore("h c c")
+        store.poses[1].trigger_click = 1
+        writer.write(store.frame())
+    """
+
+    def __init__(self, udu_string, header=b"", terminator=b"\t\r\n", on_change=None):
+        """
+        :udu_string: device types, 'h c c'
+        :header: bytes in front of the values, see virtualreality.server.merge.pack_partial_header
+        :terminator: frame terminator
+        :on_change: called after every write through self.poses, see the module docs
+        """
+        self.device_types = udu_string.split(" ")
+        self.header = header
+        self.terminator = terminator
+
+        classes = [DEVICE_CLASSES[i] for i in self.device_types]
+        self.sizes = [len(i.__slots__) for i in classes]
+        self.offsets = np.cumsum([0] + self.sizes[:-1]).tolist()
+
+        self._buff = bytearray(header + bytes(4 * sum(self.sizes)) + terminator)
+        self.values = np.frombuffer(
+            self._buff, dtype=np.float32, count=sum(self.sizes), offset=len(header) # noqa E501
+        )
+        self.devices = [
+            self.values[o:o + s] for o, s in zip(self.offsets, self.sizes)
+        ]
+        # views write their defaults into the store
+        if on_change is None:
+            self.poses = [
+                _VIEW_CLASSES[c](v) for c, v in zip(classes, self.devices)
+            ]
+
+        else:
+            self.poses = [
+                _TRACKED_VIEW_CLASSES[c](v, on_change=on_change)
+                for c, v in zip(classes, self.devices)
+            ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__module__}.{self.__class__.__name__} devices={len(self.poses)} frame_size={len(self)} object at {hex(id(self))}>" # noqa E501
+
+    def __len__(self):
+        return len(self._buff)
+
+    def index(self, *fields, devices=None):
+        """
+        flat indices of :fields: in self.values, one row per device
+
+        :devices: device indices, all devices by default, every one of them
+            needs every field, controller fields only exist on controllers
+        """
+        if devices is None:
+            devices = range(len(self.poses))
+
+        rows = []
+        for d in devices:
+            slots = self.poses[d].__slots__
+            rows.append([self.offsets[d] + slots.index(f) for f in fields])
+
+        return np.array(rows, dtype=np.intp)
+
+    def frame(self):
+        """
+        the frame, ready to send, it is the store's own buffer,
+        copy it if it has to outlive the next write
+        """
+        return self._buff
@@ -291,6 +291,40 @@ class ControllerState(Pose):
         return 22
 
 
+def _no_change():
+    pass
+
+
+def tracked_class(base):
+    """
+    subclass of the pose class :base: that calls self.on_change() after every
+    attribute write, the templates use it with on_change, so writing a pose
+    wakes the send thread
+
+    example:
+        TrackedPose(on_change=poser.pose_changed).x = 1  # -> pose_changed()
+    """
+    def __init__(self, *args, on_change=None, **kwargs):
+        object.__setattr__(self, "on_change", on_change or _no_change)
+        base.__init__(self, *args, **kwargs)
+
+    def __setattr__(self, key, val):
+        base.__setattr__(self, key, val)
+        self.on_change()
+
+    return type(f"Tracked{base.__name__}", (base,), {
+        "__init__": __init__,
+        "__setattr__": __setattr__,
+        "__doc__": f"{base.__name__} that calls self.on_change() after every write", # noqa E501
+    })
+
+
+TrackedPose = tracked_class(Pose)
+TrackedControllerState = tracked_class(ControllerState)
+
+TRACKED_CLASSES = {Pose: TrackedPose, ControllerState: TrackedControllerState}
+
+
 def get_slot_values(slotted_instance):
     """Get all slot values in a class with slots."""
     # thanks: https://stackoverflow.com/a/6720815/782170
@@ -9,6 +9,18 @@ from aioconsole import ainput
 import shlex
 import docopt
 import struct
+import json
+import time
+from collections import deque
+
+from ..server.udp import pack_dgram, DGRAM_POSE
+from ..server.ring import PoseRing, DEFAULT_RING_PATH
+from ..server.manager import IDS_ACK, REPLY_TIMEOUT, ReplyReader, pack_request
+from ..server.net import tune_socket
+from ..server.heartbeat import HEARTBEAT_MSG
+from ..server.compact import CompactCodec, velocity_mask
+from .pacing import Pacer, SKIP
+from .poses import TRACKED_CLASSES
 
 
 class KeepAliveTrigger:
@@ -65,6 +77,11 @@ class PoserTemplateBase(object):
 
     every child class also needs to register it's thread
     methods with the PoserTemplate.register_member_thread decorator
+
+    threads end their loops with 'await self.pace(name)' instead of
+    sleeping, they run at 1/sleep_delay against monotonic deadlines,
+    self.loop_stats() says how close they got, loops that wait for reads,
+    like recv, aren't paced
     """
 
     _CLI_SETTS = '''hobo_vr poser
@@ -74,6 +91,7 @@ Usage: poser [-h | --help] [options]
 Options:
     -h, --help      shows this message
     -q, --quit      exits the poser
+    -l, --loops     prints the pacing stats of every thread
 '''
 
     def __init__(
@@ -83,6 +101,19 @@ Options:
         port=6969,
         send_delay=1 / 100,
         recv_delay=1 / 1000,
+        udp=False,
+        pose_ring=None,
+        channel=None,
+        socket_tuning=True,
+        heartbeats=True,
+        idle_timeout=5,
+        on_change=False,
+        max_rate=None,
+        keep_alive_rate=1,
+        compact=False,
+        velocity=None,
+        pacing=SKIP,
+        manager_timeout=REPLY_TIMEOUT,
         **kwargs,
     ):
         """
@@ -90,11 +121,61 @@ Options:
         :port: is the port of the server to connect to, stored in self.port
         :send_delay: sleep delay for the self.send thread(in seconds)
         :recv_delay: sleep delay for the self.recv thread(in seconds)
+        :udp: send pose frames as datagrams instead of over tcp, stored in self.udp
+                    the server has to be started with udp enabled
+        :pose_ring: publish pose frames into a same host pose ring instead,
+                    path to the ring file or True for the default path,
+                    stored in self.pose_ring
+        :channel: server channel to join, None is the default channel, stored in self.channel
+                    udp poses always go to the default channel
+        :socket_tuning: low latency socket options on the pose connection,
+                    see virtualreality.server.net, stored in self.socket_tuning
+        :heartbeats: ask the server for heartbeats and answer them, so a dead
+                    poser gets dropped quickly, see virtualreality.server.heartbeat,
+                    stored in self.heartbeats
+        :idle_timeout: give up on the server if it goes silent for this long(in seconds),
+                    only once it sent a heartbeat, None never does, stored in self.idle_timeout
+        :on_change: send a frame when the poses change instead of every send_delay,
+                    writes to the template's poses call self.pose_changed() by
+                    themselves, stored in self.on_change
+        :max_rate: most frames per second with on_change, None is 1/send_delay,
+                    stored in self.max_rate
+        :keep_alive_rate: least frames per second with on_change, the frame is resent
+                    even if nothing changed, None never does, stored in self.keep_alive_rate
+        :compact: send quantized compact frames, a fraction of the size, tcp only,
+                    see virtualreality.server.compact, stored in self.compact
+        :velocity: with compact, a bool per device, False for devices that never send
+                    velocities, or False for none at all, None is all, stored in self.velocity
+        :pacing: what paced loops do about overruns, 'skip' or 'catch_up',
+                    see virtualreality.templates.pacing, stored in self.pacing
+        :manager_timeout: seconds to wait for a manager reply before giving up,
+                    stored in self.manager_timeout
         """
+        if compact and (udp or pose_ring):
+            raise RuntimeError("compact frames are tcp only")
+
         self.addr = addr
         self.port = port
-
-        self._coro_name_exceptions = ["main", "register_member_thread"]
+        self.udp = udp
+        self.pose_ring = DEFAULT_RING_PATH if pose_ring is True else pose_ring
+        self.channel = channel
+        self.socket_tuning = socket_tuning
+        self.heartbeats = heartbeats
+        self.idle_timeout = idle_timeout
+        self.on_change = on_change
+        self.max_rate = max_rate
+        self.keep_alive_rate = keep_alive_rate
+        self.compact = compact
+        self.velocity = velocity
+        self._codec = None
+        self.pacing = pacing
+        self.pacers = {}
+        self.manager_timeout = manager_timeout
+
+        self._coro_name_exceptions = [
+            "main", "register_member_thread", "pose_changed",
+            "pace", "pace_sync", "loop_stats",
+        ]
 
         self.coro_list = [
             method_name
@@ -111,8 +192,31 @@ Options:
         }
         self.last_read = b""
         self.id_message = "holla"
-        self.manager_id_message = "monky"
+        self.manager_id_message = "monky ids=1"
+        if heartbeats:
+            self.id_message += " hb=1"
+            self.manager_id_message += " hb=1"
+        if channel:
+            self.id_message += f" channel={channel}"
+            self.manager_id_message += f" channel={channel}"
         self._terminator = b"\t\r\n"
+        self._udp_transport = None
+        self._udp_seq = 0
+        self._pose_ring = None
+        self._cutover = None  # asyncio.Event while the pose connection is replaced
+        self.manager_rtt = None
+        self._manager_ids = False
+        self._manager_next_rid = 1
+        self._manager_pending = {}
+        self._manager_stats = deque()
+        self._manager_task = None
+        self._heartbeat_seen = False
+        self._dirty = False
+        self._wake = None
+        self._loop = None
+        self.frames_sent = 0
+        self.frames_unchanged = 0
+        self.keep_alives = 0
 
     async def _socket_init(self):
         """
@@ -123,32 +227,353 @@ Options:
         It is not recommended you override this method
         """
         print(f'connecting to the server at "{self.addr}:{self.port}"...')
+        # connect manager, first, its id line finds out what the server knows
+        self._manager_reader, self._manager_writer = await asyncio.open_connection( # noqa E501
+            self.addr, self.port
+        )
+        # send manager id
+        self._manager_writer.write(
+            format_str_for_write(self.manager_id_message)
+        )
+
+        # 0.10 servers confirm request ids right away, older ones take the
+        # whole id line for an unknown id and never answer it
+        try:
+            ack = await asyncio.wait_for(
+                self._manager_reader.readexactly(len(IDS_ACK)), 1
+            )
+            self._manager_ids = ack == IDS_ACK
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self._manager_ids = False
+
+        if self._manager_ids:
+            self._manager_task = asyncio.ensure_future(self._manager_recv())
+
+        else:
+            await self._plain_ids()
+
         # connect
+        await self._poser_connect()
+
+        if self.udp:
+            # poses only, everything else stays on tcp
+            self._udp_transport, _ = await asyncio.get_event_loop().create_datagram_endpoint( # noqa E501
+                asyncio.DatagramProtocol,
+                remote_addr=(self.addr, self.port)
+            )
+
+        if self.pose_ring:
+            # drivers on this machine read poses straight from the ring
+            self._pose_ring = PoseRing(self.pose_ring, create=True)
+            print(f"publishing poses to {repr(self.pose_ring)}")
+
+    async def _poser_connect(self):
+        # the pose connection, the server reads the frame layout from its
+        # id message once, right after connecting
         self.reader, self.writer = await asyncio.open_connection(
-            self.addr, self.port, loop=asyncio.get_event_loop()
+            self.addr, self.port
         )
+        if self.socket_tuning:
+            tune_socket(self.writer.get_extra_info("socket"))
+
         # send poser id
         self.writer.write(format_str_for_write(self.id_message))
 
-        # connect manager
+    async def _poser_reconnect(self):
+        """
+        Reconnect the pose connection with the current self.id_message,
+        the only way to tell the server about a new frame layout.
+
+        The new connection replaces the old one before it is closed,
+        so the send and recv threads just carry on.
+        It is not recommended you override this method
+        """
+        old = self.writer
+        await self._poser_connect()
+        try:
+            old.write(format_str_for_write("CLOSE"))
+            old.close()
+            await old.wait_closed()
+
+        except Exception as e:
+            print(f"failed to close old connection: {e}")
+
+    async def _send_pose(self, msg):
+        """
+        Send a complete pose frame, into the pose ring or over udp
+        if enabled, tcp otherwise.
+
+        It is not recommended you override this method
+        """
+        if self._cutover is not None:
+            # the server still expects the old layout, see self._poser_reconnect
+            await self._cutover.wait()
+
+        if self._pose_ring is not None:
+            self._pose_ring.publish(msg)
+            return
+
+        if self._udp_transport is not None:
+            self._udp_seq += 1
+            self._udp_transport.sendto(
+                pack_dgram(DGRAM_POSE, self._udp_seq, msg)
+            )
+            return
+
+        # frames can be a reused buffer, see templates.encoder, and the
+        # transport may hold on to whatever it couldn't send right away
+        self.writer.write(bytes(msg))
+        await self.writer.drain()
+
+    async def _plain_ids(self):
+        # a server from before id line options, plain 'holla' and 'monky'
+        # on a fresh manager connection, one request at a time
+        if self.compact or self.channel:
+            raise RuntimeError(
+                f"server at {self.addr}:{self.port} doesn't know id line options, compact frames and channels need version 0.10 or newer" # noqa E501
+            )
+
+        print("old server, no manager request ids or heartbeats, one request at a time") # noqa E501
+        self._manager_writer.close()
+        self.id_message = self.id_message.split(" ")[0]
+        self.manager_id_message = self.manager_id_message.split(" ")[0]
         self._manager_reader, self._manager_writer = await asyncio.open_connection( # noqa E501
-            self.addr, self.port, loop=asyncio.get_event_loop()
+            self.addr, self.port
         )
-        # send manager id
         self._manager_writer.write(
             format_str_for_write(self.manager_id_message)
         )
 
+    def _compact_id(self, device_types):
+        # ' udu=h,c,c enc=q vel=100' for the id message, builds self._codec
+        if self.velocity is False:
+            self.velocity = [False] * len(device_types)
+
+        if self.velocity is not None and len(self.velocity) != len(device_types): # noqa E501
+            print("device count changed, dropping velocity flags")
+            self.velocity = None
+
+        self._codec = CompactCodec(
+            " ".join(device_types), self.velocity, self._terminator
+        )
+        ret = f" udu={','.join(device_types)} enc=q"
+        if self.velocity is not None:
+            ret += f" vel={velocity_mask(self.velocity)}"
+
+        return ret
+
+    def _pacer(self, name):
+        pacer = self.pacers.get(name)
+        if pacer is None:
+            pacer = self.pacers[name] = Pacer(
+                self.coro_keep_alive[name].sleep_delay, self.pacing
+            )
+
+        return pacer
+
+    async def pace(self, name):
+        """
+        Sleep until the next deadline of the :name: thread, one
+        self.coro_keep_alive[name].sleep_delay after the last one,
+        use it instead of asyncio.sleep at the end of a thread's loop.
+
+        the thread runs at 1/sleep_delay no matter how long its work took,
+        see virtualreality.templates.pacing, stats are in self.loop_stats()
+        """
+        await self._pacer(name).wait(self.coro_keep_alive[name].sleep_delay)
+
+    def pace_sync(self, name):
+        """self.pace for threads that run in the default executor"""
+        self._pacer(name).wait_sync(self.coro_keep_alive[name].sleep_delay)
+
+    def loop_stats(self):
+        """target and actual rate, skipped ticks and lateness of every paced thread""" # noqa E501
+        return {k: v.stats() for k, v in self.pacers.items()}
+
+    def pose_changed(self):
+        """
+        Mark the poses as changed, with on_change this wakes the send thread,
+        the frame goes out right away unless max_rate says otherwise.
+        Writes to the template's poses call it already, writes straight into
+        a pose store's values don't.
+
+        Safe to call from executor threads
+        """
+        self._dirty = True
+        if self._wake is not None and not self._wake.is_set():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _new_pose(self, device_class, *args, **kwargs):
+        # with on_change writing to the pose calls self.pose_changed
+        if self.on_change:
+            return TRACKED_CLASSES[device_class](
+                *args, on_change=self.pose_changed, **kwargs
+            )
+
+        return device_class(*args, **kwargs)
+
+    def _store_on_change(self):
+        # on_change of a PoseStore, see self._new_pose
+        return self.pose_changed if self.on_change else None
+
+    async def _send_on_change(self, frame):
+        """
+        Change driven send thread, see on_change in help(self.__init__)
+
+        :frame: returns the current pose frame
+        frames equal to the last one sent are skipped until a keep alive is due
+        """
+        keep = self.coro_keep_alive["send"]
+        self._loop = asyncio.get_event_loop()
+        self._wake = asyncio.Event()
+        last = None
+        t_last = float("-inf")
+        try:
+            while keep.is_alive:
+                now = time.monotonic()
+                period = 1 / self.keep_alive_rate if self.keep_alive_rate else float("inf") # noqa E501
+                due = t_last + period - now
+                if not self._dirty and due > 0:
+                    self._wake.clear()
+                    if not self._dirty:
+                        # wakes up now and then to see keep.is_alive
+                        try:
+                            await asyncio.wait_for(self._wake.wait(), min(due, 0.5)) # noqa E501
+
+                        except asyncio.TimeoutError:
+                            pass
+
+                    continue
+
+                # times come from the clock, not from summed up sleeps
+                gap = t_last + (1 / self.max_rate if self.max_rate else keep.sleep_delay) - now # noqa E501
+                if gap > 0:
+                    await asyncio.sleep(gap)
+
+                self._dirty = False
+                msg = frame()
+                if msg == last:
+                    if time.monotonic() - t_last < period:
+                        self.frames_unchanged += 1
+                        continue
+
+                    self.keep_alives += 1
+
+                await self._send_pose(msg)
+                self.frames_sent += 1
+                last = bytes(msg)
+                t_last = time.monotonic()
+
+        except Exception as e:
+            print(f"send failed: {e}")
+
+        self._wake = None
+        keep.is_alive = False
+
     async def send(self):
         """Send all poses thread, you need to implement this!"""
         raise NotImplementedError("please implement the send thread")
 
     async def _send_manager(self, byte_msg):
-        self._manager_writer.write(byte_msg + self._terminator)
-        await self._manager_writer.drain()
-        resp = await self._manager_reader.read(4)
+        """
+        Send a settings manager message and wait for the reply.
+
+        with request ids any number of these can wait at once,
+        each gets its own reply, the round trip time in seconds
+        ends up in self.manager_rtt
+
+        raises asyncio.TimeoutError if no reply came within self.manager_timeout
+        """
+        t0 = time.perf_counter()
+        if self._manager_ids:
+            rid = self._manager_next_rid
+            self._manager_next_rid = rid % 0xFFFFFFFF + 1
+            fut = asyncio.get_event_loop().create_future()
+            self._manager_pending[rid] = fut
+            try:
+                self._manager_writer.write(
+                    pack_request(rid, byte_msg + self._terminator)
+                )
+                await self._manager_writer.drain()
+                resp = await asyncio.wait_for(fut, self.manager_timeout)
+
+            finally:
+                # answered, lost or the connection is gone
+                self._manager_pending.pop(rid, None)
+
+        else:
+            self._manager_writer.write(byte_msg + self._terminator)
+            await self._manager_writer.drain()
+            resp = await asyncio.wait_for(
+                self._manager_reader.read(4), self.manager_timeout
+            )
+
+        self.manager_rtt = time.perf_counter() - t0
         return resp
 
+    async def _manager_recv(self):
+        """hands manager replies to whoever is waiting on them, request ids only"""
+        replies = ReplyReader()
+        try:
+            while 1:
+                data = await self._manager_reader.read(256)
+                if not data:
+                    break
+
+                for rid, reply in replies.feed(data):
+                    if reply == HEARTBEAT_MSG:
+                        self._manager_writer.write(HEARTBEAT_MSG)
+                        continue
+
+                    if rid is None:
+                        # a STATS report
+                        if self._manager_stats:
+                            self._manager_stats.popleft().set_result(reply)
+
+                        continue
+
+                    fut = self._manager_pending.pop(rid, None)
+                    if fut is not None and not fut.done():
+                        fut.set_result(reply)
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            print(f"manager recv failed: {e}")
+
+        for fut in [*self._manager_pending.values(), *self._manager_stats]:
+            if not fut.done():
+                fut.set_exception(ConnectionError("manager connection closed"))
+
+        self._manager_pending.clear()
+        self._manager_stats.clear()
+
+    async def _get_server_stats(self):
+        """
+        Ask the server for its metrics report over the manager connection.
+
+        returns a dict, see virtualreality.server.metrics.snapshot
+        """
+        if self._manager_ids:
+            fut = asyncio.get_event_loop().create_future()
+            self._manager_stats.append(fut)
+            self._manager_writer.write(b"STATS\n")
+            await self._manager_writer.drain()
+            try:
+                return json.loads(await asyncio.wait_for(fut, self.manager_timeout)) # noqa E501
+
+            finally:
+                if fut in self._manager_stats:
+                    self._manager_stats.remove(fut)
+
+        self._manager_writer.write(b"STATS\n")
+        await self._manager_writer.drain()
+        resp = await self._manager_reader.readline()
+        # other managers' replies might have slipped in before the report
+        return json.loads(resp[resp.index(b"{"):])
+
     async def recv(self):
         """Receive messages thread."""
         backBuffer = bytearray()
@@ -156,15 +581,35 @@ Options:
             try:
                 # data = await read3(self.reader)
                 # self.last_read = data
-                data = await self.reader.read(200)
+                if self._heartbeat_seen and self.idle_timeout:
+                    data = await asyncio.wait_for(
+                        self.reader.read(200), self.idle_timeout
+                    )
+
+                else:
+                    data = await self.reader.read(200)
+
                 backBuffer.extend(data)
 
+                if HEARTBEAT_MSG in backBuffer:
+                    backBuffer = backBuffer.replace(HEARTBEAT_MSG, b"")
+                    self._heartbeat_seen = True
+                    self.writer.write(HEARTBEAT_MSG)
+
                 while b'\n' in backBuffer:
                     self.last_read, backBuffer = backBuffer.split(
                         b'\n', 1
                     )
 
+                # driven by the reads, a Pacer would count the time spent
+                # waiting for data as overruns, see self.loop_stats
                 await asyncio.sleep(self.coro_keep_alive["recv"].sleep_delay)
+            except asyncio.TimeoutError:
+                print(f"server silent for {self.idle_timeout}s, giving up on it") # noqa E501
+                self.writer.transport.abort()
+                self.coro_keep_alive["recv"].is_alive = False
+                break
+
             except Exception as e:
                 print(f"recv failed: {e}")
                 self.coro_keep_alive["recv"].is_alive = False
@@ -192,6 +637,9 @@ override this if you want, it has to be async thread safe
                 if ret['--quit']:
                     break
 
+                if ret['--loops']:
+                    print(json.dumps(self.loop_stats(), indent=2))
+
                 for i in ret.items():
                     await self._cli_arg_map(i)
 
@@ -222,6 +670,9 @@ override this if you want, it has to be async thread safe
         except Exception as e:
             print(f"failed to close connection: {e}")
 
+        if self._manager_task is not None:
+            self._manager_task.cancel()
+
         try:
             self._manager_writer.write(format_str_for_write("CLOSE"))
             self._manager_writer.close()
@@ -230,6 +681,12 @@ override this if you want, it has to be async thread safe
         except Exception as e:
             print(f"failed to close manager connection: {e}")
 
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+
+        if self._pose_ring is not None:
+            self._pose_ring.close()
+
         print("finished")
 
     async def main(self):
@@ -254,9 +711,10 @@ override this if you want, it has to be async thread safe
         """
         Registers thread functions, should only be used on member functions
 
-        sleepDelay - sleep delay in seconds
+        sleepDelay - sleep delay in seconds, the thread's period with self.pace
         runInDefaultExecutor - bool, set True if you want the
-            function to be executed in asyncio's default pool executor
+            function to be executed in asyncio's default pool executor,
+            those use self.pace_sync
         """
 
         def _thread_reg(func):
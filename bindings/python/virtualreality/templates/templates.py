@@ -2,14 +2,14 @@
 # This code is licensed under MIT license (see LICENSE for details)
 
 """Templates for pose estimators, or posers."""
-import asyncio
 # import numbers
 # import warnings
 
 # from ..util import utilz as u
 from .template_base import *
 from .poses import *
-import struct
+from .encoder import FrameEncoder
+from .pose_store import PoseStore
 
 
 class PoserTemplate(PoserTemplateBase):
@@ -33,9 +33,7 @@ class PoserTemplate(PoserTemplateBase):
                 while self.coro_keep_alive['example_thread'].is_alive:
                     self.pose.x += 0.04
 
-                    await asyncio.sleep(
-                        self.coro_keep_alive['example_thread'].sleep_delay
-                    )
+                    await self.pace('example_thread')
 
         poser = MyPoser()
 
@@ -51,43 +49,72 @@ class PoserTemplate(PoserTemplateBase):
         :port: is the port of the server to connect to, stored in self.port
         :send_delay: sleep delay for the self.send thread(in seconds)
         :recv_delay: sleep delay for the self.recv thread(in seconds)
+        :udp: send pose frames over udp instead of tcp
+        :pose_ring: publish pose frames into a same host pose ring instead of tcp
+        :channel: server channel to join, None is the default channel
+        :socket_tuning: low latency socket options on the pose connection
+        :heartbeats: ask the server for heartbeats and answer them
+        :idle_timeout: give up on a server silent for this long, once it sent heartbeats
+        :on_change: send when the poses change, at most max_rate and at least keep_alive_rate frames per second
+        :pose_store: keep the 3 poses in one float32 array, self.pose_store, see virtualreality.templates.pose_store
+        :compact: send quantized compact frames, see virtualreality.server.compact
+        :velocity: with compact, a bool per device, False for devices that never send velocities, False for none at all
         """
+        use_pose_store = kwargs.pop("pose_store", False)
         super().__init__(**kwargs)
 
-        self.pose = Pose()
-        self.pose_controller_r = ControllerState(
-            pose=(0.5, 1, -1, 1, 0, 0, 0)
-        )
-        self.pose_controller_l = ControllerState(
-            pose=(0.5, 1.1, -1, 1, 0, 0, 0)
-        )
+        if self.compact:
+            self.id_message += self._compact_id(["h", "c", "c"])
+
+        self.pose_store = None
+        self._encoder = None
+        if use_pose_store:
+            self.pose_store = PoseStore(
+                "h c c", terminator=self._terminator,
+                on_change=self._store_on_change()
+            )
+            self.pose, self.pose_controller_r, self.pose_controller_l = self.pose_store.poses # noqa E501
+            for i, y in ((self.pose_controller_r, 1), (self.pose_controller_l, 1.1)): # noqa E501
+                i.x, i.y, i.z = 0.5, y, -1
+
+        else:
+            self.pose = self._new_pose(Pose)
+            self.pose_controller_r = self._new_pose(
+                ControllerState, pose=(0.5, 1, -1, 1, 0, 0, 0)
+            )
+            self.pose_controller_l = self._new_pose(
+                ControllerState, pose=(0.5, 1.1, -1, 1, 0, 0, 0)
+            )
+            self._encoder = FrameEncoder.for_poses(
+                (self.pose, self.pose_controller_r, self.pose_controller_l),
+                terminator=self._terminator
+            )
+
+    def _frame(self):
+        if self.pose_store is not None:
+            frame = self.pose_store.frame()
+
+        else:
+            frame = self._encoder.encode(
+                (self.pose, self.pose_controller_r, self.pose_controller_l)
+            )
+
+        if self._codec is not None:
+            return self._codec.encode_frame(frame)
+
+        return frame
 
     async def send(self):
         """Send all poses thread."""
+        if self.on_change:
+            await self._send_on_change(self._frame)
+            return
+
         while self.coro_keep_alive["send"].is_alive:
             try:
-                msg = b"".join(
-                    [
-                        struct.pack(
-                            f"{len(self.pose)}f", *self.pose.get_vals()
-                        ),
-                        struct.pack(
-                            f"{len(self.pose_controller_r)}f",
-                            *self.pose_controller_r.get_vals()
-                        ),
-                        struct.pack(
-                            f"{len(self.pose_controller_l)}f",
-                            *self.pose_controller_l.get_vals()
-                        )
-                    ]
-                ) + self._terminator
-
-                self.writer.write(msg)
-                await self.writer.drain()
-
-                await asyncio.sleep(
-                    self.coro_keep_alive["send"].sleep_delay - 0.0001
-                )
+                await self._send_pose(self._frame())
+
+                await self.pace("send")
             except Exception as e:
                 print(f"send failed: {e}")
                 break
@@ -106,7 +133,7 @@ class PoserClient(PoserTemplate, PoserClientBase):
             while poser.coro_keep_alive['lol'].is_alive:
                 poser.pose.x += 0.2
 
-                await asyncio.sleep(poser.coro_keep_alive['lol'].sleep_delay)
+                await poser.pace('lol')
 
         asyncio.run(poser.main())
 
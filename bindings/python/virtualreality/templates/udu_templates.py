@@ -4,15 +4,17 @@
 """
 Templates for pose estimators, or posers. unlimited devices upgrade version.
 """
-import asyncio
 # import numbers
 # import warnings
 
 # from ..util import utilz as u
 from .template_base import *
 from .poses import *
+from ..server.merge import pack_partial_header
+from .encoder import FrameEncoder
+from .pose_store import PoseStore
+import asyncio
 import re
-import struct
 import numpy as np
 
 
@@ -22,6 +24,8 @@ class UduPoserTemplate(PoserTemplateBase):
 
     supplies a list of poses:
         self.poses - pose objects
+        self.pose_store - all of them in one array, with pose_store=True,
+            rebuilt along with self.poses when the udu layout changes
 
     for more info: help(PoserTemplateBase)
 
@@ -35,9 +39,7 @@ class UduPoserTemplate(PoserTemplateBase):
                 while self.coro_keep_alive['example_thread'].is_alive:
                     self.poses[0].x += 0.04
 
-                    await asyncio.sleep(
-                        self.coro_keep_alive['example_thread'].sleep_delay
-                    )
+                    await self.pace('example_thread')
 
         poser = MyPoser('h c c')
 
@@ -54,7 +56,20 @@ class UduPoserTemplate(PoserTemplateBase):
         :port: is the port of the server to connect to, stored in self.port
         :send_delay: sleep delay for the self.send thread(in seconds)
         :recv_delay: sleep delay for the self.recv thread(in seconds)
+        :udp: send pose frames over udp instead of tcp
+        :pose_ring: publish pose frames into a same host pose ring instead of tcp
+        :channel: server channel to join, None is the default channel
+        :socket_tuning: low latency socket options on the pose connection
+        :heartbeats: ask the server for heartbeats and answer them
+        :idle_timeout: give up on a server silent for this long, once it sent heartbeats
+        :on_change: send when the poses change, at most max_rate and at least keep_alive_rate frames per second
+        :device_slots: slots of the server's merged layout these devices fill, one per device, see 'server --merge'
+        :pose_store: keep all poses in one float32 array, self.pose_store, see virtualreality.templates.pose_store
+        :compact: send quantized compact frames, see virtualreality.server.compact
+        :velocity: with compact, a bool per device, False for devices that never send velocities, False for none at all
         """
+        device_slots = kwargs.pop("device_slots", None)
+        use_pose_store = kwargs.pop("pose_store", False)
         super().__init__(**kwargs)
 
         re_s = re.search("([htc][ ])*([htc]$)", udu_string)
@@ -71,10 +86,10 @@ class UduPoserTemplate(PoserTemplateBase):
         new_struct = []
         for i in self.device_types:
             if i == "h" or i == "t":
-                self.poses.append(Pose())
+                self.poses.append(self._new_pose(Pose))
 
             elif i == "c":
-                self.poses.append(ControllerState())
+                self.poses.append(self._new_pose(ControllerState))
 
             new_struct.append(f"{i}{len(self.poses[-1])}")
 
@@ -87,6 +102,52 @@ class UduPoserTemplate(PoserTemplateBase):
             "full device list is now available through self.device_types, all device poses are in self.poses"  # noqa E501
         )
 
+        self.device_slots = None
+        self._partial_header = b""
+        self._use_pose_store = use_pose_store
+        self.pose_store = None
+        if device_slots is not None:
+            if self.compact:
+                raise RuntimeError("compact frames can't be partial frames")
+
+            if len(device_slots) != len(self.poses):
+                raise RuntimeError(
+                    f"{len(device_slots)} device slot(s) for {len(self.poses)} device(s)" # noqa E501
+                )
+
+            self.device_slots = list(device_slots)
+            self._partial_header = pack_partial_header(self.device_slots)
+
+        self._set_id_layout(self.device_types)
+        self._build_encoder()
+
+    def _build_encoder(self):
+        # the frame layout only changes with the udu string
+        if self._use_pose_store:
+            # the store is the frame, its views replace the plain poses
+            self.pose_store = PoseStore(
+                " ".join(self.device_types), self._partial_header, self._terminator, # noqa E501
+                self._store_on_change()
+            )
+            self.poses = self.pose_store.poses
+            self._encoder = None
+            return
+
+        self._encoder = FrameEncoder.for_poses(
+            self.poses, self._partial_header, self._terminator
+        )
+
+    def _set_id_layout(self, device_types):
+        # tell the server the frame layout, 'holla udu=h,c,c', so it can drop
+        # frames that don't fit, partial frames are checked by the merger,
+        # takes a reconnect to reach the server, see self._poser_reconnect
+        self.id_message = re.sub(r" (udu|enc|vel)=\S*", "", self.id_message)
+        if self.compact:
+            self.id_message += self._compact_id(device_types)
+
+        elif self.device_slots is None:
+            self.id_message += f" udu={','.join(device_types)}"
+
     async def _sync_udu(self, new_udu_string):
         # update own udu
         newUduString = new_udu_string
@@ -104,15 +165,28 @@ class UduPoserTemplate(PoserTemplateBase):
         new_struct = []
         for i in newUduString.split(' '):
             if i == "h" or i == "t":
-                newPoses.append(Pose())
+                newPoses.append(self._new_pose(Pose))
 
             elif i == "c":
-                newPoses.append(ControllerState())
+                newPoses.append(self._new_pose(ControllerState))
 
             new_struct.append(f"{i}{len(newPoses[-1])}")
 
         self.poses = newPoses
+        self.device_types = newUduString.split(' ')
         new_struct = " ".join(new_struct)
+        if self.device_slots is not None and len(self.device_slots) != len(self.poses): # noqa E501
+            print("device count changed, dropping device slots, sending full frames") # noqa E501
+            self.device_slots = None
+            self._partial_header = b""
+
+        # frames of the new layout wait in self._send_pose until the server
+        # knows it, the old connection would get them dropped as malformed
+        self._cutover = asyncio.Event()
+        self._set_id_layout(newUduString.split(' '))
+        self._build_encoder()
+        self.pose_changed()
+
         print(
             f"new udu settings: {repr(new_struct)}, {len(self.poses)} device(s) total" # noqa E501
         )
@@ -131,23 +205,49 @@ class UduPoserTemplate(PoserTemplateBase):
             *packet,
             *np.zeros((128 - packet.shape[0], ), dtype=np.uint32)
         )
-        resp = await self._send_manager(data)
+        try:
+            try:
+                resp = await self._send_manager(data)
+
+            except asyncio.TimeoutError:
+                # the driver didn't answer, the server still has to know
+                print("no reply to the new udu settings")
+                resp = None
+
+            # the server took the old layout from the id message, it only
+            # reads a new one from a new connection
+            await self._poser_reconnect()
+
+        finally:
+            self._cutover.set()
+            self._cutover = None
+
         return resp
 
+    def _frame(self):
+        if self.pose_store is not None:
+            frame = self.pose_store.frame()
+
+        else:
+            frame = self._encoder.encode(self.poses)
+
+        if self._codec is not None:
+            return self._codec.encode_frame(frame)
+
+        return frame
+
     async def send(self):
         """Send all poses thread."""
+        if self.on_change:
+            await self._send_on_change(self._frame)
+            return
+
         while self.coro_keep_alive["send"].is_alive:
             try:
-                msg = b"".join(
-                    [struct.pack(f"{len(i)}f", *i.get_vals()) for i in self.poses] # noqa E501
-                ) + self._terminator
-                self.writer.write(msg)
-                await self.writer.drain()
+                await self._send_pose(self._frame())
                 # print('written and drained')
 
-                await asyncio.sleep(
-                    self.coro_keep_alive["send"].sleep_delay - 0.0001
-                )
+                await self.pace("send")
             except Exception as e:
                 print(f"send failed: {e}")
                 break
@@ -166,7 +266,7 @@ class UduPoserClient(UduPoserTemplate, PoserClientBase):
             while poser.coro_keep_alive['lol'].is_alive:
                 poser.poses[0].x += 0.2
 
-                await asyncio.sleep(poser.coro_keep_alive['lol'].sleep_delay)
+                await poser.pace('lol')
 
         asyncio.run(poser.main())
 
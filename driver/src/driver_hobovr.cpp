@@ -58,6 +58,9 @@ namespace hobovr {
 // driver keys
 static const char *const k_pch_Hobovr_Section = "driver_hobovr";
 static const char *const k_pch_Hobovr_UduDeviceManifestList_String = "uduSettings";
+static const char *const k_pch_Hobovr_UdpPoseTransport_Bool = "UdpPoseTransport";
+static const char *const k_pch_Hobovr_PoseRingPath_String = "PoseRingPath";
+static const char *const k_pch_Hobovr_Channel_String = "Channel";
 
 // hmd device keys
 static const char *const k_pch_Hmd_Section = "hobovr_device_hmd";
@@ -762,7 +765,19 @@ public:
 		// manager stuff
 		try {
 			m_pSocketComm = std::make_shared<SockReceiver::DriverReceiver>("h520");
+			// plain id, old servers know no other, newer ones learn this is
+			// the driver from its replies and send settings requests here only
 			m_pSocketComm->m_sIdMessage = "monky\n";
+
+			// same channel as the pose receiver
+			char buf[256];
+			vr::VRSettings()->GetString(
+				k_pch_Hobovr_Section,
+				k_pch_Hobovr_Channel_String,
+				buf,
+				sizeof(buf)
+			);
+			m_pSocketComm->m_sChannel = buf;
 			m_pSocketComm->start();
 		} catch (...) {
 			DriverLog("tracking reference: couldn't connect to the server");
@@ -1191,6 +1206,32 @@ EVRInitError CServerDriver_hobovr::Init(vr::IVRDriverContext *pDriverContext) {
 	// udu setting parse is done by SockReceiver
 	try{
 		m_pSocketComm = std::make_shared<SockReceiver::DriverReceiver>(uduThing);
+		// poses over udp, the settings manager stays on tcp
+		m_pSocketComm->m_bUdp = vr::VRSettings()->GetBool(
+			k_pch_Hobovr_Section,
+			k_pch_Hobovr_UdpPoseTransport_Bool
+		);
+		DriverLog("driver: udp pose transport: %d\n", m_pSocketComm->m_bUdp);
+
+		// same host posers can skip the server, empty means off
+		vr::VRSettings()->GetString(
+			k_pch_Hobovr_Section,
+			k_pch_Hobovr_PoseRingPath_String,
+			buf,
+			sizeof(buf)
+		);
+		m_pSocketComm->m_sPoseRingPath = buf;
+		DriverLog("driver: pose ring: '%s'\n", buf);
+
+		// one server can serve many setups, empty is the default channel
+		vr::VRSettings()->GetString(
+			k_pch_Hobovr_Section,
+			k_pch_Hobovr_Channel_String,
+			buf,
+			sizeof(buf)
+		);
+		m_pSocketComm->m_sChannel = buf;
+		DriverLog("driver: channel: '%s'\n", buf);
 		m_pSocketComm->start();
 
 	} catch (...){
@@ -28,6 +28,11 @@
 #include <sys/socket.h>
 // #include <netinet/in.h>
 #include <netdb.h> 
+#include <errno.h>
+#include <sys/time.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
 
 #define SOCKET char //needed for a type check to be possible
 #include "util.h"
@@ -40,6 +45,9 @@ namespace SockReceiver {
     std::vector<int> m_viEps;
     int m_iExpectedMessageSize;
     std::string m_sIdMessage = "hello\n";
+    bool m_bUdp = false; // receive poses as datagrams, set before start()
+    std::string m_sPoseRingPath; // read poses from a same host pose ring file instead, set before start()
+    std::string m_sChannel; // server channel to join, empty is the default channel, set before start()
 
     DriverReceiver(std::string expected_pose_struct, int port=6969, std::string addr="127.0.01") {
       std::regex rgx("[htc]");
@@ -91,6 +99,8 @@ namespace SockReceiver {
 #endif
           throw std::runtime_error("connection error");
       }
+
+      m_ServAddr = serv_addr; // for the udp socket
     }
 
     ~DriverReceiver() {
@@ -99,6 +109,22 @@ namespace SockReceiver {
 
      void start() {
       m_bThreadKeepAlive = true;
+
+      if (!m_sPoseRingPath.empty()) {
+        // the tcp connection stays for send2, poses come from the ring
+        m_sIdMessage = "hello_ring\n";
+
+      } else if (m_bUdp) {
+        // the tcp connection stays for send2, poses come in over udp
+        this->udp_init();
+        m_sIdMessage = "hello_udp\n";
+      }
+
+      if (!m_sChannel.empty() && m_sIdMessage.find(" channel=") == std::string::npos) {
+        // 'hello\n' -> 'hello channel=rig1\n'
+        m_sIdMessage.insert(m_sIdMessage.size() - 1, " channel=" + m_sChannel);
+      }
+
       this->send2(m_sIdMessage.c_str());
 
       this->m_pMyTread = new std::thread(this->my_thread_enter, this);
@@ -126,6 +152,13 @@ namespace SockReceiver {
     }
 
     void close_me() {
+      if (m_iUdpSocketObject > 0) {
+        this->send_dgram(Edgram_unsubscribe);
+        close(m_iUdpSocketObject);
+      }
+
+      m_iUdpSocketObject = 0;
+
       if (m_pSocketObject) {
         this->send2("CLOSE\n");
         close(m_pSocketObject);
@@ -173,12 +206,185 @@ namespace SockReceiver {
     Callback* m_pCallback = nullptr;
 
     int m_pSocketObject;
+    int m_iUdpSocketObject = 0;
+    uint32_t m_unUdpSeq = 0;
+    struct sockaddr_in m_ServAddr;
 
     static void my_thread_enter(DriverReceiver *ptr) {
       ptr->my_thread();
     }
 
+    void udp_init() {
+      m_iUdpSocketObject = socket(AF_INET, SOCK_DGRAM, 0);
+
+      if (m_iUdpSocketObject < 0) {
+#ifdef DRIVERLOG_H
+          DriverLog("receiver opening udp socket error");
+#endif
+          m_iUdpSocketObject = 0;
+          throw std::runtime_error("failed to open udp socket");
+      }
+
+      // connected udp socket, only talks to the server
+      if (connect(m_iUdpSocketObject, (struct sockaddr *) &m_ServAddr, sizeof(m_ServAddr)) < 0) {
+#ifdef DRIVERLOG_H
+          DriverLog("receiver failed to connect udp socket");
+#endif
+          throw std::runtime_error("udp connection error");
+      }
+
+      // wake up every second to renew the subscription
+      struct timeval tv;
+      tv.tv_sec = 1;
+      tv.tv_usec = 0;
+      setsockopt(m_iUdpSocketObject, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+
+      this->send_dgram(Edgram_subscribe);
+    }
+
+    int send_dgram(uint8_t kind) {
+      char buf[sizeof(DgramHeader_t)];
+      int len = make_dgram_header(buf, kind, m_unUdpSeq++);
+      return send(m_iUdpSocketObject, buf, len, 0);
+    }
+
+    void my_udp_thread() {
+      char* l_cpRecvBuffer = new char[k_iMaxDgramSize];
+      SequenceFilter l_Filter;
+      auto l_LastSub = std::chrono::steady_clock::now();
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver udp thread started\n");
+    #endif
+
+      while (m_bThreadKeepAlive) {
+        // subscriptions expire on the server, keep renewing
+        auto now = std::chrono::steady_clock::now();
+        if (now - l_LastSub > std::chrono::seconds(1)) {
+          this->send_dgram(Edgram_subscribe);
+          l_LastSub = now;
+        }
+
+        int msglen = recv(m_iUdpSocketObject, l_cpRecvBuffer, k_iMaxDgramSize, 0);
+
+        if (msglen < 0) {
+          if (errno == EAGAIN || errno == EWOULDBLOCK || errno == EINTR) continue;
+          break;
+        }
+
+        if (msglen < (int)sizeof(DgramHeader_t)) continue;
+
+        DgramHeader_t* h = (DgramHeader_t*)l_cpRecvBuffer;
+        if (h->magic[0] != 'h' || h->magic[1] != 'v' || h->kind != Edgram_pose) continue;
+
+        if (!l_Filter.accept(h->seq)) continue;
+
+        if (m_pCallback != nullptr)
+          m_pCallback->OnPacket(l_cpRecvBuffer + sizeof(DgramHeader_t), msglen - (int)sizeof(DgramHeader_t));
+      }
+      delete[] l_cpRecvBuffer;
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver udp thread ended, %u stale datagrams dropped\n", l_Filter.m_unDropped);
+    #endif
+      m_bThreadKeepAlive = false;
+    }
+
+    // maps the ring file read only, returns nullptr if its not there(yet)
+    char* ring_map(size_t& ringSize, ino_t& ringIno) {
+      int fd = open(m_sPoseRingPath.c_str(), O_RDONLY);
+      if (fd < 0) return nullptr;
+
+      struct stat st;
+      if (fstat(fd, &st) < 0) {
+        close(fd);
+        return nullptr;
+      }
+
+      void* p = mmap(nullptr, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+      close(fd);
+      if (p == MAP_FAILED) return nullptr;
+
+      if (!pose_ring_valid((char*)p, st.st_size)) {
+        munmap(p, st.st_size);
+        return nullptr;
+      }
+
+      ringSize = st.st_size;
+      ringIno = st.st_ino;
+      return (char*)p;
+    }
+
+    void my_ring_thread() {
+      char* l_cpRecvBuffer = new char[k_iMaxDgramSize];
+      char* l_pRing = nullptr;
+      size_t l_uRingSize = 0;
+      ino_t l_RingIno = 0;
+      uint64_t l_ulLastSeq = 0;
+      auto l_LastNew = std::chrono::steady_clock::now();
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver ring thread started, ring: '%s'\n", m_sPoseRingPath.c_str());
+    #endif
+
+      while (m_bThreadKeepAlive) {
+        if (l_pRing == nullptr) {
+          l_pRing = this->ring_map(l_uRingSize, l_RingIno);
+          if (l_pRing == nullptr) {
+            std::this_thread::sleep_for(std::chrono::milliseconds(500));
+            continue;
+          }
+          l_ulLastSeq = 0;
+          l_LastNew = std::chrono::steady_clock::now();
+        }
+
+        int msglen = pose_ring_read_latest(l_pRing, l_cpRecvBuffer, k_iMaxDgramSize, l_ulLastSeq);
+
+        if (msglen > 0) {
+          l_LastNew = std::chrono::steady_clock::now();
+          if (m_pCallback != nullptr)
+            m_pCallback->OnPacket(l_cpRecvBuffer, msglen);
+
+          continue;
+        }
+
+        // the poser swaps in a new file when the ring layout changes
+        auto now = std::chrono::steady_clock::now();
+        if (now - l_LastNew > std::chrono::seconds(1)) {
+          struct stat st;
+          if (stat(m_sPoseRingPath.c_str(), &st) == 0 && st.st_ino != l_RingIno) {
+            munmap(l_pRing, l_uRingSize);
+            l_pRing = nullptr;
+            continue;
+          }
+          l_LastNew = now;
+        }
+
+        std::this_thread::sleep_for(std::chrono::microseconds(500));
+      }
+
+      if (l_pRing != nullptr)
+        munmap(l_pRing, l_uRingSize);
+
+      delete[] l_cpRecvBuffer;
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver ring thread ended\n");
+    #endif
+      m_bThreadKeepAlive = false;
+    }
+
     void my_thread() {
+      if (!m_sPoseRingPath.empty()) {
+        this->my_ring_thread();
+        return;
+      }
+
+      if (m_bUdp) {
+        this->my_udp_thread();
+        return;
+      }
+
       while (m_bThreadKeepAlive){
         m_bThreadReset = false;
         int numbit = 0, msglen;
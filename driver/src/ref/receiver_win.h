@@ -40,6 +40,9 @@ namespace SockReceiver {
     std::vector<int> m_viEps;
     int m_iExpectedMessageSize;
     std::string m_sIdMessage = "hello\n";
+    bool m_bUdp = false; // receive poses as datagrams, set before start()
+    std::string m_sPoseRingPath; // read poses from a same host pose ring file instead, set before start()
+    std::string m_sChannel; // server channel to join, empty is the default channel, set before start()
 
     DriverReceiver(std::string expected_pose_struct, int port=6969) {
       std::regex rgx("[htc]");
@@ -102,6 +105,7 @@ namespace SockReceiver {
         throw std::runtime_error("failed to connect");
       }
 
+      m_AddrDetails = addrDetails; // for the udp socket
     }
 
     ~DriverReceiver() {
@@ -110,6 +114,22 @@ namespace SockReceiver {
 
     void start() {
       m_bThreadKeepAlive = true;
+
+      if (!m_sPoseRingPath.empty()) {
+        // the tcp connection stays for send2, poses come from the ring
+        m_sIdMessage = "hello_ring\n";
+
+      } else if (m_bUdp) {
+        // the tcp connection stays for send2, poses come in over udp
+        udp_init();
+        m_sIdMessage = "hello_udp\n";
+      }
+
+      if (!m_sChannel.empty() && m_sIdMessage.find(" channel=") == std::string::npos) {
+        // 'hello\n' -> 'hello channel=rig1\n'
+        m_sIdMessage.insert(m_sIdMessage.size() - 1, " channel=" + m_sChannel);
+      }
+
       this->send2(m_sIdMessage.c_str());
 
       m_pMyTread = new std::thread(my_thread_enter, this);
@@ -137,6 +157,13 @@ namespace SockReceiver {
     }
 
     void close() {
+      if (m_pUdpSocketObject != INVALID_SOCKET) {
+        send_dgram(Edgram_unsubscribe);
+        closesocket(m_pUdpSocketObject);
+      }
+
+      m_pUdpSocketObject = INVALID_SOCKET;
+
       if (m_pSocketObject != NULL) {
         int res = send2("CLOSE\n");
         res = closesocket(m_pSocketObject);
@@ -189,6 +216,9 @@ namespace SockReceiver {
     bool m_bThreadReset = false;
 
     SOCKET m_pSocketObject;
+    SOCKET m_pUdpSocketObject = INVALID_SOCKET;
+    uint32_t m_unUdpSeq = 0;
+    sockaddr_in m_AddrDetails;
 
     Callback* m_pCallback = nullptr;
 
@@ -196,7 +226,175 @@ namespace SockReceiver {
       ptr->my_thread();
     }
 
+    void udp_init() {
+      m_pUdpSocketObject = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
+
+      if (m_pUdpSocketObject == INVALID_SOCKET) {
+#ifdef DRIVERLOG_H
+        DriverLog("receiver udp create error: %d\n", WSAGetLastError());
+#endif
+        throw std::runtime_error("failed to create udp socket");
+      }
+
+      // connected udp socket, only talks to the server
+      if (connect(m_pUdpSocketObject, (SOCKADDR *) & m_AddrDetails, sizeof (m_AddrDetails)) == SOCKET_ERROR) {
+#ifdef DRIVERLOG_H
+        DriverLog("receiver udp connect error: %d\n", WSAGetLastError());
+#endif
+        closesocket(m_pUdpSocketObject);
+        m_pUdpSocketObject = INVALID_SOCKET;
+        throw std::runtime_error("failed to connect udp socket");
+      }
+
+      // wake up every second to renew the subscription
+      DWORD timeout = 1000;
+      setsockopt(m_pUdpSocketObject, SOL_SOCKET, SO_RCVTIMEO, (const char*)&timeout, sizeof(timeout));
+
+      send_dgram(Edgram_subscribe);
+    }
+
+    int send_dgram(uint8_t kind) {
+      char buf[sizeof(DgramHeader_t)];
+      int len = make_dgram_header(buf, kind, m_unUdpSeq++);
+      return send(m_pUdpSocketObject, buf, len, 0);
+    }
+
+    void my_udp_thread() {
+      char* l_cpRecvBuffer = new char[k_iMaxDgramSize];
+      SequenceFilter l_Filter;
+      auto l_LastSub = std::chrono::steady_clock::now();
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver udp thread started\n");
+    #endif
+
+      while (m_bThreadKeepAlive) {
+        // subscriptions expire on the server, keep renewing
+        auto now = std::chrono::steady_clock::now();
+        if (now - l_LastSub > std::chrono::seconds(1)) {
+          send_dgram(Edgram_subscribe);
+          l_LastSub = now;
+        }
+
+        int msglen = recv(m_pUdpSocketObject, l_cpRecvBuffer, k_iMaxDgramSize, 0);
+
+        if (msglen == SOCKET_ERROR) {
+          int err = WSAGetLastError();
+          // WSAECONNRESET is an icmp port unreachable from a previous send, server not up yet
+          if (err == WSAETIMEDOUT || err == WSAECONNRESET) continue;
+          break;
+        }
+
+        if (msglen < (int)sizeof(DgramHeader_t)) continue;
+
+        DgramHeader_t* h = (DgramHeader_t*)l_cpRecvBuffer;
+        if (h->magic[0] != 'h' || h->magic[1] != 'v' || h->kind != Edgram_pose) continue;
+
+        if (!l_Filter.accept(h->seq)) continue;
+
+        if (m_pCallback != nullptr)
+          m_pCallback->OnPacket(l_cpRecvBuffer + sizeof(DgramHeader_t), msglen - (int)sizeof(DgramHeader_t));
+      }
+      delete[] l_cpRecvBuffer;
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver udp thread ended, %u stale datagrams dropped\n", l_Filter.m_unDropped);
+    #endif
+      m_bThreadKeepAlive = false;
+    }
+
+    // maps the ring file read only, returns nullptr if its not there(yet)
+    char* ring_map(size_t& ringSize) {
+      HANDLE hFile = CreateFileA(
+        m_sPoseRingPath.c_str(),
+        GENERIC_READ,
+        FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+        NULL,
+        OPEN_EXISTING,
+        FILE_ATTRIBUTE_NORMAL,
+        NULL
+      );
+      if (hFile == INVALID_HANDLE_VALUE) return nullptr;
+
+      LARGE_INTEGER size;
+      if (!GetFileSizeEx(hFile, &size) || size.QuadPart == 0) {
+        CloseHandle(hFile);
+        return nullptr;
+      }
+
+      HANDLE hMapping = CreateFileMappingA(hFile, NULL, PAGE_READONLY, 0, 0, NULL);
+      CloseHandle(hFile);
+      if (hMapping == NULL) return nullptr;
+
+      // the view keeps the mapping alive
+      void* p = MapViewOfFile(hMapping, FILE_MAP_READ, 0, 0, 0);
+      CloseHandle(hMapping);
+      if (p == NULL) return nullptr;
+
+      if (!pose_ring_valid((char*)p, (size_t)size.QuadPart)) {
+        UnmapViewOfFile(p);
+        return nullptr;
+      }
+
+      ringSize = (size_t)size.QuadPart;
+      return (char*)p;
+    }
+
+    void my_ring_thread() {
+      char* l_cpRecvBuffer = new char[k_iMaxDgramSize];
+      char* l_pRing = nullptr;
+      size_t l_uRingSize = 0;
+      uint64_t l_ulLastSeq = 0;
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver ring thread started, ring: '%s'\n", m_sPoseRingPath.c_str());
+    #endif
+
+      while (m_bThreadKeepAlive) {
+        if (l_pRing == nullptr) {
+          l_pRing = ring_map(l_uRingSize);
+          if (l_pRing == nullptr) {
+            std::this_thread::sleep_for(std::chrono::milliseconds(500));
+            continue;
+          }
+          l_ulLastSeq = 0;
+        }
+
+        // a mapped file can't be replaced on windows, no need to watch for that here
+        int msglen = pose_ring_read_latest(l_pRing, l_cpRecvBuffer, k_iMaxDgramSize, l_ulLastSeq);
+
+        if (msglen > 0) {
+          if (m_pCallback != nullptr)
+            m_pCallback->OnPacket(l_cpRecvBuffer, msglen);
+
+          continue;
+        }
+
+        std::this_thread::sleep_for(std::chrono::microseconds(500));
+      }
+
+      if (l_pRing != nullptr)
+        UnmapViewOfFile(l_pRing);
+
+      delete[] l_cpRecvBuffer;
+
+    #ifdef DRIVERLOG_H
+          DriverLog("receiver ring thread ended\n");
+    #endif
+      m_bThreadKeepAlive = false;
+    }
+
     void my_thread() {
+      if (!m_sPoseRingPath.empty()) {
+        my_ring_thread();
+        return;
+      }
+
+      if (m_bUdp) {
+        my_udp_thread();
+        return;
+      }
+
       while (m_bThreadKeepAlive){
         m_bThreadReset = false;
         int numbit = 0, msglen;
@@ -11,6 +11,9 @@
 #include <regex>
 #include <string>
 #include <sstream>
+#include <cstdint>
+#include <cstring>
+#include <atomic>
 
 namespace SockReceiver {
   //can receive packets ending with \t\r\n using either winsock2 or unix sockets
@@ -173,6 +176,123 @@ namespace SockReceiver {
     return false;
   }
 
+  // datagram pose transport, matches virtualreality/server/udp.py
+#pragma pack(push, 1)
+  struct DgramHeader_t {
+    char magic[2]; // always "hv"
+    uint8_t kind; // EDgramKind
+    uint8_t pad;
+    uint32_t seq; // per sender sequence number
+  };
+#pragma pack(pop)
+
+  enum EDgramKind {
+    Edgram_pose = 0,
+    Edgram_subscribe = 1,
+    Edgram_unsubscribe = 2,
+  };
+
+  static const int k_iMaxDgramSize = 65536;
+  // a sequence number this far behind the last one means the sender restarted
+  static const uint32_t k_unDgramSeqResetWindow = 1024;
+
+  // fills a header, returns its size
+  int make_dgram_header(char* buf, uint8_t kind, uint32_t seq)
+  {
+    DgramHeader_t* h = (DgramHeader_t*)buf;
+    h->magic[0] = 'h';
+    h->magic[1] = 'v';
+    h->kind = kind;
+    h->pad = 0;
+    h->seq = seq;
+    return (int)sizeof(DgramHeader_t);
+  }
+
+  // drops out of order and stale datagrams
+  class SequenceFilter {
+  public:
+    uint32_t m_unDropped = 0;
+
+    bool accept(uint32_t seq) {
+      uint32_t ahead = seq - m_unLast;
+      uint32_t behind = m_unLast - seq;
+
+      if (!m_bHasLast || (ahead != 0 && ahead < 0x80000000u) || behind > k_unDgramSeqResetWindow) {
+        m_bHasLast = true;
+        m_unLast = seq;
+        return true;
+      }
+
+      m_unDropped++;
+      return false;
+    }
+
+  private:
+    bool m_bHasLast = false;
+    uint32_t m_unLast = 0;
+  };
+
+  // same host pose ring, matches virtualreality/server/ring.py
+#pragma pack(push, 1)
+  struct PoseRingHeader_t {
+    char magic[8];
+    uint32_t slotSize; // max frame size
+    uint32_t slotCount;
+    uint64_t writeSeq; // sequence number of the newest frame, 0 if none yet
+    char pad[40];
+  };
+
+  struct PoseRingSlotHeader_t {
+    uint64_t seq; // sequence number of the frame in this slot, 0 while being written
+    uint32_t len;
+    uint32_t pad;
+  };
+#pragma pack(pop)
+
+  static const char k_pchPoseRingMagic[8] = {'h', 'v', 'r', 'i', 'n', 'g', '\0', '\1'};
+
+  bool pose_ring_valid(const char* ring, size_t ringSize)
+  {
+    if (ringSize < sizeof(PoseRingHeader_t) || memcmp(ring, k_pchPoseRingMagic, 8) != 0)
+      return false;
+
+    const PoseRingHeader_t* h = (const PoseRingHeader_t*)ring;
+    return h->slotCount > 0 && sizeof(PoseRingHeader_t) + (size_t)h->slotCount * (sizeof(PoseRingSlotHeader_t) + h->slotSize) <= ringSize;
+  }
+
+  // copies the newest frame into buf if it's not lastSeq
+  // returns the frame length, 0 if there is nothing new or the frame got overwritten while copying
+  int pose_ring_read_latest(const char* ring, char* buf, int bufSize, uint64_t& lastSeq)
+  {
+    const volatile PoseRingHeader_t* h = (const volatile PoseRingHeader_t*)ring;
+    uint64_t seq = h->writeSeq;
+    std::atomic_thread_fence(std::memory_order_acquire);
+
+    if (seq == 0 || seq == lastSeq)
+      return 0;
+
+    uint32_t slotSize = h->slotSize;
+    const char* slot = ring + sizeof(PoseRingHeader_t) + ((seq - 1) % h->slotCount) * (sizeof(PoseRingSlotHeader_t) + slotSize);
+    const volatile PoseRingSlotHeader_t* sh = (const volatile PoseRingSlotHeader_t*)slot;
+
+    if (sh->seq != seq)
+      return 0;
+
+    std::atomic_thread_fence(std::memory_order_acquire);
+    uint32_t len = sh->len;
+    if (len > slotSize || (int)len > bufSize)
+      return 0;
+
+    memcpy(buf, slot + sizeof(PoseRingSlotHeader_t), len);
+    std::atomic_thread_fence(std::memory_order_acquire);
+
+    if (sh->seq != seq)
+      return 0;
+
+    lastSeq = seq;
+    return (int)len;
+  }
+
   class Callback {
   public:
     virtual void OnPacket(char* buff, int len) = 0;